@@ -0,0 +1,180 @@
+#
+#   SondeHub APRS Gateway - Adaptive APRS-IS Server-side Filter
+#
+#   Rather than receiving every position report on APRS-IS (t/p), we only ask
+#   for balloon-symbol positions, chase-car packets, and packets from the
+#   iGates which have recently relayed balloons (so we have their positions
+#   for listener uploads). The iGate list is learnt from the balloon packets
+#   themselves, and the filter is re-sent on the open connection when it changes.
+#   The gateway can also add the balloons, to receive their telemetry packets.
+#   These are kept in a separate list, with its own share of the filter, so
+#   that they never push out iGates.
+#
+#   APRS-IS has no way to add to an existing filter, so each update re-sends
+#   the whole filter. Updates are rate limited, and the lists are limited to
+#   the most recently active that fit within max_length.
+#
+import logging
+import re
+import threading
+import time
+
+# Balloon symbol (primary table 'O'), and packets via the SHUB chase-car path aliases.
+DEFAULT_BASE_FILTER = "s/O d/SHUB/SHUB1-1"
+
+# Characters allowed in callsigns added to the filter.
+_VALID_CALLSIGN = re.compile(r'^[A-Za-z0-9]{1,9}(-[A-Za-z0-9]{1,2})?$')
+
+
+class AdaptiveFilter(object):
+    """
+    Maintains a server-side filter of a base filter, plus buddy lists (b/)
+    of recently active iGates, and of recently active balloons.
+    """
+
+    # Columns of the rows returned by snapshot(), for saving state across restarts.
+    SNAPSHOT_COLUMNS = ('callsign', 'seen')
+
+    def __init__(self, base_filter=DEFAULT_BASE_FILTER, ttl=24*3600, max_length=900, balloon_max_length=200, update_interval=60, clock=time.time):
+        """
+        base_filter: Filter which is always applied.
+        ttl: Time (seconds) an iGate or balloon stays in the filter after it was last seen.
+        max_length: Maximum length of the complete filter string.
+        balloon_max_length: Maximum length of the balloon list within max_length. The iGate list
+                            can use the rest. 0 disables adding balloons.
+        update_interval: Minimum time (seconds) between filter updates sent to the server.
+        clock: Function returning the current time.
+        """
+        self.base_filter = base_filter
+        self.ttl = ttl
+        self.max_length = max_length
+        self.balloon_max_length = balloon_max_length
+        self.update_interval = update_interval
+        self.clock = clock
+
+        self.updates_sent = 0
+        self.igates_in_filter = 0
+        self.balloons_in_filter = 0
+
+        # callsign -> last time it relayed a balloon. Insertion order is least -> most recently seen.
+        self._igates = {}
+        # callsign -> last time a packet from the balloon was uploaded, in the same order.
+        self._balloons = {}
+        self._current = None
+        self._last_update = None
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()
+
+    def add(self, callsign):
+        """ Note that callsign has relayed a balloon packet. """
+        self._add(self._igates, callsign)
+
+    def add_balloon(self, callsign):
+        """ Note that a packet from balloon callsign has been uploaded, to receive its other packets (e.g. telemetry). """
+        if self.balloon_max_length > 0:
+            self._add(self._balloons, callsign)
+
+    def _add(self, entries, callsign):
+        _callsign = callsign.rstrip('*').upper()
+        if not _VALID_CALLSIGN.match(_callsign):
+            return
+        with self._lock:
+            entries.pop(_callsign, None)
+            entries[_callsign] = self.clock()
+
+    def igates(self):
+        """ Return the known iGates, most recently seen first. """
+        with self._lock:
+            return list(reversed(self._igates))
+
+    def balloons(self):
+        """ Return the known balloons, most recently seen first. """
+        with self._lock:
+            return list(reversed(self._balloons))
+
+    def filter_string(self):
+        """
+        Build the filter, expiring old iGates and balloons, and including as many of the most
+        recent balloons as fit within balloon_max_length, then as many iGates as fit in the rest.
+        """
+        with self._lock:
+            _cutoff = self.clock() - self.ttl
+            for _entries in (self._igates, self._balloons):
+                for _callsign, _seen in list(_entries.items()):
+                    if _seen >= _cutoff:
+                        break
+                    del _entries[_callsign]
+
+            _balloons = self._fit(self._balloons, self.balloon_max_length)
+            _balloons_length = len(" b/" + "/".join(_balloons)) if _balloons else 0
+            _igates = self._fit(self._igates, self.max_length - len(self.base_filter) - _balloons_length)
+            self.igates_in_filter = len(_igates)
+            self.balloons_in_filter = len(_balloons)
+
+        # Sorted, so the filter only changes when the set of iGates or balloons does.
+        _filter = self.base_filter
+        for _included in (_igates, _balloons):
+            if _included:
+                _filter += " b/" + "/".join(sorted(_included))
+        return _filter
+
+    @staticmethod
+    def _fit(entries, max_length):
+        """ Return the most recently seen callsigns of entries which fit in a ' b/...' list of at most max_length. Must hold the lock. """
+        _length = len(" b")
+        _included = []
+        for _callsign in reversed(entries):
+            if _length + len(_callsign) + 1 > max_length:
+                break
+            _included.append(_callsign)
+            _length += len(_callsign) + 1
+        return _included
+
+    def snapshot(self):
+        """ Return the known iGates (not balloons) as a list of rows (see SNAPSHOT_COLUMNS). """
+        with self._lock:
+            return list(self._igates.items())
+
+    def restore(self, rows):
+        """ Load iGates from snapshot() rows, skipping any which have expired. Returns the number loaded. """
+        _cutoff = self.clock() - self.ttl
+        with self._lock:
+            _restored = [
+                (_callsign, _seen) for (_callsign, _seen) in sorted(rows, key=lambda _row: _row[1])
+                if _seen >= _cutoff and _callsign not in self._igates
+            ]
+            # Before any iGates seen since starting up, keeping the least -> most recently seen order.
+            self._igates = dict(_restored + list(self._igates.items()))
+        return len(_restored)
+
+    def apply(self, ais, force=False):
+        """
+        Send the filter to the APRS-IS connection (aprslib.IS) if it has changed,
+        at most once every update_interval seconds. If force is True, the filter is
+        always set. If not connected, aprslib sends the filter when logging in.
+        """
+        with self._apply_lock:
+            _now = self.clock()
+            if not force and self._last_update is not None and _now - self._last_update < self.update_interval:
+                return
+            self._last_update = _now
+
+            _filter = self.filter_string()
+            if _filter == self._current and not force:
+                return
+            self._current = _filter
+
+        self.updates_sent += 1
+        logging.info("Setting APRS-IS filter to: %s", _filter)
+        ais.set_filter(_filter)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "igates": len(self._igates),
+                "igates_in_filter": self.igates_in_filter,
+                "balloons": len(self._balloons),
+                "balloons_in_filter": self.balloons_in_filter,
+                "updates_sent": self.updates_sent,
+                "filter_length": len(self._current) if self._current else 0,
+            }
@@ -0,0 +1,331 @@
+#
+#   SondeHub APRS Gateway - APRS Telemetry Packets
+#
+#   Decodes APRS telemetry (APRS 1.01 chapter 13): T# frames of up to five
+#   analog values and eight digital bits, and the PARM, UNIT, EQNS and BITS
+#   messages which give a station's channel names, units, scaling equations
+#   and bit senses.
+#
+#   Definition messages are parsed once, when received, and kept per station.
+#   Frames are only stored when received, and decoded when the next payload
+#   from the station is uploaded, with whatever definitions have arrived by
+#   then - raw values and default channel names (a1-a5) if none have.
+#
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+DEFINITION_TYPES = ("PARM", "UNIT", "EQNS", "BITS")
+
+ANALOG_CHANNELS = 5
+DIGITAL_CHANNELS = 8
+# Names of channels which have not been named by a PARM message.
+DEFAULT_KEYS = tuple(f"a{_i + 1}" for _i in range(ANALOG_CHANNELS)) + tuple(f"b{_i + 1}" for _i in range(DIGITAL_CHANNELS))
+# Scaling equation (a, b, c) of channels without an EQNS message - value = a*x^2 + b*x + c.
+DEFAULT_EQUATION = (0.0, 1.0, 0.0)
+
+# Characters not allowed in the payload field names made from channel names.
+_KEY_INVALID = re.compile(r'[^a-z0-9]+')
+
+
+def channel_key(name, default):
+    """ Payload field name for a channel named name (e.g. 'Batt V' -> 'batt_v'), or default if it has no usable name. """
+    _key = _KEY_INVALID.sub('_', name.lower()).strip('_')
+    return _key if _key else default
+
+
+class StationTelemetry(object):
+    """
+    The telemetry definitions and last frame of a station.
+
+    definitions: Dict of definition type (e.g. 'PARM') -> text of the last message of that type.
+    keys: Payload field name of each channel, from the PARM message.
+    units: Unit of each channel, from the UNIT message.
+    equations: (a, b, c) scaling equation of each analog channel, from the EQNS message.
+    bits: Sense ('1' or '0') of each digital channel, from the BITS message.
+    project: Project title, from the BITS message.
+    frame: Text of the last frame (after 'T#') which has not been uploaded yet, or None.
+    frame_time: Time the frame was received.
+    last_frame: Text of the last frame received, to ignore copies via other iGates.
+    attached: (packet, values) of the last upload the frame's values were attached to.
+    updated: Time anything was last received from (or for) the station.
+    """
+    __slots__ = ('definitions', 'keys', 'units', 'equations', 'bits', 'project', 'frame', 'frame_time', 'last_frame', 'attached', 'updated')
+
+    def __init__(self, updated=None):
+        self.definitions = {}
+        self.keys = DEFAULT_KEYS
+        self.units = ("",) * (ANALOG_CHANNELS + DIGITAL_CHANNELS)
+        self.equations = (DEFAULT_EQUATION,) * ANALOG_CHANNELS
+        self.bits = "1" * DIGITAL_CHANNELS
+        self.project = None
+        self.frame = None
+        self.frame_time = None
+        self.last_frame = None
+        self.attached = None
+        self.updated = updated
+
+    def define(self, definition_type, text):
+        """
+        Apply a definition message (type e.g. 'PARM', and the text after 'PARM.').
+        Raises ValueError if it is invalid, leaving the previous definition in place.
+        """
+        _fields = [_field.strip() for _field in text.split(',')]
+        if definition_type == "PARM":
+            _names = _fields[:ANALOG_CHANNELS + DIGITAL_CHANNELS]
+            self.keys = tuple(channel_key(_name, _default) for (_name, _default) in zip(_names, DEFAULT_KEYS)) + DEFAULT_KEYS[len(_names):]
+        elif definition_type == "UNIT":
+            _units = tuple(_fields[:ANALOG_CHANNELS + DIGITAL_CHANNELS])
+            self.units = _units + ("",) * (ANALOG_CHANNELS + DIGITAL_CHANNELS - len(_units))
+        elif definition_type == "EQNS":
+            _equations = []
+            for _channel in range(ANALOG_CHANNELS):
+                _coefficients = _fields[_channel * 3:_channel * 3 + 3]
+                if not any(_coefficients):
+                    _equations.append(DEFAULT_EQUATION)
+                    continue
+                _coefficients += [""] * (3 - len(_coefficients))
+                _equations.append(tuple(float(_value) if _value else _default for (_value, _default) in zip(_coefficients, DEFAULT_EQUATION)))
+            self.equations = tuple(_equations)
+        elif definition_type == "BITS":
+            (_bits, _sep, _project) = text.partition(',')
+            if not _bits or len(_bits) > DIGITAL_CHANNELS or _bits.strip("01"):
+                raise ValueError(f"Invalid telemetry bit senses: {_bits}")
+            self.bits = _bits.ljust(DIGITAL_CHANNELS, "1")
+            self.project = _project.strip() or None
+        else:
+            raise ValueError(f"Unknown telemetry definition type: {definition_type}")
+        self.definitions[definition_type] = text
+
+    def decode(self, frame):
+        """
+        Decode a frame (the text after 'T#': sequence number, analog values and bits), returning a
+        dict of payload field name -> value. Analog values are scaled by the channel's equation, and
+        digital channels are only included if named by PARM, as True if the bit matches its sense.
+        """
+        _fields = frame.split(',')
+        _values = {}
+        for (_index, _field) in enumerate(_fields[1:1 + ANALOG_CHANNELS]):
+            try:
+                _x = float(_field)
+            except ValueError:
+                continue
+            (_a, _b, _c) = self.equations[_index]
+            _values[self.keys[_index]] = round(_a * _x * _x + _b * _x + _c, 6)
+
+        if len(_fields) > 1 + ANALOG_CHANNELS:
+            _bits = _fields[1 + ANALOG_CHANNELS][:DIGITAL_CHANNELS]
+            if len(_bits) == DIGITAL_CHANNELS and not _bits.strip("01"):
+                for _index in range(DIGITAL_CHANNELS):
+                    _key = self.keys[ANALOG_CHANNELS + _index]
+                    if _key != DEFAULT_KEYS[ANALOG_CHANNELS + _index]:
+                        _values[_key] = _bits[_index] == self.bits[_index]
+        return _values
+
+
+class TelemetryStore(object):
+    """
+    Maps callsign -> StationTelemetry, evicting stations which have sent nothing
+    within the TTL, and the least recently updated stations when full.
+    """
+
+    # Columns of the rows returned by snapshot(), for saving state across restarts.
+    SNAPSHOT_COLUMNS = ('callsign', 'parm', 'unit', 'eqns', 'bits', 'updated')
+
+    def __init__(self, ttl=24*3600, frame_ttl=600, max_entries=20000, expire_interval=60, clock=time.time):
+        """
+        ttl: Time (seconds) a station's definitions are kept after anything was last received from it.
+        frame_ttl: Maximum age (seconds) of a frame attached to a payload.
+        max_entries: Maximum number of stations to store.
+        expire_interval: Minimum time (seconds) between scans for expired entries.
+        """
+        self.ttl = ttl
+        self.frame_ttl = frame_ttl
+        self.max_entries = max_entries
+        self.expire_interval = expire_interval
+        self.clock = clock
+
+        self.frames_received = 0
+        self.frames_duplicate = 0
+        self.frames_attached = 0
+        self.frames_stale = 0
+        self.definitions_received = 0
+        self.definition_errors = 0
+        self.evicted_ttl = 0
+        self.evicted_size = 0
+
+        self._stations = OrderedDict()
+        # Number of stations with definitions, and with a frame waiting to be uploaded.
+        self._defined = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._last_expire = clock()
+
+    def __contains__(self, callsign):
+        with self._lock:
+            return callsign in self._stations
+
+    def _station(self, callsign, now):
+        """ Return the entry for a station, creating it if needed, and mark it updated. Call with the lock held. """
+        # abs() so that expiry still runs if the clock is set backwards (e.g. replaying a capture)
+        if abs(now - self._last_expire) > self.expire_interval:
+            self._expire(now)
+
+        _station = self._stations.get(callsign)
+        if _station is None:
+            _station = self._stations[callsign] = StationTelemetry()
+            if len(self._stations) > self.max_entries:
+                self._evict_oldest()
+                self.evicted_size += 1
+        else:
+            self._stations.move_to_end(callsign)
+        _station.updated = now
+        return _station
+
+    def _expire(self, now):
+        # Entries are ordered by update time, so we only need to look at the oldest.
+        self._last_expire = now
+        _cutoff = now - self.ttl
+        while self._stations:
+            _callsign, _station = next(iter(self._stations.items()))
+            if _station.updated >= _cutoff:
+                break
+            self._evict_oldest()
+            self.evicted_ttl += 1
+
+    def _evict_oldest(self):
+        (_callsign, _station) = self._stations.popitem(last=False)
+        if _station.definitions:
+            self._defined -= 1
+        if _station.frame is not None:
+            self._pending -= 1
+
+    def update_frame(self, callsign, frame):
+        """ Store a frame (the text after 'T#') from a station, to be decoded when its next payload is uploaded. """
+        _now = self.clock()
+        with self._lock:
+            _station = self._station(callsign, _now)
+            if frame == _station.last_frame:
+                # The same frame, via another iGate.
+                self.frames_duplicate += 1
+                return
+            if _station.frame is None:
+                self._pending += 1
+            _station.frame = frame
+            _station.frame_time = _now
+            _station.last_frame = frame
+            self.frames_received += 1
+
+    def update_definition(self, callsign, definition_type, text):
+        """ Apply a definition message (type e.g. 'PARM', and the text after 'PARM.') for a station's telemetry. """
+        with self._lock:
+            _station = self._station(callsign, self.clock())
+            _defined = bool(_station.definitions)
+            try:
+                _station.define(definition_type, text)
+                if not _defined:
+                    self._defined += 1
+                self.definitions_received += 1
+            except ValueError as e:
+                self.definition_errors += 1
+                logging.debug("Invalid %s telemetry definition for %s (%s): %s", definition_type, callsign, text, e)
+
+    def take(self, callsign, packet):
+        """
+        Return the decoded values of the frame received from a station since its last upload,
+        or None. packet identifies the upload (e.g. the packet's information field), so that
+        uploads of copies of the packet via other iGates are given the same values.
+        """
+        with self._lock:
+            _station = self._stations.get(callsign)
+            if _station is None:
+                return None
+
+            if _station.frame is not None:
+                (_frame, _station.frame) = (_station.frame, None)
+                self._pending -= 1
+                if self.clock() - _station.frame_time > self.frame_ttl:
+                    self.frames_stale += 1
+                    _station.attached = None
+                    return None
+                _station.attached = (packet, _station.decode(_frame))
+                self.frames_attached += 1
+                return dict(_station.attached[1])
+
+            if _station.attached is not None and _station.attached[0] == packet:
+                return dict(_station.attached[1])
+            return None
+
+    def describe(self, callsign, values):
+        """ Format decoded values for logging, with the station's units. """
+        with self._lock:
+            _station = self._stations.get(callsign)
+            _units = dict(zip(_station.keys, _station.units)) if _station is not None else {}
+        return ", ".join(f"{_key}={_value} {_units.get(_key, '')}".rstrip() for (_key, _value) in values.items())
+
+    def snapshot(self):
+        """ Return the stations' definitions as a list of rows (see SNAPSHOT_COLUMNS), least recently updated first. """
+        with self._lock:
+            return [
+                (_callsign,) + tuple(_station.definitions.get(_type) for _type in DEFINITION_TYPES) + (_station.updated,)
+                for (_callsign, _station) in self._stations.items() if _station.definitions
+            ]
+
+    def restore(self, rows):
+        """ Load definitions from snapshot() rows, skipping any which have expired. Returns the number of stations loaded. """
+        _cutoff = self.clock() - self.ttl
+        _count = 0
+        with self._lock:
+            for _row in sorted(rows, key=lambda _row: _row[-1], reverse=True):
+                (_callsign, _updated) = (_row[0], _row[-1])
+                if _updated < _cutoff or _callsign in self._stations:
+                    continue
+                _station = StationTelemetry(updated=_updated)
+                for (_type, _text) in zip(DEFINITION_TYPES, _row[1:-1]):
+                    if _text is not None:
+                        try:
+                            _station.define(_type, _text)
+                        except ValueError:
+                            pass
+                self._stations[_callsign] = _station
+                if _station.definitions:
+                    self._defined += 1
+                # Newest first, each moved in front of any stations heard from since starting up.
+                self._stations.move_to_end(_callsign, last=False)
+                _count += 1
+            while len(self._stations) > self.max_entries:
+                self._evict_oldest()
+                self.evicted_size += 1
+        return _count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "stations": len(self._stations),
+                "defined": self._defined,
+                "frames_pending": self._pending,
+                "frames_received": self.frames_received,
+                "frames_duplicate": self.frames_duplicate,
+                "frames_attached": self.frames_attached,
+                "frames_stale": self.frames_stale,
+                "definitions_received": self.definitions_received,
+                "definition_errors": self.definition_errors,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_size": self.evicted_size,
+            }
+
+
+def parse_telemetry_line(line):
+    """
+    Split a raw APRS-IS line (bytes) classified as prefilter.TELEMETRY into ('frame', source
+    callsign, frame text) or ('definition', addressee callsign, (type, text)).
+    """
+    (_head, _sep, _body) = line.partition(b':')
+    _body = _body.rstrip(b'\r\n').decode('utf-8', 'replace')
+    if _body.startswith('T#'):
+        return ("frame", _head.split(b'>', 1)[0].decode('latin-1'), _body[2:])
+    # Message - ':' addressee (9 characters) ':' type '.' text, optionally with a '{' message number.
+    _text = _body[16:].partition('{')[0]
+    return ("definition", _body[1:10].strip(), (_body[11:15], _text))
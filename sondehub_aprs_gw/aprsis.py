@@ -0,0 +1,138 @@
+#
+#   SondeHub APRS Gateway - asyncio APRS-IS Client
+#
+#   A single APRS-IS connection, read with a large buffered asyncio
+#   StreamReader. Handles the login (with passcode and filter), filter changes
+#   on the open connection, and sending packets. Rather than relying on a
+#   socket timeout, a stalled server is detected when nothing (not even the
+#   keepalive comments APRS-IS servers send every 20 seconds) has been
+#   received for keepalive_timeout seconds.
+#
+#   Reconnection is left to the caller (see upstream.py).
+#
+import asyncio
+import logging
+
+import aprslib
+
+SOFTWARE_NAME = "SondeHubAPRSGateway"
+
+
+class LoginError(ConnectionError):
+    """ The server rejected the login. """
+
+
+class StalledError(ConnectionError):
+    """ Nothing has been received from the server within the keepalive timeout. """
+
+
+class APRSISClient(object):
+    """ An asyncio APRS-IS connection. """
+
+    def __init__(self, callsign, host, port=14580, filter="", passcode=None, software_version="local",
+                 connect_timeout=10, keepalive_timeout=60, buffer_size=1 << 20):
+        """
+        callsign: Callsign to log in with.
+        host, port: APRS-IS server.
+        filter: Server-side filter sent with the login.
+        passcode: APRS-IS passcode. Calculated from the callsign if not given.
+        software_version: Software version sent with the login.
+        connect_timeout: Time (seconds) allowed to connect and log in.
+        keepalive_timeout: Time (seconds) without receiving anything after which the connection is considered stalled.
+        buffer_size: StreamReader buffer size, which is also the longest line that can be read.
+        """
+        self.callsign = callsign
+        self.host = host
+        self.port = port
+        self.filter = filter
+        self.passcode = passcode if passcode is not None else aprslib.passcode(callsign)
+        self.software_version = software_version
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+        self.buffer_size = buffer_size
+
+        self.server = None
+        self.connected = False
+        self.lines = 0
+        self.comments = 0
+
+        self._reader = None
+        self._writer = None
+
+    async def connect(self):
+        """ Connect and log in. Raises LoginError if the login is rejected, or another exception on failure. """
+        await asyncio.wait_for(self._connect(), self.connect_timeout)
+
+    async def _connect(self):
+        (self._reader, self._writer) = await asyncio.open_connection(self.host, self.port, limit=self.buffer_size)
+        try:
+            # Server banner
+            await self._reader.readline()
+            _login = f"user {self.callsign} pass {self.passcode} vers {SOFTWARE_NAME} {self.software_version}"
+            if self.filter:
+                _login += f" filter {self.filter}"
+            await self._write(_login)
+
+            _response = (await self._reader.readline()).decode('latin-1').strip()
+            # e.g. '# logresp N0CALL verified, server T2TEST'
+            _fields = _response.split()
+            if len(_fields) < 4 or _fields[1] != "logresp" or _fields[2] != self.callsign:
+                raise LoginError(f"Unexpected login response: {_response!r}")
+            if _fields[3].rstrip(",") == "unverified" and self.passcode != -1:
+                raise LoginError(f"Passcode rejected: {_response!r}")
+            if _fields[3].rstrip(",") not in ("verified", "unverified"):
+                raise LoginError(f"Login rejected: {_response!r}")
+            if len(_fields) >= 6 and _fields[4] == "server":
+                self.server = _fields[5]
+        except BaseException:
+            await self.close()
+            raise
+        self.connected = True
+
+    async def lines_received(self):
+        """
+        Async iterator of the raw packets (bytes, without line endings) received.
+        Server comments and keepalives are skipped. Raises StalledError if nothing is
+        received within the keepalive timeout, or ConnectionError if the server disconnects.
+        """
+        while True:
+            try:
+                _line = await asyncio.wait_for(self._reader.readline(), self.keepalive_timeout)
+            except asyncio.TimeoutError:
+                raise StalledError(f"Nothing received for {self.keepalive_timeout} seconds")
+            if not _line:
+                raise ConnectionError("Server closed the connection")
+            if _line.startswith(b'#'):
+                self.comments += 1
+                continue
+            _line = _line.rstrip(b'\r\n')
+            if _line:
+                self.lines += 1
+                yield _line
+
+    async def set_filter(self, filter_text):
+        """ Change the server-side filter. If not connected, it is sent when logging in. """
+        self.filter = filter_text
+        if self.connected:
+            await self._write(f"#filter {filter_text}")
+
+    async def send(self, line):
+        """ Send a packet (str) to APRS-IS. """
+        if not self.connected:
+            raise ConnectionError("Not connected to APRS-IS")
+        await self._write(line)
+
+    async def _write(self, line):
+        self._writer.write(line.encode('latin-1') + b"\r\n")
+        await self._writer.drain()
+
+    async def close(self):
+        self.connected = False
+        if self._writer is None:
+            return
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except Exception as e:
+            logging.debug(f"Error closing APRS-IS connection: {e}")
+        self._writer = None
@@ -0,0 +1,458 @@
+#
+#   SondeHub APRS Gateway - Offline Replay Benchmark
+#
+#   Replays a corpus of raw APRS-IS lines through the full parser() path
+#   (pre-filter, parsing, filter rules, conversion and comment telemetry
+#   extraction), with the SNS, listener and APRS-IS message sinks stubbed out,
+#   and reports throughput, time per stage and peak memory.
+#
+#   Usage:
+#       python -m sondehub_aprs_gw.benchmark                    # Synthetic corpus
+#       python -m sondehub_aprs_gw.benchmark capture.txt.gz     # Recorded corpus (one raw line per line)
+#       python -m sondehub_aprs_gw.benchmark --write-corpus corpus.txt --lines 500000
+#       python -m sondehub_aprs_gw.benchmark --shards 4                         # Parse in 4 worker processes
+#       python -m sondehub_aprs_gw.benchmark --comments                         # Balloon comment checks only
+#       python -m sondehub_aprs_gw.benchmark --decoder capture.txt.gz           # Fast position decoder vs aprslib
+#
+import argparse
+import gzip
+import json
+import logging
+import random
+import sys
+import time
+import timeit
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import aprslib
+
+from . import position_decoder, prefilter
+from .comment_telemetry import extract_comment_telemetry
+from .config import create_gateway
+from .filter_rules import FilterRules
+from .gateway import METRIC_STAGE_SECONDS
+from .modified_packets import is_modified_packet
+from .sharding import ShardedParser
+from .sinks import CallbackSink
+
+
+# Fraction of each type of line in the synthetic corpus, roughly following the APRS-IS full feed.
+CORPUS_MIX = (
+    ("position", 0.70),
+    ("non_position", 0.16),
+    ("balloon", 0.07),
+    ("blocked_balloon", 0.02),
+    ("chase", 0.01),
+    ("garbage", 0.04),
+)
+
+_POSITION_SYMBOLS = "->k_#&`[<uvjsy"
+_TOCALLS = ("APRS", "APDW16", "APMI06", "APLRG1", "APOT30", "APN391", "APTT4", "APK102", "APAT81", "T3RTQP")
+
+# Real balloon packets with comment telemetry, used as-is apart from the iGate.
+_BALLOON_TEMPLATES = (
+    "KJ6IJM-12>APELK0,WIDE2-1,qAR,{igate}:/202110h3419.82N/11625.45WO002/009/A=006532 12 4.34 33 1991 101 |\"+%g$B!-!\"!\"|",
+    "KF0GOR-12>CQ,WIDE2-1,qAR,{igate}:!4003.46N/10421.62WO307/017/A=085292,StrTrk,84,9,1.46V,-14C,2127Pa,",
+    "N0LQ-11>APLIGA,W1YK-1*,WIDE2-2,qAR,{igate}:/194239h4216.46N/07148.45WO353/000/A=000479 011TxC  36.10C 1034.61hPa  4.93V 08S WPI SDC Gompei-0 Mission",
+    "PD3EGE-7>APZQAP,WIDE1-1,qAO,{igate}:!5046.64N/00439.14EO/A=044653/P809S8T-30V127 RS41 Balloon",
+    "IS0HHA-2>APZQVA,WIDE2-2,qAR,{igate}:@223215h2102.30S/11504.48EO045/000/A=000000!w5_!Clb=0.00 Volt=2.76 Sats=0 Fixed=0 - RS41 tracker",
+    "SQ5PGC-12>APZQAP,OK2VOP-1*,qAO,{igate}:!2900.83N/12749.09WO/A=016498/Cnt:494,Sat:0,p:126,t:-7.58,Vbat:2.38   SP7TEAM APRS _ v2.0 PS20 ;)",
+    "OE9IMJ-11>TW1VU7-2,WIDE1-1,WIDE2-1,qAR,{igate}:`\x7fByl\x1fQO/\"9S}mou CT3001 S8 2.8C  955hPa 3.4V",
+)
+
+# Balloon-symbol packets which are rejected by the filter rules or modified packet detection.
+_BLOCKED_BALLOON_TEMPLATES = (
+    "{call}>APRARX,SONDEGATE,TCPIP,qAR,{igate}:;T1234567 *{time}h{lat}/{lon}O180/010/A=030000 Clb=5.0m/s t=-40.0C 403.000 MHz Type=RS41 Radiosonde auto_rx",
+    "{call}>APRARX,TCPIP*,qAC,{igate}:!{lat}/{lon}O180/010/A=030000 Clb=5.0m/s RS41 Radiosonde",
+    "{call}>APLAIR,NOHUB,qAS,{igate}:!{lat}/{lon}O208/054/A=042250/P3S15O16F1N2 FT0 DS -15.75 RS -106",
+    "{call}>APLRG1,qAS,{igate}:!{lat}/{lon}EO117/054/A=042362/P567S30F0R0N31Q1 S rssi: -117.25dBm, snr: -3.25dB, err: -5131Hz",
+    "{call}>APRS,TCPIP*,qAC,{igate}:!{lat}/{lon}O000/000/A=001000 SondeID S1234567",
+)
+
+_NON_POSITION_TEMPLATES = (
+    "{call}>APRS,TCPIP*,qAC,T2TEXAS::{dest:<9}:Hello there{{{n}",
+    "{call}>{tocall},WIDE1-1,qAR,{igate}:>Status text for {call}",
+    "{call}>{tocall},TCPIP*,qAC,T2SYDNEY:_10090556c220s004g005t077r000p000P000h50b09900wRSW",
+    "{call}>{tocall},TCPIP*,qAC,T2POLAND:T#{n:03d},199,000,255,073,123,01101001",
+    "{call}>{tocall},TCPIP*,qAC,T2POLAND::{call:<9}:PARM.Vbat,Temp,Pres,RSSI,SNR",
+    "{call}>{tocall},WIDE2-1,qAR,{igate}:<IGATE,MSG_CNT=30,LOC_CNT=12",
+    "{call}>{tocall},TCPIP*,qAC,T2CAN:${lat}",
+)
+
+_GARBAGE_LINES = (
+    "# aprsc 2.1.14-g5e22b37 17 Oct 2026 00:00:00 GMT T2TEST 1.2.3.4:14580",
+    "NOCALL>APRS:",
+    ">APRS,qAR,NOCALL:!5000.00N/01400.00E-",
+    "BROKEN",
+    "{call}>APRS,TCPIP*,qAC,T2TEST:!9999.99N/99999.99E-Bad position",
+    "{call}>APRS,TCPIP*,qAC,T2TEST:!50\x00\xff.00N/01400.00E-Binary junk",
+    "{call}>APRS,TCPIP*,qAC,T2TEST:=5000.00N/01400.00",
+    "{call}>APRS,TCPIP*,qAC,T2TEST:@",
+)
+
+
+def _callsign(rng, index):
+    _prefix = "ABCDEFGHIKLMNOPRSUVWYZ"
+    return f"{_prefix[index % len(_prefix)]}{_prefix[(index // 7) % len(_prefix)]}{index % 10}{chr(65 + index % 26)}{chr(65 + (index // 26) % 26)}-{rng.randint(1, 15)}"
+
+
+def _latlon(rng):
+    _lat = rng.uniform(-70, 70)
+    _lon = rng.uniform(-179, 179)
+    return (
+        f"{int(abs(_lat)):02d}{abs(_lat) % 1 * 60:05.2f}{'N' if _lat >= 0 else 'S'}",
+        f"{int(abs(_lon)):03d}{abs(_lon) % 1 * 60:05.2f}{'E' if _lon >= 0 else 'W'}",
+    )
+
+
+def generate_corpus(lines=100000, stations=5000, igates=500, seed=1):
+    """
+    Generate a synthetic corpus of raw APRS-IS lines (bytes), following CORPUS_MIX.
+    A subset of the stations are iGates, which also send position reports, so
+    that listener uploads are exercised.
+    """
+    _rng = random.Random(seed)
+    _stations = [_callsign(_rng, _i) for _i in range(stations)]
+    _igates = _stations[:igates]
+    _balloons = [f"{_call.split('-')[0]}-11" for _call in _stations[igates:igates + 50]]
+    _kinds = [_kind for _kind, _weight in CORPUS_MIX]
+    _weights = [_weight for _kind, _weight in CORPUS_MIX]
+
+    _corpus = []
+    for _kind in _rng.choices(_kinds, _weights, k=lines):
+        _call = _rng.choice(_stations)
+        _igate = _rng.choice(_igates)
+        (_lat, _lon) = _latlon(_rng)
+
+        if _kind == "position":
+            _tocall = _rng.choice(_TOCALLS)
+            _symbol = _rng.choice(_POSITION_SYMBOLS)
+            _format = _rng.random()
+            if _format < 0.6:
+                _line = f"{_call}>{_tocall},WIDE1-1,qAR,{_igate}:!{_lat}/{_lon}{_symbol}PHG2360 Station {_call}"
+            elif _format < 0.8:
+                _line = f"{_call}>{_tocall},TCPIP*,qAC,T2TEST:@{_rng.randint(0, 235959):06d}z{_lat}/{_lon}{_symbol}{_rng.randint(0, 359):03d}/{_rng.randint(0, 99):03d}/A={_rng.randint(0, 9999):06d}"
+            else:
+                _line = f"{_call}>{_tocall},qAR,{_igate}:={_lat}/{_lon}{_symbol}/A={_rng.randint(0, 9999):06d} iGate"
+
+        elif _kind == "balloon":
+            if _rng.random() < 0.3:
+                _line = _rng.choice(_BALLOON_TEMPLATES).replace("{igate}", _igate)
+            else:
+                _line = (
+                    f"{_rng.choice(_balloons)}>APZ41N,WIDE1-1,WIDE2-1,qAR,{_igate}:!{_lat}/{_lon}O{_rng.randint(0, 359):03d}/{_rng.randint(0, 99):03d}"
+                    f"/A={_rng.randint(1000, 110000):06d}/P{_rng.randint(1, 9999)}S{_rng.randint(0, 12)}T{_rng.randint(-60, 30)}V{_rng.randint(2400, 3100)}C{_rng.randint(0, 99):02d}"
+                )
+
+        elif _kind == "blocked_balloon":
+            _line = _rng.choice(_BLOCKED_BALLOON_TEMPLATES).format(call=_call, igate=_igate, lat=_lat, lon=_lon, time=f"{_rng.randint(0, 235959):06d}")
+
+        elif _kind == "chase":
+            _line = f"{_call.split('-')[0]}-9>APDR16,SHUB,TCPIP*,qAC,T2TEST:={_lat}/{_lon}>{_rng.randint(0, 359):03d}/{_rng.randint(0, 99):03d}/A={_rng.randint(0, 3000):06d} Chasing"
+
+        elif _kind == "non_position":
+            _line = _rng.choice(_NON_POSITION_TEMPLATES).format(
+                call=_call, dest=_rng.choice(_stations), tocall=_rng.choice(_TOCALLS), igate=_igate, n=_rng.randint(0, 999), lat=_lat
+            )
+
+        else:
+            _line = _rng.choice(_GARBAGE_LINES).format(call=_call)
+
+        _corpus.append(_line.encode('latin-1'))
+
+    return _corpus
+
+
+def load_corpus(filename):
+    """ Read a corpus of raw lines (one per line), optionally gzip compressed. """
+    _open = gzip.open if filename.endswith(".gz") else open
+    with _open(filename, 'rb') as _f:
+        return [_line.rstrip(b"\r\n") for _line in _f if _line.strip()]
+
+
+def write_corpus(corpus, filename):
+    _open = gzip.open if filename.endswith(".gz") else open
+    with _open(filename, 'wb') as _f:
+        for _line in corpus:
+            _f.write(_line + b"\n")
+
+
+class _StubAIS(object):
+    def __init__(self, sink=None):
+        self.sink = sink
+        self.sent = 0
+
+    def sendall(self, line):
+        self.sent += 1
+        if self.sink:
+            self.sink("message", line)
+
+    def set_filter(self, filter_text):
+        self.filter = filter_text
+
+
+def load_gateway(sink=None):
+    """
+    Create a gateway configured from the environment (without connecting to
+    APRS-IS), with the SNS, listener API and APRS-IS sinks replaced by stubs
+    that only count uploads.
+    sink: Optional function called with (upload type, body) for every payload,
+          listener and APRS message upload.
+    """
+    _gateway = create_gateway(CallbackSink("payload", sink), CallbackSink("listener", sink))
+    _gateway.ais = _StubAIS(sink)
+    return _gateway
+
+
+def run(corpus, gateway=None, trace_memory=False, shards=0):
+    """
+    Feed each line of the corpus to parser(), and return a dict of results.
+    If trace_memory is True, the peak Python heap usage is measured with
+    tracemalloc (which slows processing considerably).
+    If shards is set, balloon and chase-car packets are parsed by that many worker
+    processes (see sharding.py), and the stage times only cover this process.
+    """
+    _gateway = gateway if gateway else load_gateway()
+    _gateway.payload_sink.published = 0
+    _gateway.listener_sink.published = 0
+    _gateway.ais.sent = 0
+    _stages_before = _stage_totals()
+
+    if shards:
+        _gateway.shards = ShardedParser("sondehub_aprs_gw.config:setup_shard_worker", _gateway.handle_shard_output, shards=shards).start()
+        _process = _gateway.dispatch
+    else:
+        _process = _gateway.parser
+
+    if trace_memory:
+        tracemalloc.start()
+    _start = time.perf_counter()
+    try:
+        for _line in corpus:
+            _process(_line)
+        if shards:
+            _gateway.shards.drain()
+        _elapsed = time.perf_counter() - _start
+    finally:
+        if shards:
+            _gateway.shards.stop()
+            _gateway.shards = None
+    if trace_memory:
+        (_current, _peak) = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    _stages = {}
+    for _stage, (_count, _total) in _stage_totals().items():
+        (_count_before, _total_before) = _stages_before.get(_stage, (0, 0.0))
+        if _count > _count_before:
+            _stages[_stage] = {"count": _count - _count_before, "seconds": _total - _total_before}
+
+    _results = {
+        "lines": len(corpus),
+        "seconds": _elapsed,
+        "lines_per_second": len(corpus) / _elapsed if _elapsed > 0 else None,
+        "shards": shards,
+        "stages": _stages,
+        "payloads_published": _gateway.payload_sink.published,
+        "listener_uploads": _gateway.listener_sink.published,
+        "messages_sent": _gateway.ais.sent,
+        "positions": len(_gateway.positions),
+        "peak_rss_bytes": _peak_rss(),
+    }
+    if trace_memory:
+        _results["peak_traced_bytes"] = _peak
+    return _results
+
+
+def comment_benchmark(corpus, repeat=5):
+    """
+    Micro-benchmark of the comment checks made on each balloon packet in the corpus:
+    the filter rules, modified packet detection and telemetry extraction. They are
+    timed with each check analysing the comment itself ('separate'), and sharing one
+    CommentAnalysis per packet, as the gateway does ('shared').
+    Returns a dict with the best time per comment (microseconds) of each.
+    """
+    _rules = FilterRules()
+    _packets = []
+    for _line in corpus:
+        if prefilter.classify(_line, _rules.rules.path_bytes) != prefilter.BALLOON:
+            continue
+        try:
+            _thing = aprslib.parse(_line)
+        except Exception:
+            continue
+        if _thing.get("comment") is not None:
+            _packets.append((_thing, {"comment": _thing["comment"], "aprs_tocall": _thing["to"]}))
+
+    def _separate():
+        for (_thing, _payload) in _packets:
+            _rules.match(_thing)
+            is_modified_packet(_thing)
+            extract_comment_telemetry(_payload)
+
+    def _shared():
+        for (_thing, _payload) in _packets:
+            _analysis = _rules.analyze(_thing)
+            _rules.match(_thing, _analysis)
+            is_modified_packet(_thing, _analysis)
+            extract_comment_telemetry(_payload, _analysis)
+
+    _results = {"comments": len(_packets)}
+    for (_name, _function) in (("separate", _separate), ("shared", _shared)):
+        _best = min(timeit.repeat(_function, number=1, repeat=repeat))
+        _results[f"{_name}_us_per_comment"] = _best / len(_packets) * 1e6 if _packets else None
+    return _results
+
+
+def decoder_benchmark(corpus, repeat=5):
+    """
+    Micro-benchmark of parsing the balloon and chase-car lines in the corpus with aprslib,
+    and with the fast position decoder (falling back to aprslib for lines it can't decode).
+    Every line the fast decoder handles is also checked against aprslib.
+    Returns a dict with the best time per line (microseconds) of each, the fraction of
+    lines handled by the fast decoder, and the lines on which the two disagree.
+    """
+    _lines = [_line for _line in corpus if prefilter.classify(_line) in (prefilter.BALLOON, prefilter.CHASE)]
+    _decoded = 0
+    _mismatches = []
+    for _line in _lines:
+        _thing = position_decoder.decode(_line)
+        if _thing is None:
+            continue
+        _decoded += 1
+        try:
+            _expected = position_decoder.fields(aprslib.parse(_line))
+        except Exception:
+            _expected = None
+        if _thing != _expected:
+            _mismatches.append(_line)
+
+    def _parse_all(parse):
+        for _line in _lines:
+            try:
+                parse(_line)
+            except Exception:
+                pass
+
+    _results = {
+        "lines": len(_lines),
+        "fast_decoded": _decoded / len(_lines) if _lines else None,
+        "mismatches": _mismatches,
+    }
+    for (_name, _parse) in (("aprslib", aprslib.parse), ("fast", position_decoder.parse)):
+        _best = min(timeit.repeat(lambda: _parse_all(_parse), number=1, repeat=repeat))
+        _results[f"{_name}_us_per_line"] = _best / len(_lines) * 1e6 if _lines else None
+    return _results
+
+
+def _stage_totals():
+    """ Return {stage: (count, total seconds)} from the stage timing histogram. """
+    _totals = {}
+    for _stage, _summary in METRIC_STAGE_SECONDS.summary().items():
+        _totals[_stage] = (_summary["count"], _summary["count"] * _summary["mean"])
+    return _totals
+
+
+def _peak_rss():
+    if resource is None:
+        return None
+    _maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux, but bytes on macOS
+    return _maxrss if sys.platform == "darwin" else _maxrss * 1024
+
+
+def format_results(results):
+    _lines = [
+        f"Lines:              {results['lines']}",
+        f"Elapsed:            {results['seconds']:.3f} s",
+        f"Throughput:         {results['lines_per_second']:.0f} lines/s",
+        f"Payloads published: {results['payloads_published']}",
+        f"Listener uploads:   {results['listener_uploads']}",
+        f"Messages sent:      {results['messages_sent']}",
+        f"Positions stored:   {results['positions']}",
+    ]
+    if results['peak_rss_bytes'] is not None:
+        _lines.append(f"Peak RSS:           {results['peak_rss_bytes'] / 1e6:.1f} MB")
+    if 'peak_traced_bytes' in results:
+        _lines.append(f"Peak traced heap:   {results['peak_traced_bytes'] / 1e6:.1f} MB")
+    _lines.append("")
+    _lines.append(f"{'Stage':<10} {'Count':>9} {'Total (s)':>10} {'Mean (us)':>10} {'Share':>7}")
+    for _stage, _stage_results in sorted(results['stages'].items(), key=lambda _item: -_item[1]['seconds']):
+        _lines.append(
+            f"{_stage:<10} {_stage_results['count']:>9} {_stage_results['seconds']:>10.3f} "
+            f"{_stage_results['seconds'] / _stage_results['count'] * 1e6:>10.1f} {_stage_results['seconds'] / results['seconds']:>7.1%}"
+        )
+    return "\n".join(_lines)
+
+
+def main():
+    _parser = argparse.ArgumentParser(description="Replay a corpus of raw APRS-IS lines through the gateway parser, and report throughput.")
+    _parser.add_argument("corpus", nargs="?", help="Corpus file (one raw line per line, optionally .gz). A synthetic corpus is used if not provided.")
+    _parser.add_argument("--lines", type=int, default=100000, help="Number of lines in the synthetic corpus (default 100000)")
+    _parser.add_argument("--seed", type=int, default=1, help="Random seed for the synthetic corpus (default 1)")
+    _parser.add_argument("--repeat", type=int, default=1, help="Number of passes over the corpus (default 1)")
+    _parser.add_argument("--write-corpus", metavar="FILENAME", help="Write the synthetic corpus to a file and exit")
+    _parser.add_argument("--comments", action="store_true", help="Only run the micro-benchmark of the balloon comment checks")
+    _parser.add_argument("--decoder", action="store_true", help="Only run the comparison of the fast position decoder with aprslib")
+    _parser.add_argument("--shards", type=int, default=0, help="Parse balloon and chase-car packets in this many worker processes (default 0, parse in this process)")
+    _parser.add_argument("--trace-memory", action="store_true", help="Measure peak Python heap usage with tracemalloc (slow)")
+    _parser.add_argument("--log-level", default="CRITICAL", help="Gateway log level during the run (default CRITICAL)")
+    _parser.add_argument("--json", action="store_true", help="Output results as JSON")
+    _args = _parser.parse_args()
+
+    logging.basicConfig(level=_args.log_level.upper())
+
+    if _args.corpus:
+        _corpus = load_corpus(_args.corpus)
+    else:
+        _corpus = generate_corpus(_args.lines, seed=_args.seed)
+
+    if _args.write_corpus:
+        write_corpus(_corpus, _args.write_corpus)
+        print(f"Wrote {len(_corpus)} lines to {_args.write_corpus}")
+        return
+
+    if _args.comments:
+        _results = comment_benchmark(_corpus, repeat=max(_args.repeat, 5))
+        if _args.json:
+            print(json.dumps(_results))
+        else:
+            print(f"Comments:           {_results['comments']}")
+            print(f"Separate checks:    {_results['separate_us_per_comment']:.2f} us/comment")
+            print(f"Shared analysis:    {_results['shared_us_per_comment']:.2f} us/comment")
+        return
+
+    if _args.decoder:
+        _results = decoder_benchmark(_corpus, repeat=max(_args.repeat, 5))
+        if _args.json:
+            _results["mismatches"] = [_line.decode('latin-1') for _line in _results["mismatches"]]
+            print(json.dumps(_results))
+        else:
+            print(f"Lines:              {_results['lines']}")
+            print(f"Fast decoded:       {_results['fast_decoded']:.1%}")
+            print(f"aprslib:            {_results['aprslib_us_per_line']:.2f} us/line")
+            print(f"Fast decoder:       {_results['fast_us_per_line']:.2f} us/line ({_results['aprslib_us_per_line'] / _results['fast_us_per_line']:.1f}x)")
+            print(f"Mismatches:         {len(_results['mismatches'])}")
+            for _line in _results["mismatches"][:20]:
+                print(f"    {_line!r}")
+        return
+
+    _gateway = load_gateway()
+    for _pass in range(_args.repeat):
+        _results = run(_corpus, _gateway, trace_memory=_args.trace_memory, shards=_args.shards)
+        if _args.json:
+            print(json.dumps(_results))
+        else:
+            if _args.repeat > 1:
+                print(f"Pass {_pass + 1}:")
+            print(format_results(_results))
+            print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#
+#   SondeHub APRS Gateway - Raw Stream Capture
+#
+#   Writes every raw line received from APRS-IS to gzip compressed capture
+#   files, rotated on a fixed interval, so that traffic can be replayed later.
+#   Each line in a capture file is the receive time (UNIX epoch seconds),
+#   a space, and the raw line as received.
+#
+import datetime
+import glob
+import gzip
+import logging
+import os
+import queue
+import threading
+import time
+
+CAPTURE_PREFIX = "aprs-"
+CAPTURE_SUFFIX = ".txt.gz"
+
+
+class CaptureWriter(object):
+    """
+    Tees raw lines to rotating capture files. Lines are written from a
+    background thread, so compression never blocks the APRS-IS reader.
+    """
+
+    def __init__(self, directory, rotate_interval=3600, max_files=0, queue_size=100000, compresslevel=6, clock=time.time):
+        """
+        directory: Directory to write capture files to (created if necessary).
+        rotate_interval: Time (seconds) after which a new capture file is started.
+        max_files: Maximum number of capture files to keep. The oldest are deleted. 0 keeps all files.
+        queue_size: Maximum number of lines waiting to be written. Lines are dropped if this is full.
+        compresslevel: gzip compression level.
+        clock: Function returning the current time, used for receive timestamps.
+        """
+        self.directory = directory
+        self.rotate_interval = rotate_interval
+        self.max_files = max_files
+        self.compresslevel = compresslevel
+        self.clock = clock
+
+        self.lines_written = 0
+        self.lines_dropped = 0
+        self.files_opened = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._file_opened = None
+        self.filename = None
+
+        os.makedirs(self.directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._write_loop, name="capture-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, line):
+        """ Queue a raw line (bytes) for writing, with the current time. """
+        try:
+            self._queue.put_nowait((self.clock(), line))
+        except queue.Full:
+            self.lines_dropped += 1
+
+    def close(self):
+        """ Write all queued lines, and close the current capture file. """
+        self._queue.put(None)
+        self._thread.join()
+        self._close_file()
+
+    def _write_loop(self):
+        while True:
+            _item = self._queue.get()
+            if _item is None:
+                return
+            (_timestamp, _line) = _item
+            try:
+                if self._file is None or _timestamp - self._file_opened >= self.rotate_interval:
+                    self._rotate(_timestamp)
+                self._file.write(f"{_timestamp:.3f} ".encode('ascii') + bytes(_line) + b"\n")
+                self.lines_written += 1
+            except Exception:
+                logging.exception("Error writing to capture file")
+                self.lines_dropped += 1
+
+    def _rotate(self, timestamp):
+        self._close_file()
+        _name = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self.filename = os.path.join(self.directory, CAPTURE_PREFIX + _name + CAPTURE_SUFFIX)
+        self._file = gzip.open(self.filename, 'ab', compresslevel=self.compresslevel)
+        self._file_opened = timestamp
+        self.files_opened += 1
+        logging.info(f"Capturing raw APRS-IS lines to {self.filename}")
+
+        if self.max_files > 0:
+            for _old in capture_files(self.directory)[:-self.max_files]:
+                try:
+                    os.remove(_old)
+                except OSError:
+                    logging.exception(f"Error removing old capture file {_old}")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {
+            "lines_written": self.lines_written,
+            "lines_dropped": self.lines_dropped,
+            "queued": self._queue.qsize(),
+            "files_opened": self.files_opened,
+        }
+
+
+def capture_files(path):
+    """ Return the capture files in a directory, oldest first. If path is a file, return just that file. """
+    if os.path.isdir(path):
+        return sorted(glob.glob(os.path.join(path, CAPTURE_PREFIX + "*" + CAPTURE_SUFFIX)))
+    return [path]
+
+
+def read_capture(paths):
+    """
+    Read capture files (or directories of capture files), yielding
+    (receive time, raw line) for each line, in file order.
+    """
+    for _path in paths:
+        for _filename in capture_files(_path):
+            _open = gzip.open if _filename.endswith(".gz") else open
+            with _open(_filename, 'rb') as _f:
+                try:
+                    for _line in _f:
+                        (_timestamp, _sep, _raw) = _line.rstrip(b"\r\n").partition(b" ")
+                        try:
+                            yield float(_timestamp), _raw
+                        except ValueError:
+                            logging.warning(f"Skipping malformed line in {_filename}: {_line[:80]}")
+                except EOFError:
+                    # The file was not closed cleanly (e.g. the gateway was killed), so stop at the last complete line.
+                    logging.warning(f"Capture file {_filename} is truncated")
@@ -0,0 +1,161 @@
+#
+#   SondeHub APRS Gateway - Multi-iGate Coalescing
+#
+#   A balloon beacon is often heard by many iGates, and arrives once via each.
+#   The copies differ only in their path. This keeps the parsed packet and
+#   converted payload of the first copy for a short window, so that later
+#   copies can be handled without parsing, filtering on content, or decoding
+#   telemetry again.
+#
+#   Optionally, the payload is held for the window and emitted once, with a
+#   list of all the iGates which uploaded it, rather than once per iGate.
+#
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+
+class CoalescedPacket(object):
+    """ The first copy of a packet, and the iGates it has been received via. """
+    __slots__ = ('thing', 'payload', 'first_seen', 'uploaders', 'copies')
+
+    def __init__(self, thing, first_seen):
+        self.thing = thing
+        self.payload = None
+        self.first_seen = first_seen
+        self.uploaders = []
+        self.copies = 0
+
+
+def packet_key(line):
+    """ Key identifying copies of a raw packet (bytes) - the source, destination and body, without the path. """
+    (_header, _sep, _body) = line.partition(b':')
+    return _header.split(b',', 1)[0] + b':' + _body
+
+
+class PacketCoalescer(object):
+    """
+    Recently received packets, keyed on packet_key().
+    """
+
+    def __init__(self, window=2.0, combine=False, emit=None, max_entries=100000, clock=time.time):
+        """
+        window: Time (seconds) after the first copy of a packet in which other copies are coalesced.
+        combine: If True, packets are held until the window expires, and then emit is called
+                 with each packet which has a payload.
+        emit: Function called with each expired CoalescedPacket, if combine is True.
+        max_entries: Hard limit on the number of packets held.
+        clock: Function returning the current time.
+        """
+        self.window = window
+        self.combine = combine
+        self.emit = emit
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self.packets = 0
+        self.copies = 0
+        self.emitted = 0
+
+        self._packets = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._running = False
+
+    def get(self, key):
+        """ Return the CoalescedPacket for key if it was first received within the window, else None. """
+        _now = self.clock()
+        with self._lock:
+            _packet = self._packets.get(key)
+            if _packet is None or _now - _packet.first_seen > self.window:
+                return None
+            _packet.copies += 1
+            self.copies += 1
+            return _packet
+
+    def put(self, key, thing):
+        """
+        Store the first copy of a packet. Its payload (if accepted) should be set with set_payload().
+
+        An older copy which has passed the window is expired (and emitted, if combining) first.
+        If another copy was stored within the window (by another worker), that packet is returned.
+        """
+        _now = self.clock()
+        with self._lock:
+            _expired = self._expire(_now)
+            _packet = self._packets.get(key)
+            if _packet is not None:
+                _packet.copies += 1
+                self.copies += 1
+            else:
+                _packet = CoalescedPacket(thing, _now)
+                self._packets[key] = _packet
+                self.packets += 1
+                if len(self._packets) > self.max_entries:
+                    _expired.extend(self._expire(_now))
+        self._emit(_expired)
+        return _packet
+
+    def set_payload(self, packet, payload):
+        """ Set the payload of a packet, unless another copy has set it already. Returns the packet's payload. """
+        with self._lock:
+            if packet.payload is None:
+                packet.payload = payload
+            return packet.payload
+
+    def add_uploader(self, packet, uploader):
+        with self._lock:
+            packet.uploaders.append(uploader)
+
+    def _expire(self, now):
+        _expired = []
+        _cutoff = now - self.window
+        while self._packets:
+            _key, _packet = next(iter(self._packets.items()))
+            if _packet.first_seen >= _cutoff and len(self._packets) <= self.max_entries:
+                break
+            del self._packets[_key]
+            if self.combine and _packet.payload is not None:
+                _expired.append(_packet)
+        return _expired
+
+    def _emit(self, packets):
+        for _packet in packets:
+            self.emitted += 1
+            try:
+                self.emit(_packet)
+            except Exception:
+                logging.exception("Error emitting coalesced packet")
+
+    def flush(self, all=False):
+        """ Expire packets older than the window (or all packets), emitting them if combining. """
+        with self._lock:
+            _expired = self._expire(float('inf') if all else self.clock())
+        self._emit(_expired)
+
+    def start(self):
+        """ Start a thread which expires packets when no new packets are arriving. """
+        self._running = True
+        self._thread = threading.Thread(target=self._flush_loop, name="coalescer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join()
+        self.flush(all=True)
+
+    def _flush_loop(self):
+        while self._running:
+            time.sleep(min(self.window / 4, 1.0))
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "packets": self.packets,
+                "copies": self.copies,
+                "emitted": self.emitted,
+                "held": len(self._packets),
+            }
@@ -0,0 +1,102 @@
+#
+#   SondeHub APRS Gateway - Comment Analysis
+#
+#   Works out everything the gateway needs to know about a balloon packet's
+#   comment once: the comment blocking rule it matches (if any), whether an
+#   iGate has added its own RSSI/SNR metadata to it, and its whitespace
+#   delimited tokens, which the telemetry decoders work from. The filter rules,
+#   modified packet detection and comment telemetry extraction all accept the
+#   result, rather than each searching, upper-casing and splitting the comment
+#   again.
+#
+#   These are still separate scans of the comment. Folding them into a single
+#   precompiled regex is slower: Python's regex engine searches an alternation
+#   of the rule strings about three times slower than str.find does.
+#
+
+# Signatures of comments modified by an iGate.
+MODIFIED_RSSI_SNR_DB = "rssi_snr_db"        # e.g. 'rssi: -117.25dBm, snr: -3.25dB' (LoRa APRS iGates)
+MODIFIED_RSSI_SNR_EQUALS = "rssi_snr_equals"    # e.g. 'RSSI=-110 SNR=-5'
+MODIFIED_DS_RS_TAIL = "ds_rs_tail"          # e.g. '... DS -15.75 RS -106' on the end
+
+
+class CommentAnalysis(object):
+    """
+    The result of analyze_comment().
+
+    comment: The comment (may be None).
+    upper: The comment in upper case.
+    tokens: The whitespace delimited fields of the comment (comment.split()).
+    rules: The CompiledRules the comment was checked against, or None.
+    block_rule: Name of the first comment rule the comment matches, or None.
+    block_rule_tocall_is_from: Name of the first 'tocall_is_from' comment rule the comment
+                               matches, or None. Only checked if requested.
+    modified: The MODIFIED_* signature of an iGate modified comment, or None.
+    """
+
+    __slots__ = ("comment", "upper", "tokens", "rules", "block_rule", "block_rule_tocall_is_from", "modified")
+
+    def __init__(self, comment, upper="", tokens=(), rules=None, block_rule=None, block_rule_tocall_is_from=None, modified=None):
+        self.comment = comment
+        self.upper = upper
+        self.tokens = tokens
+        self.rules = rules
+        self.block_rule = block_rule
+        self.block_rule_tocall_is_from = block_rule_tocall_is_from
+        self.modified = modified
+
+    def __repr__(self):
+        return f"CommentAnalysis(block_rule={self.block_rule!r}, modified={self.modified!r}, tokens={self.tokens!r})"
+
+
+def analyze_comment(comment, rules=None, tocall_is_from=False):
+    """
+    Analyse a packet comment (str or None).
+    rules: CompiledRules (see filter_rules.py) to check the comment against.
+    tocall_is_from: Also check the 'tocall_is_from' comment rules (i.e. the packet's tocall is its source callsign).
+    """
+    if comment is None:
+        return CommentAnalysis(None, rules=rules)
+
+    if rules is not None and comment:
+        (_block_rule, _block_rule_tocall_is_from) = rules.search_comment(comment, tocall_is_from)
+    else:
+        (_block_rule, _block_rule_tocall_is_from) = (None, None)
+
+    _upper = comment.upper()
+    _tokens = comment.split()
+    return CommentAnalysis(
+        comment,
+        _upper,
+        _tokens,
+        rules,
+        _block_rule,
+        _block_rule_tocall_is_from,
+        _modified_signature(comment, _upper, _tokens)
+    )
+
+
+def _modified_signature(comment, upper, tokens):
+    """ Return the signature of a comment which has been modified by an iGate, or None. """
+    # LoRa APRS iGate detection
+    # Detect the presence of RSSI, SNR and dB within the comment.
+    if 'RSSI' in upper:
+        if ('SNR' in upper) and ('DB' in upper):
+            return MODIFIED_RSSI_SNR_DB
+        if ('RSSI=' in upper) and ('SNR=' in upper):
+            return MODIFIED_RSSI_SNR_EQUALS
+
+    # Check for comments with a "DS -15.75 RS -106" construct on the end. The tokens rule
+    # out nearly every comment, before checking the exact space delimited fields.
+    if len(tokens) >= 4 and tokens[-2] == "RS" and tokens[-4] == "DS":
+        _fields = comment.rstrip().split(" ")
+        try:
+            if (_fields[-2] == "RS") and (_fields[-4] == "DS"):
+                # Only if the RSSI and SNR fields are numbers (raises ValueError if not).
+                float(_fields[-1])
+                float(_fields[-3])
+                return MODIFIED_DS_RS_TAIL
+        except (IndexError, ValueError):
+            pass
+
+    return None
@@ -6,18 +6,156 @@
 import logging
 import re
 
+from .comment_analysis import analyze_comment
+
 # APRS tocalls (device IDs) of trackers which are known to send comment-field
 # telemetry with satellite information reported as 'Sn' or 'Sats=0', and commonly send 
 # positions with no GNSS lock ('S0', 'Sats=0')
 APRS_S0_TRACKERS = ['APBCRS', 'APZQVA']
 
-def extract_comment_telemetry(payload):
+# Tokenizer for the 'letter followed by a number' telemetry format used by
+# a number of RS41/M20 firmwares, e.g. P6S7T29V2947C00
+LETTER_NUMBER_TOKENS = re.compile(r'([A-Z])(-?\d+)')
+
+
+class LetterNumberDecoder(object):
+    """
+    Decoder for letter/number format comment telemetry, where the telemetry
+    is the first space-delimited field of the comment.
+
+    fields maps the field letter to a (key, type, scale) tuple. The value
+    stored is type(data)/scale, or type(data) if scale is None.
+    If type is a dict, the integer value is looked up in the dict, and
+    the field is only stored if it is present.
+    post is an optional function called with (payload, analysis, output) after decoding.
+
+    Called with (payload, analysis), where analysis is the comment's CommentAnalysis,
+    or None to analyse it here.
+    """
+
+    def __init__(self, model, fields, post=None):
+        self.model = model
+        self.fields = fields
+        self.post = post
+
+    def __call__(self, payload, analysis=None):
+        try:
+            output = {'model': self.model}
+            if analysis is None:
+                analysis = analyze_comment(payload['comment'])
+
+            # Telemetry should be the first field of the comment
+            _telemetry = analysis.tokens[0]
+
+            for _type, _data in LETTER_NUMBER_TOKENS.findall(_telemetry):
+                _field = self.fields.get(_type)
+                if _field is None:
+                    continue
+
+                (_key, _value_type, _scale) = _field
+                if isinstance(_value_type, dict):
+                    _value = _value_type.get(int(_data))
+                    if _value is not None:
+                        output[_key] = _value
+                elif _scale is None:
+                    output[_key] = _value_type(_data)
+                else:
+                    output[_key] = _value_type(_data) / _scale
+
+            if self.post:
+                self.post(payload, analysis, output)
+
+            return output
+
+        except Exception as e:
+            logging.exception(f"Error extracting telemetry from {self.model} telemetry")
+
+        return {}
+
+
+def rs41hup_no_fix(payload, analysis, output):
+    # Catch some other RS41HUP variants (or other firmware using this device id) sending positions with no GNSS fix
+    if 'SAT=0' in analysis.upper or 'SAT:0' in analysis.upper:
+        output['sats'] = 0
+
+
+# RS41ng - https://github.com/mikaelnousiainen/RS41ng
+# Example: P6S7T29V2947C00 JO00WW - RS41ng radiosonde Toto test
+RS41NG_DECODER = LetterNumberDecoder('RS41ng', {
+    'P': ('frame', int, None),
+    'S': ('sats', int, None),
+    'T': ('temp', int, None),
+    'V': ('batt', int, 1000.0),     # mV
+})
+
+# RS41HUP - https://github.com/whallmann/RS41HUP_V2
+# Example: P809S8T-30V127 RS41 Balloon
+RS41HUP_DECODER = LetterNumberDecoder('RS41HUP', {
+    'P': ('frame', int, None),
+    'S': ('sats', int, None),
+    'T': ('temp', int, None),
+    'V': ('batt', int, 100.0),      # Hundredths of a volt
+}, post=rs41hup_no_fix)
+
+# M20 - https://github.com/sq2ips/m20-custom-firmware
+# Example: C5S6R0T23P10002E-349V2176 M20 radiosonde test
+M20_DECODER = LetterNumberDecoder('M20', {
+    'C': ('frame', int, None),
+    'S': ('sats', int, None),
+    'R': ('gps_restarts', int, None),
+    'T': ('temp', int, None),
+    'E': ('ext_temp', int, 10.0),
+    'P': ('ext_pressure', int, 10.0),
+    'V': ('batt', int, 1000.0),     # mV
+    'A': ('pv_voltage', int, 1000.0),   # mV
+})
+
+# RS41-NFW - https://github.com/Nevvman18/rs41-nfw
+# Example: F123S8V3900C150I25T-30H40P101325J0R4
+NFW_DECODER = LetterNumberDecoder('RS41-NFW', {
+    'F': ('frame', int, None),
+    'S': ('sats', int, None),
+    'V': ('batt', int, 1000.0),     # mV
+    'C': ('ascent_rate', int, 100.0),   # cm/s
+    'I': ('temp', int, None),
+    'T': ('ext_temperature', int, None),
+    'H': ('ext_humidity', int, None),
+    'P': ('ext_pressure', int, 10.0),   # daPa (dekaPascal) -> hPa
+    'J': ('jam_warning', int, None),
+    # PCB revision
+    'R': ('subtype', {2: 'RSM4x1/2 PCB revision', 4: 'RSM4x4/5 PCB revision'}, None),
+})
+
+
+def extract_RS41ng_telemetry(payload, analysis=None):
+    """ Extract telemetry from an RS41ng comment field (see RS41NG_DECODER). """
+    return RS41NG_DECODER(payload, analysis)
+
+
+def extract_RS41HUP_telemetry(payload, analysis=None):
+    """ Extract telemetry from an RS41HUP comment field (see RS41HUP_DECODER). """
+    return RS41HUP_DECODER(payload, analysis)
+
+
+def extract_M20_telemetry(payload, analysis=None):
+    """ Extract telemetry from an M20 SQ2IPS firmware comment field (see M20_DECODER). """
+    return M20_DECODER(payload, analysis)
+
+
+def extract_NFW_telemetry(payload, analysis=None):
+    """ Extract telemetry from an RS41-NFW comment field (see NFW_DECODER). """
+    return NFW_DECODER(payload, analysis)
+
+
+def extract_comment_telemetry(payload, analysis=None):
     """
     Attempts to determine what kind of APRS tracker is in use,
     then attempts to extract telemetry from the comment field.
 
     Takes the payload data to be sent to sondehub as an input, and
     returns a dictionary with any keys to be added or overwritten. 
+    analysis is the CommentAnalysis of the comment, if already made (see comment_analysis.py).
+    Decoders are called with (payload, analysis), and can also be called with just the payload.
     """
 
     try:
@@ -25,40 +163,11 @@ def extract_comment_telemetry(payload):
             # No Comment data, return.
             return {}
 
-        # Detect StratoTrack telemtry via ',StrTrk' in the comment field.
-        if payload['comment'].startswith(',StrTrk'):
-            return extract_stratotrack_telemetry(payload)
-
-        # Detect WB8ELK Skytracker by the toCall
-        if payload['aprs_tocall'].startswith('APELK0'):
-            return extract_wb8elk_skytracker_telemetry(payload)
-
-        # LightAPRS / LightAPRS LoRa
-        if payload['aprs_tocall'] == 'APLIGA' or payload['aprs_tocall'] == 'APLIGP':
-            return extract_lightaprs_telemetry(payload)
-
-        # RS41ng / RS41-NFW
-        if payload['aprs_tocall'] == 'APZ41N' or payload['aprs_tocall'] == 'APZNFW':
-            return extract_RS41ng_telemetry(payload)
-        
-        # RS41HUP (and variants)
-        if payload['aprs_tocall'] == 'APZQAP':
-            return extract_RS41HUP_telemetry(payload)
-
-        # M20 SQ2IPS
-        if payload['aprs_tocall'] == 'APRM20':
-            return extract_M20_telemetry(payload)
-
-        # RS41-NFW
-        if payload['aprs_tocall'] == 'APRNFW':
-            return extract_NFW_telemetry(payload)
-
-        # Detect trackers that are known to send positions with no
-        # GNSS lock, and report this in the comment field as 'S0'
-        if payload['aprs_tocall'] in APRS_S0_TRACKERS:
-            return extract_aprs_s0_telemetry(payload)
-
-
+        _decoder = find_decoder(payload['aprs_tocall'], payload['comment'])
+        if _decoder is not None:
+            if analysis is None:
+                analysis = analyze_comment(payload['comment'])
+            return _decoder(payload, analysis)
 
     except Exception as e:
         logging.exception("Failed extracting comment telemetry")
@@ -67,8 +176,20 @@ def extract_comment_telemetry(payload):
     return {}
 
 
+def find_decoder(tocall, comment):
+    """ Return the telemetry decoder for a tracker, based on its tocall and comment, or None. """
+    for _prefix, _decoder in COMMENT_PREFIX_DECODERS:
+        if comment.startswith(_prefix):
+            return _decoder
+
+    _decoder = TOCALL_PREFIX_DECODERS.get(tocall[:TOCALL_PREFIX_LENGTH])
+    if _decoder is not None:
+        return _decoder
 
-def extract_stratotrack_telemetry(payload):
+    return TOCALL_DECODERS.get(tocall)
+
+
+def extract_stratotrack_telemetry(payload, analysis=None):
     """
     Attempt to extract telemetry from a StratoTrack APRS comment field.
     Example: ",StrTrk,84,9,1.46V,-14C,2127Pa,"
@@ -99,7 +220,7 @@ def extract_stratotrack_telemetry(payload):
     return {}
 
 
-def extract_wb8elk_skytracker_telemetry(payload):
+def extract_wb8elk_skytracker_telemetry(payload, analysis=None):
     """
     Attempt to extract telemetry from a WB8ELK SkyTracker APRS comment field.
     Example: "12 4.34 33 1991 101"
@@ -107,9 +228,11 @@ def extract_wb8elk_skytracker_telemetry(payload):
     """
     try:
         output = {'model': 'WB8ELK SkyTracker'}
+        if analysis is None:
+            analysis = analyze_comment(payload['comment'])
 
-        # Space-delimited fields, but use split with no argument in case of more than one space
-        _fields = payload['comment'].split()
+        # Space-delimited fields, but split on any whitespace in case of more than one space
+        _fields = analysis.tokens
 
         # Only extract data if we have the exact number of expected fields.
         if len(_fields) == 5:
@@ -126,7 +249,7 @@ def extract_wb8elk_skytracker_telemetry(payload):
     return {}
 
 
-def extract_lightaprs_telemetry(payload):
+def extract_lightaprs_telemetry(payload, analysis=None):
     """
     Attempt to extract telemetry from a LightAPRS tracker comment field.
     Example: 015TxC 29.00C 1019.86hPa 4.59V 06S
@@ -135,9 +258,11 @@ def extract_lightaprs_telemetry(payload):
 
     try:
         output = {'model': 'LightAPRS'}
+        if analysis is None:
+            analysis = analyze_comment(payload['comment'])
 
         # Space delimited fields, but sometimes with more than one space.
-        _fields = payload['comment'].split()
+        _fields = analysis.tokens
 
         # Explicitly check for the expected suffix on every field.
         if _fields[0].endswith('TxC'):
@@ -168,201 +293,7 @@ def extract_lightaprs_telemetry(payload):
 
 
 
-def extract_RS41ng_telemetry(payload):
-    """
-    Attempt to extract telemetry from a RS41ng tracker comment field.
-    Example: P6S7T29V2947C00 JO00WW - RS41ng radiosonde Toto test
-    Link: https://github.com/mikaelnousiainen/RS41ng
-    """
-
-    try:
-        output = {'model': 'RS41ng'}
-
-        # Split comment field, telemetry should be the first
-        _fields = payload['comment'].split()
-
-        # Extract telemetry segments
-        pattern = r'([A-Z])(-?\d+)'
-        _matches = re.findall(pattern, _fields[0])
-
-        # Iterate through the found matches, and look for specific identifiers
-        for _telem in _matches:
-            _type = _telem[0]
-            _data = _telem[1]
-
-            if _type == 'P':
-                output['frame'] = int(_data)
-            elif _type == 'S':
-                output['sats'] = int(_data)
-            elif _type == 'T':
-                output['temp'] = int(_data)
-            elif _type == 'V':
-                output['batt'] = int(_data)/1000.0
-
-        return output
-
-    except Exception as e:
-        logging.exception("Error extracting telemetry from RS41ng telemetry")
-
-    return {}
-
-def extract_RS41HUP_telemetry(payload):
-    """
-    Attempt to extract telemetry from a RS41HUP tracker comment field.
-    Example: P809S8T-30V127 RS41 Balloon
-    Link: https://github.com/whallmann/RS41HUP_V2
-    """
-
-    try:
-        output = {'model': 'RS41HUP'}
-
-        # Split comment field, telemetry should be the first
-        _fields = payload['comment'].split()
-
-        # Extract telemetry segments
-        pattern = r'([A-Z])(-?\d+)'
-        _matches = re.findall(pattern, _fields[0])
-
-        # Iterate through the found matches, and look for specific identifiers
-        for _telem in _matches:
-            _type = _telem[0]
-            _data = _telem[1]
-
-            if _type == 'P':
-                output['frame'] = int(_data)
-            elif _type == 'S':
-                output['sats'] = int(_data)
-            elif _type == 'T':
-                output['temp'] = int(_data)
-            elif _type == 'V':
-                output['batt'] = int(_data)/100.0
-
-        # Catch some other RS41HUP variants (or other firmware using this device id) sending positions with no GNSS fix
-        if 'SAT=0' in payload['comment'].upper():
-            output['sats'] = 0
-        
-        if 'SAT:0' in payload['comment'].upper():
-            output['sats'] = 0
-
-        return output
-
-    except Exception as e:
-        logging.exception("Error extracting telemetry from RS41HUP telemetry")
-
-    return {}
-
-def extract_M20_telemetry(payload):
-    """
-    Attempt to extract telemetry from a M20 tracker comment field.
-    Example: C5S6R0T23P10002E-349V2176 M20 radiosonde test
-    Link: https://github.com/sq2ips/m20-custom-firmware
-    """
-
-    try:
-        output = {'model': 'M20'}
-
-        # Split comment field, telemetry should be the first
-        _fields = payload['comment'].split()
-
-        # Extract telemetry segments
-        pattern = r'([A-Z])(-?\d+)'
-        _matches = re.findall(pattern, _fields[0])
-
-        # Iterate through the found matches, and look for specific identifiers
-        for _telem in _matches:
-            _type = _telem[0]
-            _data = _telem[1]
-
-            if _type == 'C':
-                output['frame'] = int(_data)
-            elif _type == 'S':
-                output['sats'] = int(_data)
-            elif _type == 'R':
-                output['gps_restarts'] = int(_data)
-            elif _type == 'T':
-                output['temp'] = int(_data)
-            elif _type == 'E':
-                output['ext_temp'] = int(_data)/10.0
-            elif _type == 'P':
-                output['ext_pressure'] = int(_data)/10.0
-            elif _type == 'V':
-                output['batt'] = int(_data)/1000.0
-            elif _type == 'A':
-                output['pv_voltage'] = int(_data)/1000.0
-
-        return output
-
-    except Exception as e:
-        logging.exception("Error extracting telemetry from M20 telemetry")
-
-    return {}
-
-def extract_NFW_telemetry(payload):
-    """
-    Attempt to extract telemetry from a RS41-NFW tracker comment field.
-    Example: F123S8V3900C150I25T-30H40P101325J0R4
-    F - frame
-    S - sats
-    V - batt (mV -> V)
-    C - ascent_rate (cm/s -> m/s)
-    I - temp
-    T - ext_temperature
-    H - ext_humidity
-    P - ext_pressure (daPa (dekaPascal) -> hPa)
-    J - jam_warning (1 or 0)
-    R - PCB revision (determines model string)
-
-    https://github.com/Nevvman18/rs41-nfw
-    """
-
-    try:
-        # Default model if R is not present
-        output = {'model': 'RS41-NFW'}
-
-        # Split comment field, telemetry should be the first segment
-        _fields = payload['comment'].split()
-
-        # Extract telemetry segments
-        pattern = r'([A-Z])(-?\d+)'
-        _matches = re.findall(pattern, _fields[0])
-
-        for _telem in _matches:
-            _type = _telem[0]
-            _data = _telem[1]
-
-            if _type == 'F':
-                output['frame'] = int(_data)
-            elif _type == 'S':
-                output['sats'] = int(_data)
-            elif _type == 'V':
-                output['batt'] = int(_data) / 1000.0
-            elif _type == 'C':
-                output['ascent_rate'] = int(_data) / 100.0
-            elif _type == 'I':
-                output['temp'] = int(_data)
-            elif _type == 'T':
-                output['ext_temperature'] = int(_data)
-            elif _type == 'H':
-                output['ext_humidity'] = int(_data)
-            elif _type == 'P':
-                output['ext_pressure'] = int(_data) / 10.0
-            elif _type == 'J':
-                output['jam_warning'] = int(_data)
-            elif _type == 'R':
-                rev = int(_data)
-                if rev == 2:
-                    output['subtype'] = 'RSM4x1/2 PCB revision'
-                elif rev == 4:
-                    output['subtype'] = 'RSM4x4/5 PCB revision'
-
-        return output
-
-    except Exception as e:
-        logging.exception("Error extracting telemetry from RS41-NFW telemetry")
-
-    return {}
-
-def extract_aprs_s0_telemetry(payload):
+def extract_aprs_s0_telemetry(payload, analysis=None):
     """
     Special case for a set of APRS tracker firmware (seems to be mainly for RS41s)
     that transmit telemtry information in the comment field in the form:
@@ -393,6 +324,31 @@ def extract_aprs_s0_telemetry(payload):
     return {}
 
 
+# Trackers detected by the start of the comment field.
+COMMENT_PREFIX_DECODERS = (
+    (',StrTrk', extract_stratotrack_telemetry),   # StratoTrack
+)
+
+# Trackers detected by the first TOCALL_PREFIX_LENGTH characters of the tocall.
+TOCALL_PREFIX_LENGTH = 6
+TOCALL_PREFIX_DECODERS = {
+    'APELK0': extract_wb8elk_skytracker_telemetry,    # WB8ELK Skytracker
+}
+
+# Trackers detected by their tocall.
+TOCALL_DECODERS = {
+    'APLIGA': extract_lightaprs_telemetry,    # LightAPRS
+    'APLIGP': extract_lightaprs_telemetry,    # LightAPRS LoRa
+    'APZ41N': RS41NG_DECODER,   # RS41ng
+    'APZNFW': RS41NG_DECODER,   # RS41ng (RS41-NFW)
+    'APZQAP': RS41HUP_DECODER,  # RS41HUP (and variants)
+    'APRM20': M20_DECODER,      # M20 SQ2IPS
+    'APRNFW': NFW_DECODER,      # RS41-NFW
+}
+# Trackers that are known to send positions with no GNSS lock,
+# and report this in the comment field as 'S0'
+TOCALL_DECODERS.update({_tocall: extract_aprs_s0_telemetry for _tocall in APRS_S0_TRACKERS})
+
 
 if __name__ == "__main__":
     # Some test payload data.
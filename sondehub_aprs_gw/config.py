@@ -0,0 +1,185 @@
+#
+#   SondeHub APRS Gateway - Configuration
+#
+#   Gateway settings, read from environment variables (see the README), and
+#   functions creating a Gateway and its upload sinks from them. Used by
+#   __main__.py, the parser worker processes, and the benchmark, replay and
+#   simulator tools.
+#
+import os
+from .aprs_filter import AdaptiveFilter, DEFAULT_BASE_FILTER
+from .filter_rules import DEFAULT_RULES_FILE
+from .gateway import Gateway
+from .logs import setup_logging
+from .sinks import JSONLinesSink, sns_sink, listener_api_sink
+
+VERSION = os.getenv("COMMIT_SHA") if os.getenv("COMMIT_SHA") else "local"
+
+CALLSIGN = os.getenv("CALLSIGN")
+SNS_PAYLOAD = os.getenv("SNS")
+LISTENER_API = "https://api.v2.sondehub.org/amateur/listeners"
+# Where payloads and listener positions are uploaded: 'sns' (payloads only), 'api' (listeners only),
+# 'stdout', 'file:<filename>' (one JSON object per line), or 'none'.
+PAYLOAD_SINK = os.getenv("PAYLOAD_SINK", "sns" if SNS_PAYLOAD else "none")
+LISTENER_SINK = os.getenv("LISTENER_SINK", "api")
+# APRS-IS servers to connect to, as a comma separated list of host[:port]. Lines are taken
+# from whichever server delivers them first.
+APRS_HOST = os.getenv("APRS_HOST", "rotate.aprs.net")
+APRS_PORT = int(os.getenv("APRS_PORT", "14580"))
+# Time (seconds) lines are remembered, to discard copies from other servers.
+APRS_DEDUPE_WINDOW = int(os.getenv("APRS_DEDUPE_WINDOW", "30"))
+# Reconnect to a server if nothing (including its keepalives, every 20 seconds) is received for this long.
+APRS_KEEPALIVE_TIMEOUT = int(os.getenv("APRS_KEEPALIVE_TIMEOUT", "60"))
+# APRS-IS server-side filter. 'adaptive' requests balloons, chase cars and the iGates which have
+# recently relayed balloons. Otherwise this is used as a fixed filter (e.g. t/p for all positions).
+APRS_FILTER = os.getenv("APRS_FILTER", "adaptive")
+APRS_FILTER_BASE = os.getenv("APRS_FILTER_BASE", DEFAULT_BASE_FILTER)
+APRS_FILTER_IGATE_TTL = int(os.getenv("APRS_FILTER_IGATE_TTL", str(24*3600)))
+APRS_FILTER_MAX_LENGTH = int(os.getenv("APRS_FILTER_MAX_LENGTH", "900"))
+# Part of the adaptive filter used for balloons, to receive their telemetry packets. 0 disables adding balloons.
+APRS_FILTER_BALLOON_MAX_LENGTH = int(os.getenv("APRS_FILTER_BALLOON_MAX_LENGTH", "200"))
+TIME_BETWEEN_LISTENER_UPDATES = 600 # 10 minutes
+TIME_BETWEEN_SONDEHUB_MESSAGES = 60*60*4 # 4 hours
+# Outbound APRS message rate limit - average messages/second, and the number which can be sent at once.
+MESSAGE_RATE = float(os.getenv("MESSAGE_RATE", "1"))
+MESSAGE_BURST = int(os.getenv("MESSAGE_BURST", "5"))
+MESSAGE_QUEUE_SIZE = int(os.getenv("MESSAGE_QUEUE_SIZE", "100"))
+STATS_INTERVAL = int(os.getenv("STATS_INTERVAL", "60"))
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_JSON = os.getenv("LOG_FORMAT", "text").lower() == "json"
+# Port to serve Prometheus metrics on. 0 disables the metrics endpoint.
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+# Ingest pipeline settings. With INGEST_WORKERS=0, packets are processed on the
+# APRS-IS socket reading thread.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "10000"))
+INGEST_DROP_POLICY = os.getenv("INGEST_DROP_POLICY", "drop_oldest")
+# Queue balloon and chase-car packets ahead of other position reports, and shed position reports
+# first when overloaded. If 0, all lines share one queue, and INGEST_DROP_POLICY applies.
+INGEST_PRIORITY = os.getenv("INGEST_PRIORITY", "1") == "1"
+INGEST_LATENCY_BUDGET = float(os.getenv("INGEST_LATENCY_BUDGET", "1.0"))
+INGEST_SAMPLE_THRESHOLD = float(os.getenv("INGEST_SAMPLE_THRESHOLD", "0.5"))
+
+# SNS batching settings
+SNS_BATCH_SIZE = int(os.getenv("SNS_BATCH_SIZE", "10"))
+SNS_BATCH_LINGER = float(os.getenv("SNS_BATCH_LINGER", "0.25"))
+SNS_BATCH_IN_FLIGHT = int(os.getenv("SNS_BATCH_IN_FLIGHT", "4"))
+
+# Listener API client settings
+LISTENER_POOL_SIZE = int(os.getenv("LISTENER_POOL_SIZE", "4"))
+LISTENER_TIMEOUT = float(os.getenv("LISTENER_TIMEOUT", "5"))
+LISTENER_COALESCE = os.getenv("LISTENER_COALESCE", "0") == "1"
+
+# Station position store settings
+POSITION_TTL = int(os.getenv("POSITION_TTL", str(4*3600)))
+POSITION_MAX_ENTRIES = int(os.getenv("POSITION_MAX_ENTRIES", "200000"))
+
+# Window (seconds) in which copies of a packet with no timestamp are given the same time.
+RX_TIME_WINDOW = int(os.getenv("RX_TIME_WINDOW", "300"))
+
+# Packet blocking rules file, reloaded when changed or on SIGHUP.
+FILTER_RULES = os.getenv("FILTER_RULES", DEFAULT_RULES_FILE)
+
+# Raw stream capture settings. Capturing is disabled if CAPTURE_DIR is not set.
+CAPTURE_DIR = os.getenv("CAPTURE_DIR")
+CAPTURE_ROTATE = int(os.getenv("CAPTURE_ROTATE", "3600"))
+CAPTURE_MAX_FILES = int(os.getenv("CAPTURE_MAX_FILES", "0"))
+
+# Copies of a balloon packet via other iGates within this window (seconds) reuse the first copy's
+# parsed packet and payload. 0 disables coalescing.
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "0"))
+# 'per_uploader' publishes a payload for each iGate, as without coalescing. 'combined' publishes one
+# payload per packet, when the window expires, with a list of all the iGates which uploaded it.
+COALESCE_MODE = os.getenv("COALESCE_MODE", "per_uploader")
+
+# Decode balloon, chase-car and station positions in the common formats with the gateway's own
+# decoder, falling back to aprslib for anything else. If 0, everything is decoded by aprslib.
+FAST_DECODER = os.getenv("FAST_DECODER", "1") == "1"
+
+# Attach values from APRS telemetry packets (T# frames, scaled by the PARM/UNIT/EQNS/BITS definitions)
+# to the next payload from the sending balloon. Definitions are kept for APRS_TELEMETRY_TTL seconds after
+# a station was last heard, and frames are only attached if newer than APRS_TELEMETRY_FRAME_TTL seconds.
+APRS_TELEMETRY = os.getenv("APRS_TELEMETRY", "1") == "1"
+APRS_TELEMETRY_TTL = int(os.getenv("APRS_TELEMETRY_TTL", str(24*3600)))
+APRS_TELEMETRY_FRAME_TTL = int(os.getenv("APRS_TELEMETRY_FRAME_TTL", "600"))
+APRS_TELEMETRY_MAX_STATIONS = int(os.getenv("APRS_TELEMETRY_MAX_STATIONS", "20000"))
+
+# Number of worker processes for parsing balloon and chase-car packets, sharded by source callsign.
+# If 0 (default), packets are parsed in this process.
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "0"))
+
+# Station positions, message cooldowns, receive times and filter iGates are saved to this SQLite
+# database every STATE_INTERVAL seconds (and on SIGTERM), and loaded on startup. Disabled if not set.
+STATE_FILE = os.getenv("STATE_FILE")
+STATE_INTERVAL = int(os.getenv("STATE_INTERVAL", "60"))
+
+
+def make_sink(spec, upload_type):
+    """ Create the upload sink described by a PAYLOAD_SINK / LISTENER_SINK setting. """
+    if spec == "none":
+        return None
+    if spec == "stdout":
+        return JSONLinesSink(upload_type)
+    if spec.startswith("file:"):
+        return JSONLinesSink(upload_type, spec[len("file:"):])
+    if spec == "sns" and upload_type == "payload":
+        return sns_sink(
+            SNS_PAYLOAD,
+            batch_size=SNS_BATCH_SIZE,
+            max_linger=SNS_BATCH_LINGER,
+            max_in_flight=SNS_BATCH_IN_FLIGHT
+        )
+    if spec == "api" and upload_type == "listener":
+        return listener_api_sink(
+            LISTENER_API,
+            pool_size=LISTENER_POOL_SIZE,
+            timeout=LISTENER_TIMEOUT,
+            coalesce=LISTENER_COALESCE
+        )
+    raise ValueError(f"Unknown {upload_type} sink: {spec}")
+
+def create_gateway(payload_sink=None, listener_sink=None):
+    """ Create a Gateway configured from the environment, uploading to the given sinks. """
+    if APRS_FILTER == "adaptive":
+        aprs_filter = AdaptiveFilter(
+            APRS_FILTER_BASE,
+            ttl=APRS_FILTER_IGATE_TTL,
+            max_length=APRS_FILTER_MAX_LENGTH,
+            balloon_max_length=APRS_FILTER_BALLOON_MAX_LENGTH
+        )
+    else:
+        aprs_filter = None
+    return Gateway(
+        payload_sink=payload_sink,
+        listener_sink=listener_sink,
+        software_version=VERSION,
+        filter_rules_file=FILTER_RULES,
+        aprs_filter=aprs_filter,
+        listener_interval=TIME_BETWEEN_LISTENER_UPDATES,
+        message_cooldown=TIME_BETWEEN_SONDEHUB_MESSAGES,
+        message_rate=MESSAGE_RATE,
+        message_burst=MESSAGE_BURST,
+        message_queue_size=MESSAGE_QUEUE_SIZE,
+        position_ttl=POSITION_TTL,
+        position_max_entries=POSITION_MAX_ENTRIES,
+        rx_time_window=RX_TIME_WINDOW,
+        coalesce_window=COALESCE_WINDOW,
+        coalesce_mode=COALESCE_MODE,
+        fast_decoder=FAST_DECODER,
+        aprs_telemetry=APRS_TELEMETRY,
+        telemetry_ttl=APRS_TELEMETRY_TTL,
+        telemetry_frame_ttl=APRS_TELEMETRY_FRAME_TTL,
+        telemetry_max_entries=APRS_TELEMETRY_MAX_STATIONS
+    )
+
+def setup_shard_worker(results):
+    """
+    Set up a parser worker process (see sharding.py). Uploads, messages and position
+    updates are appended to results, to be carried out by the parent process.
+    Returns the parser.
+    """
+    setup_logging(LOG_LEVEL, LOG_JSON)
+    gateway = create_gateway()
+    gateway.use_shard_outputs(results)
+    return gateway.parser
@@ -0,0 +1,112 @@
+#
+#   SondeHub APRS Gateway - Receive Time Cache
+#
+#   Packets without a timestamp are given the time we first received them, so
+#   that copies of the same packet arriving via multiple iGates are given the
+#   same time. This cache stores that first receive time, keyed on a compact
+#   digest of the packet contents, for a limited time window.
+#
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+def packet_digest(data):
+    """ Compact, fixed-size digest of packet contents (str or bytes), as an int. """
+    if isinstance(data, str):
+        data = data.encode('utf-8', 'surrogateescape')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+class RxTimeCache(object):
+    """
+    Maps packet contents -> first receive time (seconds since epoch), for packets
+    received within the last 'window' seconds.
+    """
+
+    # Columns of the rows returned by snapshot(), for saving state across restarts.
+    SNAPSHOT_COLUMNS = ('digest', 'received')
+
+    def __init__(self, window=300, max_entries=100000, clock=time.time):
+        """
+        window: Time (seconds) during which a repeated packet is treated as a duplicate.
+        max_entries: Hard limit on the number of stored entries.
+        """
+        self.window = window
+        self.max_entries = max_entries
+        self.clock = clock
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._times = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._times)
+
+    def clear(self):
+        with self._lock:
+            self._times.clear()
+
+    def receive_time(self, data):
+        """
+        Return the time the packet contents 'data' was first received, storing
+        the current time if it has not been seen within the window.
+        """
+        _key = packet_digest(data)
+        _now = self.clock()
+        with self._lock:
+            _time = self._times.get(_key)
+            if _time is not None and _now - _time <= self.window:
+                self.hits += 1
+                return _time
+
+            self.misses += 1
+            if _time is not None:
+                # Expired entry for the same contents - reinsert at the end.
+                del self._times[_key]
+            self._times[_key] = _now
+            self._expire(_now)
+            return _now
+
+    def _expire(self, now):
+        # Entries are in insertion (= time) order.
+        _cutoff = now - self.window
+        while self._times:
+            _key, _time = next(iter(self._times.items()))
+            if _time >= _cutoff and len(self._times) <= self.max_entries:
+                break
+            self._times.popitem(last=False)
+            self.evictions += 1
+
+    def snapshot(self):
+        """ Return the cached receive times as a list of rows (see SNAPSHOT_COLUMNS). """
+        with self._lock:
+            # Digests as bytes, as they do not fit in a signed 64 bit integer.
+            return [(_key.to_bytes(8, 'little'), _time) for _key, _time in self._times.items()]
+
+    def restore(self, rows):
+        """ Load receive times from snapshot() rows, skipping any outside the window. Returns the number loaded. """
+        _cutoff = self.clock() - self.window
+        _count = 0
+        with self._lock:
+            for (_digest, _time) in sorted(rows, key=lambda _row: _row[1], reverse=True):
+                _key = int.from_bytes(_digest, 'little')
+                if _time < _cutoff or _key in self._times:
+                    continue
+                self._times[_key] = _time
+                self._times.move_to_end(_key, last=False)
+                _count += 1
+        return _count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._times),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
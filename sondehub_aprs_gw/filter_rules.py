@@ -0,0 +1,279 @@
+#
+#   SondeHub APRS Gateway - Packet Filter Rules
+#
+#   Loads the packet blocking rules from a JSON file, and compiles them into
+#   a matcher which checks a packet against all rules in a few operations.
+#   The rules can be reloaded without restarting the gateway.
+#
+#   Rule types:
+#       tocall_prefix - Destination (tocall) starts with value
+#       fromcall_prefix - Source callsign starts with value
+#       path - value is an element of the path
+#       comment - Comment contains value (or matches the regex in 'pattern', which must not contain named groups)
+#   Comment rules with "tocall_is_from": true only apply if the tocall is the same as the source callsign.
+#
+import json
+import logging
+import os
+import re
+import signal
+import threading
+import time
+
+from .comment_analysis import analyze_comment
+
+DEFAULT_RULES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "filter_rules.json")
+
+RULE_TYPES = ('tocall_prefix', 'fromcall_prefix', 'path', 'comment')
+
+
+def _literals(rules):
+    """
+    Return a list of (value, rule name) if all the rules are plain strings (rather than
+    regexes), or None. Plain strings are found with str.find, which is much faster than
+    a regex search.
+    """
+    if any(_value is None for _name, _regex, _value in rules):
+        return None
+    return [(_value, _name) for _name, _regex, _value in rules]
+
+
+def _first_literal(text, literals):
+    """ Return the name of the rule whose value occurs first in text (the first rule listed, if tied), or None. """
+    _first = None
+    _first_name = None
+    for (_value, _name) in literals:
+        _position = text.find(_value)
+        if _position >= 0 and (_first is None or _position < _first):
+            _first = _position
+            _first_name = _name
+    return _first_name
+
+
+def _alternation(rules):
+    """
+    Compile a list of (rule name, regex) into a single regex, with one named group
+    per rule. Returns the regex, and a dict mapping group name -> rule name.
+    """
+    if not rules:
+        return None, {}
+    _regex = "|".join(f"(?P<_r{_i}>{_rule_regex})" for _i, (_name, _rule_regex) in enumerate(rules))
+    return re.compile(_regex), {f"_r{_i}": _name for _i, (_name, _rule_regex) in enumerate(rules)}
+
+
+class CompiledRules(object):
+    """ An immutable, compiled set of filter rules. """
+
+    def __init__(self, rules):
+        _tocall = []
+        _fromcall = []
+        _comment = []
+        _comment_tocall_is_from = []
+        self.path = {}
+        self.names = []
+
+        for _rule in rules:
+            _name = _rule['name']
+            _type = _rule['type']
+            if _type not in RULE_TYPES:
+                raise ValueError(f"Rule {_name} has unknown type {_type}")
+            if _name in self.names:
+                raise ValueError(f"Duplicate rule name {_name}")
+            self.names.append(_name)
+
+            if _type == 'path':
+                self.path.setdefault(_rule['value'], _name)
+                continue
+
+            _regex = _rule['pattern'] if 'pattern' in _rule else re.escape(_rule['value'])
+            # Check the regex is valid on its own, so we can report which rule is broken.
+            re.compile(_regex)
+
+            if _type == 'tocall_prefix':
+                _tocall.append((_name, _regex))
+            elif _type == 'fromcall_prefix':
+                _fromcall.append((_name, _regex))
+            elif _rule.get('tocall_is_from', False):
+                _comment_tocall_is_from.append((_name, _regex, _rule.get('value') if 'pattern' not in _rule else None))
+            else:
+                _comment.append((_name, _regex, _rule.get('value') if 'pattern' not in _rule else None))
+
+        (self.tocall, self.tocall_names) = _alternation(_tocall)
+        (self.fromcall, self.fromcall_names) = _alternation(_fromcall)
+        (self.comment, self.comment_names) = _alternation([(_name, _regex) for _name, _regex, _value in _comment])
+        (self.comment_tocall_is_from, self.comment_tocall_is_from_names) = _alternation([(_name, _regex) for _name, _regex, _value in _comment_tocall_is_from])
+        # Path elements of the path rules, for checking raw packets (see prefilter.classify()).
+        self.path_bytes = frozenset(_value.encode('latin-1') for _value in self.path)
+        self.comment_literals = _literals(_comment)
+        self.comment_tocall_is_from_literals = _literals(_comment_tocall_is_from)
+
+    def match(self, thing, analysis=None):
+        """
+        Return the name of the first rule which matches a parsed packet, or None.
+        analysis: CommentAnalysis of the packet's comment, made with these rules (see comment_analysis.py).
+                  If not given, the comment is searched here.
+        """
+        _name = self.match_path(thing["path"])
+        if _name is not None:
+            return _name
+
+        if self.tocall:
+            _match = self.tocall.match(thing["to"])
+            if _match:
+                return self.tocall_names[_match.lastgroup]
+
+        if self.fromcall:
+            _match = self.fromcall.match(thing["from"])
+            if _match:
+                return self.fromcall_names[_match.lastgroup]
+
+        _comment = thing.get("comment")
+        if _comment:
+            _tocall_is_from = thing["to"] == thing["from"]
+            if analysis is not None and analysis.rules is self:
+                (_name, _name_tocall_is_from) = (analysis.block_rule, analysis.block_rule_tocall_is_from)
+            else:
+                (_name, _name_tocall_is_from) = self.search_comment(_comment, _tocall_is_from)
+            if _name is not None:
+                return _name
+            if _tocall_is_from:
+                return _name_tocall_is_from
+
+        return None
+
+    def match_path(self, path):
+        """ Return the name of the first path rule matching an element of a packet's path (a list of str), or None. """
+        if self.path:
+            for _element in path:
+                _name = self.path.get(_element)
+                if _name is not None:
+                    return _name
+        return None
+
+    def search_comment(self, comment, tocall_is_from=False):
+        """
+        Return the names of the first comment rule, and the first 'tocall_is_from' comment rule
+        (only checked if tocall_is_from is True) which match a comment, or None.
+        """
+        if self.comment_literals is not None:
+            _name = _first_literal(comment, self.comment_literals)
+        elif self.comment:
+            _match = self.comment.search(comment)
+            _name = self.comment_names[_match.lastgroup] if _match else None
+        else:
+            _name = None
+
+        _name_tocall_is_from = None
+        if tocall_is_from:
+            if self.comment_tocall_is_from_literals is not None:
+                _name_tocall_is_from = _first_literal(comment, self.comment_tocall_is_from_literals)
+            elif self.comment_tocall_is_from:
+                _match = self.comment_tocall_is_from.search(comment)
+                _name_tocall_is_from = self.comment_tocall_is_from_names[_match.lastgroup] if _match else None
+
+        return (_name, _name_tocall_is_from)
+
+
+class FilterRules(object):
+    """
+    Packet filter rules loaded from a file, which are reloaded when the file
+    changes, or on request (e.g. on SIGHUP).
+    """
+
+    def __init__(self, filename=DEFAULT_RULES_FILE, check_interval=10):
+        """
+        filename: JSON rules file.
+        check_interval: Minimum time (seconds) between checks for changes to the file.
+                        0 disables checking for changes.
+        """
+        self.filename = filename
+        self.check_interval = check_interval
+        self.hits = {}
+
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._last_check = time.monotonic()
+        self._reload_requested = False
+        self.rules = None
+        self.reload()
+
+    def reload(self):
+        """
+        Load and compile the rules file. If this fails, the existing rules are kept
+        (unless no rules have been loaded yet, in which case the exception is raised).
+        """
+        try:
+            _mtime = os.stat(self.filename).st_mtime
+            with open(self.filename, 'r') as _f:
+                _rules = CompiledRules(json.load(_f)['rules'])
+        except Exception:
+            if self.rules is None:
+                raise
+            logging.exception(f"Error loading filter rules from {self.filename}, keeping existing rules")
+            return False
+
+        with self._lock:
+            self.rules = _rules
+            self._mtime = _mtime
+            # Keep hit counts for rules which still exist.
+            self.hits = {_name: self.hits.get(_name, 0) for _name in _rules.names}
+
+        logging.info(f"Loaded {len(_rules.names)} filter rules from {self.filename}")
+        return True
+
+    def request_reload(self, *args):
+        """ Reload the rules before the next match. Safe to call from a signal handler. """
+        self._reload_requested = True
+
+    def install_signal_handler(self):
+        """ Reload the rules on SIGHUP. Must be called from the main thread. """
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+
+    def _check_reload(self):
+        _now = time.monotonic()
+        if self._reload_requested:
+            self._reload_requested = False
+            self._last_check = _now
+            self.reload()
+            return
+
+        if self.check_interval > 0 and _now - self._last_check > self.check_interval:
+            self._last_check = _now
+            try:
+                if os.stat(self.filename).st_mtime != self._mtime:
+                    self.reload()
+            except OSError:
+                logging.exception(f"Error checking filter rules file {self.filename}")
+
+    def analyze(self, thing):
+        """ Analyse a parsed packet's comment, including checking it against the comment rules (see comment_analysis.py). """
+        self._check_reload()
+        return analyze_comment(thing.get("comment"), self.rules, thing["to"] == thing["from"])
+
+    def match(self, thing, analysis=None):
+        """
+        Return the name of the first rule which blocks a parsed packet, or None.
+        analysis: Optional CommentAnalysis of the packet's comment, from analyze().
+        """
+        self._check_reload()
+        _name = self.rules.match(thing, analysis)
+        if _name is not None:
+            with self._lock:
+                self.hits[_name] = self.hits.get(_name, 0) + 1
+        return _name
+
+    def match_path(self, path):
+        """
+        Return the name of the first rule which blocks a packet with the given path (a list of str),
+        or None. Used for packets the pre-filter found to be blocked, which are not parsed.
+        """
+        _name = self.rules.match_path(path)
+        if _name is not None:
+            with self._lock:
+                self.hits[_name] = self.hits.get(_name, 0) + 1
+        return _name
+
+    def stats(self):
+        with self._lock:
+            return {_name: _hits for _name, _hits in self.hits.items() if _hits > 0}
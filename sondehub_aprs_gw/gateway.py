@@ -0,0 +1,653 @@
+#
+#   SondeHub APRS Gateway - Gateway
+#
+#   The packet processing path - pre-filtering, parsing, filtering, conversion
+#   to SondeHub payloads and uploading - and the state it keeps (station
+#   positions, message cooldowns, receive times), as a Gateway object.
+#
+#   Uploads go to sinks (see sinks.py), so a Gateway can be created without
+#   connecting to APRS-IS, SNS or the listener API, and fed raw lines directly,
+#   e.g. for benchmarking, profiling or replaying captures:
+#
+#       from sondehub_aprs_gw.gateway import Gateway
+#       from sondehub_aprs_gw.sinks import MemorySink
+#
+#       gateway = Gateway(payload_sink=MemorySink())
+#       gateway.parser(b"F1DZP-11>APZ41N,WIDE1-1,qAO,F6ASP:!5056.48N/00151.60EO021/000/A=013000/P6S7T29V2947C00")
+#       print(gateway.payload_sink.items)
+#
+#   config.py configures a Gateway from the environment, and __main__.py connects it to APRS-IS.
+#
+import datetime
+import functools
+import logging
+import time
+import weakref
+
+import aprslib
+
+from . import position_decoder, prefilter
+from .aprs_telemetry import TelemetryStore, parse_telemetry_line
+from .coalesce import PacketCoalescer, packet_key
+from .comment_telemetry import extract_comment_telemetry
+from .dedupe import RxTimeCache
+from .filter_rules import FilterRules, DEFAULT_RULES_FILE
+from .logs import LazyPformat
+from .messages import MessageSender
+from .metrics import REGISTRY
+from .modified_packets import is_modified_packet
+from .pipeline import StatsLogger
+from .positions import PositionStore
+from .sharding import RemotePublisher, RemotePositions, RemoteMessageSender, RemoteFilter
+from .upstream import FanIn
+
+METRIC_LINES = REGISTRY.counter("lines_total", "Lines received from APRS-IS, by pre-filter class", ["class"])
+METRIC_PARSE_FAILURES = REGISTRY.counter("parse_failures_total", "Packets which could not be parsed", ["reason"])
+METRIC_REJECTS = REGISTRY.counter("balloon_rejects_total", "Balloon-symbol packets rejected, by filter rule", ["reason"])
+METRIC_TELEMETRY = REGISTRY.counter("telemetry_decoded_total", "Packets with comment telemetry decoded, by tracker model", ["model"])
+METRIC_UPLOADS = REGISTRY.counter("uploads_total", "Payloads and listeners uploaded", ["type"])
+METRIC_COALESCED = REGISTRY.counter("coalesced_copies_total", "Copies of balloon packets via other iGates, handled from the first copy")
+METRIC_STAGE_SECONDS = REGISTRY.histogram("stage_seconds", "Time spent in each stage of packet processing", ["stage"])
+PREFILTER_CLASSES = {
+    prefilter.DROP: "drop",
+    prefilter.POSITION: "position",
+    prefilter.BALLOON: "balloon",
+    prefilter.CHASE: "chase",
+    prefilter.TELEMETRY: "telemetry",
+    prefilter.BLOCKED: "blocked",
+}
+# Priority class of each pre-filter class in the ingest pipeline. Dropped and blocked lines are not queued.
+INGEST_CLASSES = ("balloon_chase", "position")
+INGEST_PRIORITIES = {
+    prefilter.BALLOON: 0,
+    prefilter.CHASE: 0,
+    prefilter.POSITION: 1,
+    prefilter.TELEMETRY: 1,
+}
+
+SOFTWARE_NAME = "SondeHub APRS-IS Gateway"
+
+# Gateways which have been started (and not stopped). The gauges below report the total over these,
+# so they are registered once however many gateways are created in the process.
+_STARTED = weakref.WeakSet()
+
+
+def _total(function):
+    """ Sum of function(gateway) over the started gateways. """
+    return sum(function(_gateway) for _gateway in list(_STARTED))
+
+
+REGISTRY.gauge("message_queue_depth", "APRS messages waiting to be sent", lambda: _total(lambda _gateway: _gateway.message_sender.stats()["pending"]))
+REGISTRY.gauge(
+    "aprs_filter_igates",
+    "iGates in the adaptive APRS-IS filter",
+    lambda: _total(lambda _gateway: _gateway.aprs_filter.igates_in_filter if _gateway.aprs_filter else 0)
+)
+REGISTRY.gauge(
+    "aprs_filter_balloons",
+    "Balloons in the adaptive APRS-IS filter",
+    lambda: _total(lambda _gateway: _gateway.aprs_filter.balloons_in_filter if _gateway.aprs_filter else 0)
+)
+REGISTRY.gauge("positions", "Station positions stored", lambda: _total(lambda _gateway: len(_gateway.positions)))
+REGISTRY.gauge("rx_time_cache_entries", "Entries in the receive time cache", lambda: _total(lambda _gateway: len(_gateway.rx_times)))
+
+
+def decode_position(raw, parse=position_decoder.parse):
+    """
+    Decode a position-only update which was stored as a raw packet.
+    This is only done when we actually need the position (i.e. the station
+    has uploaded a balloon packet).
+    """
+    thing = parse(raw)
+    return (
+        thing["latitude"],
+        thing["longitude"],
+        thing["altitude"] if "altitude" in thing else 0,
+        thing["comment"] if "comment" in thing else None
+    )
+
+
+class Gateway(object):
+    """
+    Converts balloon and chase-car packets to SondeHub payloads and listener
+    positions, and uploads them to the given sinks.
+    """
+
+    def __init__(self, payload_sink=None, listener_sink=None, software_version="local", filter_rules_file=DEFAULT_RULES_FILE,
+                 aprs_filter=None, listener_interval=600, message_cooldown=4*3600, message_rate=1.0, message_burst=5,
+                 message_queue_size=100, position_ttl=4*3600, position_max_entries=200000, rx_time_window=300,
+                 coalesce_window=0, coalesce_mode="per_uploader", fast_decoder=True, aprs_telemetry=True,
+                 telemetry_ttl=24*3600, telemetry_frame_ttl=600, telemetry_max_entries=20000, clock=time.time):
+        """
+        payload_sink: Sink for balloon payloads (see sinks.py). Payloads are not uploaded if None.
+        listener_sink: Sink for listener and chase-car positions. Not uploaded if None.
+        software_version: Software version given in uploads.
+        filter_rules_file: Packet blocking rules file (see filter_rules.py).
+        aprs_filter: AdaptiveFilter for the APRS-IS server-side filter, or None for a fixed filter.
+        listener_interval: Minimum time (seconds) between uploads of each listener's position.
+        message_cooldown, message_rate, message_burst, message_queue_size: APRS message settings (see messages.py).
+        position_ttl, position_max_entries: Station position store settings (see positions.py).
+        rx_time_window: Window (seconds) in which copies of a packet with no timestamp are given the same time.
+        coalesce_window: Copies of a balloon packet via other iGates within this window (seconds) reuse the
+                         first copy's parsed packet and payload. 0 disables coalescing.
+        coalesce_mode: 'per_uploader' or 'combined' (see coalesce.py).
+        fast_decoder: Decode common position formats with position_decoder.py, rather than aprslib.
+        aprs_telemetry: Attach values from APRS telemetry packets to payloads (see aprs_telemetry.py).
+        telemetry_ttl, telemetry_frame_ttl, telemetry_max_entries: APRS telemetry store settings.
+        clock: Source of the current time (seconds since epoch).
+        """
+        self.payload_sink = payload_sink
+        self.listener_sink = listener_sink
+        self.software_version = software_version
+        self.listener_interval = listener_interval
+        self.clock = clock
+        self.parse = position_decoder.parse if fast_decoder else aprslib.parse
+
+        self.positions = PositionStore(functools.partial(decode_position, parse=self.parse), ttl=position_ttl, max_entries=position_max_entries, clock=clock)
+        self.message_sender = MessageSender(
+            self.send_aprs,
+            cooldown=message_cooldown,
+            rate=message_rate,
+            burst=message_burst,
+            queue_size=message_queue_size,
+            clock=clock
+        )
+        self.rx_times = RxTimeCache(window=rx_time_window, clock=clock)
+        self.filter_rules = FilterRules(filter_rules_file)
+        if aprs_telemetry:
+            self.telemetry = TelemetryStore(ttl=telemetry_ttl, frame_ttl=telemetry_frame_ttl, max_entries=telemetry_max_entries, clock=clock)
+        else:
+            self.telemetry = None
+        self.aprs_filter = aprs_filter
+        if coalesce_window > 0:
+            self.coalescer = PacketCoalescer(coalesce_window, combine=(coalesce_mode == "combined"), emit=self.publish_combined, clock=clock)
+        else:
+            self.coalescer = None
+
+        # APRS-IS connections (FanIn), also used to send messages. Set up by connect().
+        self.ais = None
+        # Parser worker processes (ShardedParser). If set, dispatch() sends balloon and chase-car packets to them.
+        self.shards = None
+        # StatsLoggers started by start() and connect(), stopped by stop().
+        self.stats_loggers = []
+
+    def set_clock(self, new_clock):
+        """ Use a different source of the current time, e.g. a fake clock when replaying captures. """
+        self.clock = new_clock
+        self.positions.clock = new_clock
+        self.rx_times.clock = new_clock
+        self.message_sender.clock = new_clock
+        if self.aprs_filter:
+            self.aprs_filter.clock = new_clock
+        if self.coalescer:
+            self.coalescer.clock = new_clock
+        if self.telemetry is not None:
+            self.telemetry.clock = new_clock
+
+    def send_aprs(self, line):
+        """ Send a packet to APRS-IS. """
+        if self.ais is None:
+            raise ConnectionError("Not connected to APRS-IS")
+        self.ais.sendall(line)
+
+    def apply_filter(self):
+        """ Send the adaptive filter to APRS-IS if it has changed. Before connecting, connect() sends it. """
+        if self.ais is not None:
+            self.aprs_filter.apply(self.ais)
+
+    def reject_reason(self, thing, analysis=None):
+        """
+        Return the reason a balloon-symbol packet should not be uploaded, or None
+        if it looks like an amateur balloon.
+        analysis: CommentAnalysis of the packet's comment, from filter_rules.analyze().
+        """
+        # Check the packet against the configurable blocking rules (blocked tocalls, fromcalls,
+        # path elements and comment contents). Refer filter_rules.json for the default rules.
+        rule = self.filter_rules.match(thing, analysis)
+        if rule is not None:
+            return rule
+
+        # Detect packets that have been modified by an iGate and block them here.
+        if is_modified_packet(thing, analysis):
+            return "modified_packet"
+
+        # Default case. We have a position report with a balloon symbol, and it's passed the above checks,
+        # so we consider it to be an amateur balloon. Filtering based on altitude will be handled in the tracker.
+        return None
+
+    def isHam(self, thing):
+        return self.reject_reason(thing) is None
+
+    def post_listener(self, body):
+        if self.listener_sink:
+            self.listener_sink.publish(body)
+
+    def classify(self, x):
+        """ Pre-filter a raw line (bytes), with the path blocking rules currently loaded. """
+        return prefilter.classify(x, self.filter_rules.rules.path_bytes)
+
+    def ingest_priority(self, x):
+        """ Return the (ingest priority, pre-filter class) of a line. """
+        packet_class = self.classify(bytes(x))
+        return (INGEST_PRIORITIES.get(packet_class), packet_class)
+
+    def parser(self, x, packet_class=None):
+        x = bytes(x)
+        stage_start = time.perf_counter()
+        if packet_class is None:
+            packet_class = self.classify(x)
+        METRIC_LINES.inc(PREFILTER_CLASSES[packet_class])
+        if packet_class == prefilter.DROP:
+            return
+
+        if packet_class == prefilter.BLOCKED:
+            # A balloon packet which a path rule blocks. Count the rule hit, then store it as a position.
+            reason = self.filter_rules.match_path([_element.decode('latin-1') for _element in prefilter.split_packet(x)[0]])
+            if reason is not None:
+                METRIC_REJECTS.inc(reason)
+            packet_class = prefilter.POSITION
+
+        if packet_class == prefilter.POSITION:
+            # Fast path - we only need this packet for the positions table, so defer
+            # parsing until the position is actually used.
+            self.positions.update_raw(x.split(b'>', 1)[0].decode('latin-1'), x)
+            METRIC_STAGE_SECONDS.observe(time.perf_counter() - stage_start, "position")
+            return
+
+        if packet_class == prefilter.TELEMETRY:
+            if self.telemetry is not None:
+                self.handle_telemetry(x)
+            METRIC_STAGE_SECONDS.observe(time.perf_counter() - stage_start, "telemetry")
+            return
+
+        if self.coalescer and packet_class == prefilter.BALLOON:
+            # Another iGate's copy of a recent packet? Handle it from the first copy, without parsing it.
+            key = packet_key(x)
+            packet = self.coalescer.get(key)
+            if packet is not None:
+                self.process_copy(x, packet, stage_start)
+                return
+        else:
+            key = None
+
+        try:
+            thing = self.parse(x)
+        except aprslib.exceptions.ParseError as e:
+            METRIC_PARSE_FAILURES.inc("parse_error")
+            logging.debug("Error parsing APRS packet (%s): %s", x, e)
+            return
+        except aprslib.exceptions.UnknownFormat as e:
+            METRIC_PARSE_FAILURES.inc("unknown_format")
+            logging.debug("Error parsing APRS packet (%s): %s", x, e)
+            return
+        except Exception as e:
+            METRIC_PARSE_FAILURES.inc("exception")
+            logging.exception(f"Error parsing APRS packet ({str(x)})", exc_info=e)
+            return
+        stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "parse")
+
+        # chase car
+        if 'SHUB' in thing['path'] or 'SHUB1-1' in thing['path']:
+            logging.info("Chase car:")
+            logging.info("%s", thing)
+            try:
+                payload = self.chase_aprs_to_sondehub(thing)
+                if "comment" in thing:
+                    payload['comment'] = thing['comment']
+                logging.info("payload: \n%s\n", LazyPformat(payload))
+            except Exception as e:
+                logging.exception("Error converting to SondeHub payload type", exc_info=e)
+                return
+            try:
+                self.post_listener(payload)
+                METRIC_UPLOADS.inc("chase")
+                logging.info("SNS published!")
+            except:
+                logging.exception("Error publishing to SNS topic")
+            stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "chase")
+
+        # balloons
+        if thing["format"] != "object" and 'symbol' in thing and 'symbol_table' in thing and thing['symbol'] == 'O' and thing['symbol_table'] == "/":
+            packet = self.coalescer.put(key, thing) if key is not None else None
+            if self.process_balloon(thing, stage_start, packet) is None:
+                return
+
+        try:
+            self.positions.update(
+                thing['from'],
+                thing["latitude"],
+                thing["longitude"],
+                thing["altitude"] if "altitude" in thing else 0,
+                thing["comment"] if "comment" in thing else None
+            )
+        except:
+            logging.debug("Could not set location for position update: %s", thing)
+
+    def process_balloon(self, thing, stage_start, packet=None):
+        """
+        Filter, convert and upload a balloon-symbol packet. If packet (a CoalescedPacket)
+        already has a payload, the payload for this copy is made from it rather than
+        converting the packet again.
+        Returns the time the last stage finished, or None if processing stopped on an error.
+        """
+        # The comment is analysed once, for the filter rules, modified packet detection and telemetry extraction.
+        analysis = self.filter_rules.analyze(thing)
+        reason = self.reject_reason(thing, analysis)
+        stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "filter")
+        if reason is not None:
+            METRIC_REJECTS.inc(reason)
+            logging.debug("%s", thing)
+            return stage_start
+
+        logging.info("%s", thing)
+        try:
+            if packet is not None and packet.payload is not None:
+                payload = self.copy_payload(packet.payload, thing)
+            else:
+                payload = self.aprs_to_sondehub(thing, analysis)
+            logging.info("payload: \n%s\n", LazyPformat(payload))
+        except Exception as e:
+            logging.exception("Error converting to SondeHub payload type", exc_info=e)
+            return None
+        stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "convert")
+        if self.aprs_filter:
+            # Make sure we receive position reports from this iGate, so we can upload it as a listener.
+            self.aprs_filter.add(payload["uploader_callsign"])
+            if self.telemetry is not None:
+                # ... and telemetry packets from the payload (in a separate list, which can't push out iGates).
+                self.aprs_filter.add_balloon(thing["from"])
+            self.apply_filter()
+        try:
+            if packet is not None:
+                self.coalescer.set_payload(packet, payload)
+            if packet is not None and self.coalescer.combine:
+                # Published with the other copies when the window expires.
+                self.coalescer.add_uploader(packet, {
+                    "uploader_callsign": payload["uploader_callsign"],
+                    "path": payload["path"],
+                    "time_received": payload["time_received"],
+                })
+            elif self.payload_sink:
+                self.payload_sink.publish(payload)
+                METRIC_UPLOADS.inc("payload")
+                logging.info("SNS queued!")
+            self.message_sender.notify(thing['from'])
+        except:
+            logging.exception("Error publishing to SNS topic")
+        stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "publish")
+
+        # Publish listener information if we can, but only if the payload is above 1500m altitude.
+        # This helps avoid uploading listeners for cars running the balloon icon...
+        try:
+            if (payload["uploader_callsign"] in self.positions) and (thing['altitude'] > 1500.0) :
+                self.upload_listener(payload)
+            else:
+                logging.info('No position info for %s!', payload["uploader_callsign"])
+        except:
+            logging.exception("Failed to update listener")
+            return None
+        return METRIC_STAGE_SECONDS.observe_since(stage_start, "listener")
+
+    def handle_telemetry(self, x):
+        """ Store an APRS telemetry frame, or apply a telemetry definition message. """
+        (kind, callsign, data) = parse_telemetry_line(x)
+        if kind == "frame":
+            self.telemetry.update_frame(callsign, data)
+        else:
+            self.telemetry.update_definition(callsign, *data)
+
+    def process_copy(self, x, packet, stage_start):
+        """
+        Process a copy of a recently received balloon packet (CoalescedPacket), via a different
+        iGate. Only the header is parsed - everything else is taken from the first copy.
+        Path based filter rules are still applied to the copy.
+        """
+        header = x.partition(b':')[0].decode('latin-1')
+        try:
+            thing = dict(packet.thing)
+            thing.update(aprslib.parsing.parse_header(header))
+        except aprslib.exceptions.ParseError as e:
+            METRIC_PARSE_FAILURES.inc("parse_error")
+            logging.debug("Error parsing APRS packet (%s): %s", x, e)
+            return
+        first_raw = packet.thing['raw']
+        thing['raw'] = header + first_raw[first_raw.index(':'):]
+        METRIC_COALESCED.inc()
+        stage_start = METRIC_STAGE_SECONDS.observe_since(stage_start, "coalesce")
+        self.process_balloon(thing, stage_start, packet)
+
+    def copy_payload(self, template, thing):
+        """ Make the payload for a copy of a packet via a different iGate, from the first copy's payload. """
+        payload = dict(template)
+        payload.update({
+            "uploader_callsign": thing["path"][-1],
+            "path": ",".join(thing["path"]),
+            "time_received": datetime.datetime.fromtimestamp(self.clock(), datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "raw": thing["raw"],
+        })
+        return payload
+
+    def publish_combined(self, packet):
+        """ Publish a coalesced packet's payload, with the list of iGates it was received via. """
+        if not self.payload_sink:
+            return
+        payload = dict(packet.payload)
+        payload["uploaders"] = packet.uploaders
+        self.payload_sink.publish(payload)
+        METRIC_UPLOADS.inc("payload")
+        logging.info("SNS queued! (%d uploaders)", len(packet.uploaders))
+
+    def upload_listener(self, payload):
+        callsign = payload['uploader_callsign']
+        position = self.positions.get(callsign)
+        if position is None:
+            return
+        if position.last_upload is None or (self.clock() - position.last_upload) > self.listener_interval:
+            listener = {
+                "software_name" : SOFTWARE_NAME,
+                "software_version": self.software_version,
+
+                "uploader_callsign": callsign,
+                "uploader_position": [
+                    position.latitude,
+                    position.longitude,
+                    position.altitude
+                ],
+                "mobile": False
+            }
+            if position.comment:
+                listener['uploader_radio'] = position.comment
+            self.post_listener(listener)
+            METRIC_UPLOADS.inc("listener")
+            logging.info(listener)
+            logging.info("Listener SNS published!")
+            self.positions.mark_uploaded(callsign)
+
+    def aprs_to_sondehub(self, thing, analysis=None):
+        # use cached time stamp if none provided
+        if "timestamp" not in thing or thing['timestamp'] == 0:
+            non_path_raw = thing['raw'].split(":",1)[1]
+            thing_datetime = datetime.datetime.fromtimestamp(self.rx_times.receive_time(non_path_raw), datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+        else:
+            thing_datetime = datetime.datetime.fromtimestamp(thing["timestamp"], datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+        payload = {
+            "software_name" : SOFTWARE_NAME,
+            "software_version": self.software_version,
+            "uploader_callsign": thing["path"][-1],
+            "path": ",".join(thing["path"]),
+            "time_received": datetime.datetime.fromtimestamp(self.clock(), datetime.timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            "payload_callsign": thing["from"],
+            "datetime": thing_datetime,
+            "lat": thing["latitude"],
+            "lon": thing["longitude"],
+            "alt": thing["altitude"],
+            "comment": thing["comment"] if "comment" in thing  else None,
+            "raw": thing["raw"],
+            "aprs_tocall": thing["to"],
+            "modulation": "APRS"
+        }
+
+        # Attempt to extract any comment-field telemetry
+        telemetry = extract_comment_telemetry(payload, analysis)
+        if telemetry:
+            METRIC_TELEMETRY.inc(telemetry.get("model", "unknown"))
+        payload.update(telemetry)
+
+        # Values from the last APRS telemetry frame sent by the payload, if any. Comment telemetry takes precedence.
+        if self.telemetry is not None:
+            aprs_telemetry = self.telemetry.take(thing["from"], thing["raw"].split(":", 1)[1])
+            if aprs_telemetry:
+                logging.info("APRS telemetry for %s: %s", thing["from"], self.telemetry.describe(thing["from"], aprs_telemetry))
+                for key, value in aprs_telemetry.items():
+                    payload.setdefault(key, value)
+
+        return payload
+
+    def chase_aprs_to_sondehub(self, thing):
+        payload = {
+            "software_name" : SOFTWARE_NAME,
+            "software_version": self.software_version,
+
+            "uploader_callsign": thing['from'],
+            "path": ",".join(thing["path"]),
+            "uploader_position": [
+                thing["latitude"],
+                thing["longitude"],
+                thing["altitude"] if "altitude" in thing else 0
+            ],
+            "uploader_radio": thing["comment"] if "comment" in thing else None,
+            "raw": thing["raw"],
+            "aprs_tocall": thing["to"],
+            "mobile": True
+        }
+
+        return payload
+
+    def dispatch(self, x, packet_class=None):
+        """
+        Send balloon and chase-car packets to the parser worker processes. Everything
+        else is cheap to handle (dropped, or stored as an undecoded position), so is
+        handled here.
+        """
+        x = bytes(x)
+        if packet_class is None:
+            packet_class = self.classify(x)
+        if packet_class in (prefilter.BALLOON, prefilter.CHASE, prefilter.TELEMETRY):
+            METRIC_LINES.inc(PREFILTER_CLASSES[packet_class])
+            self.shards.submit(x)
+        else:
+            self.parser(x, packet_class)
+
+    def use_shard_outputs(self, results):
+        """
+        Set up this gateway to run in a parser worker process. Uploads, messages and
+        position updates are appended to results, to be carried out by
+        handle_shard_output() in the parent process.
+        """
+        self.payload_sink = RemotePublisher(results)
+        self.listener_sink = RemotePublisher(results, "post_listener")
+        self.positions = RemotePositions(results)
+        self.message_sender = RemoteMessageSender(results)
+        if self.aprs_filter:
+            self.aprs_filter = RemoteFilter(results)
+        if self.coalescer:
+            self.coalescer.start()
+        self.upload_listener = lambda payload: results.append(("upload_listener", payload))
+
+    def handle_shard_output(self, kind, *args):
+        """ Carry out an upload, message or position update from a parser worker process. """
+        if kind == "publish":
+            if self.payload_sink:
+                self.payload_sink.publish(args[0])
+                METRIC_UPLOADS.inc("payload")
+        elif kind == "post_listener":
+            self.post_listener(args[0])
+            METRIC_UPLOADS.inc("chase")
+        elif kind == "upload_listener":
+            if args[0]["uploader_callsign"] in self.positions:
+                self.upload_listener(args[0])
+        elif kind == "message":
+            self.message_sender.notify(args[0])
+        elif kind == "igate":
+            if self.aprs_filter:
+                self.aprs_filter.add(args[0])
+                self.apply_filter()
+        elif kind == "balloon":
+            if self.aprs_filter:
+                self.aprs_filter.add_balloon(args[0])
+                self.apply_filter()
+        elif kind == "position":
+            self.positions.update(*args)
+        elif kind == "position_raw":
+            self.positions.update_raw(*args)
+        else:
+            logging.warning(f"Unknown output from parser worker: {kind}")
+
+    def log_stats(self, name, source, stats_interval):
+        """ Periodically log the statistics of source, until the gateway is stopped. """
+        self.stats_loggers.append(StatsLogger(name, source, stats_interval).start())
+
+    def start(self, stats_interval=60):
+        """
+        Start sending messages and flushing coalesced packets, periodically log statistics,
+        and include this gateway's state in the gauge metrics.
+        """
+        for (_name, _sink) in (("Payload sink", self.payload_sink), ("Listener sink", self.listener_sink)):
+            if hasattr(_sink, "stats"):
+                self.log_stats(_name, _sink, stats_interval)
+        self.log_stats("Position store", self.positions, stats_interval)
+        self.log_stats("Receive time cache", self.rx_times, stats_interval)
+        self.log_stats("Filter rule hits", self.filter_rules, stats_interval)
+        if self.telemetry is not None:
+            self.log_stats("APRS telemetry", self.telemetry, stats_interval)
+        self.message_sender.start()
+        self.log_stats("Message sender", self.message_sender, stats_interval)
+        if self.coalescer:
+            self.coalescer.start()
+            self.log_stats("Coalescer", self.coalescer, stats_interval)
+        if self.aprs_filter:
+            self.log_stats("APRS-IS filter", self.aprs_filter, stats_interval)
+        _STARTED.add(self)
+        return self
+
+    def connect(self, servers, callsign, callback=None, filter="", window=30, keepalive_timeout=60, stats_interval=60):
+        """
+        Connect to APRS-IS, and pass the lines received to callback (parser() by default).
+        servers: List of (host, port) of the APRS-IS servers (see upstream.FanIn).
+        filter: Server-side filter, if no adaptive filter is used.
+        window: Time (seconds) lines are remembered, to discard copies from other servers.
+        """
+        self.ais = FanIn(
+            servers,
+            callsign,
+            callback if callback else self.parser,
+            window=window,
+            keepalive_timeout=keepalive_timeout,
+            software_version=self.software_version
+        )
+        if self.aprs_filter:
+            self.aprs_filter.apply(self.ais, force=True)
+        else:
+            self.ais.set_filter(filter)
+        self.ais.start()
+        self.log_stats("APRS-IS", self.ais, stats_interval)
+        return self.ais
+
+    def stop(self):
+        """ Disconnect from APRS-IS, stop the background threads and worker processes, and close the sinks. """
+        _STARTED.discard(self)
+        for _logger in self.stats_loggers:
+            _logger.stop()
+        self.stats_loggers = []
+        if self.ais:
+            self.ais.stop()
+        if self.shards:
+            self.shards.stop()
+        self.message_sender.stop()
+        if self.coalescer:
+            self.coalescer.stop()
+        for _sink in (self.payload_sink, self.listener_sink):
+            if hasattr(_sink, "close"):
+                _sink.close()
+
@@ -0,0 +1,232 @@
+#
+#   SondeHub APRS Gateway - Listener API Client
+#
+#   Keep-alive HTTP(S) client for uploading listener and chase-car positions,
+#   with a bounded connection pool, its own timeouts, and optional coalescing
+#   of several uploads into a single PUT.
+#
+#   As an upload sink, uploads are queued and sent from background threads,
+#   so publish() never waits on the network (it may be called on the APRS-IS
+#   event loop thread).
+#
+import http.client
+import json
+import logging
+import queue
+import threading
+import time
+import urllib.parse
+from .metrics import REGISTRY
+
+METRIC_PUT_SECONDS = REGISTRY.histogram("listener_put_seconds", "Listener API PUT request latency")
+METRIC_PUT_ERRORS = REGISTRY.counter("listener_put_errors_total", "Failed listener API requests")
+METRIC_DROPPED = REGISTRY.counter("listener_uploads_dropped_total", "Listener uploads dropped due to a full upload queue")
+
+# Longest time (seconds) an idle sender thread waits for an upload before checking whether the client has been closed.
+STOP_POLL_INTERVAL = 0.1
+
+
+class ListenerClient(object):
+    """
+    Uploads listener/chase-car positions to the SondeHub listeners API.
+    """
+
+    def __init__(self, url, pool_size=4, timeout=5, coalesce=False, coalesce_window=1.0, max_batch=20, queue_size=1000):
+        """
+        url: Listener API URL.
+        pool_size: Maximum number of concurrent connections (and therefore requests), and of
+                   threads sending uploads queued by publish().
+        timeout: Connect/read timeout (seconds) for each request, and the longest time
+                 to wait for a free connection.
+        coalesce: If True, uploads are buffered and sent as a list in a single PUT.
+        coalesce_window: Maximum time (seconds) an upload is buffered when coalescing.
+        max_batch: Maximum number of uploads in a single coalesced PUT.
+        queue_size: Maximum number of uploads waiting to be sent by publish(). Further uploads are dropped.
+        """
+        _url = urllib.parse.urlsplit(url)
+        self.scheme = _url.scheme
+        self.host = _url.hostname
+        self.port = _url.port
+        self.path = _url.path or "/"
+        if _url.query:
+            self.path += "?" + _url.query
+
+        self.timeout = timeout
+        self.coalesce = coalesce
+        self.coalesce_window = coalesce_window
+        self.max_batch = max_batch
+
+        self.requests_sent = 0
+        self.requests_failed = 0
+        self.uploads_sent = 0
+        self.uploads_dropped = 0
+        self.connections_opened = 0
+
+        self._lock = threading.Lock()
+        # Pool slots - either an open connection, or None (not yet connected).
+        self._pool = queue.LifoQueue()
+        for i in range(pool_size):
+            self._pool.put(None)
+
+        self._running = True
+        if self.coalesce:
+            self._buffer = []
+            self._cond = threading.Condition(self._lock)
+            self._thread = threading.Thread(target=self._coalesce_loop, name="listener-coalesce", daemon=True)
+            self._thread.start()
+        else:
+            self._queue = queue.Queue(maxsize=queue_size)
+            self._senders = [threading.Thread(target=self._send_loop, name=f"listener-sender-{i}", daemon=True) for i in range(pool_size)]
+            for _sender in self._senders:
+                _sender.start()
+
+    def put(self, body):
+        """ Upload a listener (dict), waiting for the request to complete. Raises an exception on failure, unless coalescing. """
+        if self.coalesce:
+            with self._cond:
+                self._buffer.append(body)
+                if len(self._buffer) == 1 or len(self._buffer) >= self.max_batch:
+                    self._cond.notify()
+            return
+
+        self._request(body)
+        self._count(uploads_sent=1)
+
+    def publish(self, body):
+        """ Upload sink interface (see sinks.py). Queues a listener (dict) to be uploaded, without waiting. """
+        if self.coalesce:
+            self.put(body)
+            return
+        try:
+            self._queue.put_nowait(body)
+        except queue.Full:
+            self._count(uploads_dropped=1)
+            METRIC_DROPPED.inc()
+            logging.warning("Listener upload queue full, dropped upload")
+
+    def close(self, timeout=5):
+        """ Stop the sender threads once the queued (or buffered) uploads have been sent (or the timeout expires). """
+        if self.coalesce:
+            with self._cond:
+                self._running = False
+                self._cond.notify()
+            self._thread.join(timeout)
+            return
+        self._running = False
+        for _sender in self._senders:
+            _sender.join(timeout)
+
+    def _send_loop(self):
+        while True:
+            try:
+                _body = self._queue.get(timeout=STOP_POLL_INTERVAL)
+            except queue.Empty:
+                if not self._running:
+                    return
+                continue
+            try:
+                self._request(_body)
+                self._count(uploads_sent=1)
+            except Exception:
+                logging.exception("Error uploading listener")
+
+    def _coalesce_loop(self):
+        while True:
+            with self._cond:
+                while not self._buffer:
+                    if not self._running:
+                        return
+                    self._cond.wait()
+                _deadline = time.monotonic() + self.coalesce_window
+                # Once closed, the remaining uploads are sent without waiting for batches to fill.
+                while self._running and len(self._buffer) < self.max_batch:
+                    _wait = _deadline - time.monotonic()
+                    if _wait <= 0:
+                        break
+                    self._cond.wait(_wait)
+                _batch = self._buffer[:self.max_batch]
+                self._buffer = self._buffer[self.max_batch:]
+
+            try:
+                self._request(_batch)
+                self._count(uploads_sent=len(_batch))
+            except Exception:
+                logging.exception(f"Error uploading {len(_batch)} coalesced listeners")
+
+    def _connect(self):
+        if self.scheme == "https":
+            _conn = http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        else:
+            _conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self._count(connections_opened=1)
+        return _conn
+
+    def _request(self, body):
+        _data = json.dumps(body).encode('utf-8')
+        _headers = {
+            'Content-Type': 'application/json; charset=utf-8',
+            'Content-Length': str(len(_data))
+        }
+
+        _start = time.perf_counter()
+        try:
+            _conn = self._pool.get(timeout=self.timeout)
+        except queue.Empty:
+            self._count(requests_failed=1)
+            METRIC_PUT_ERRORS.inc()
+            raise TimeoutError("No listener API connection available")
+
+        try:
+            # A kept-alive connection may have been closed by the server, so allow
+            # one retry on a fresh connection.
+            for _attempt in range(2):
+                _reused = _conn is not None
+                if _conn is None:
+                    _conn = self._connect()
+                try:
+                    _conn.request('PUT', self.path, body=_data, headers=_headers)
+                    _response = _conn.getresponse()
+                    _response_body = _response.read()
+                except (http.client.HTTPException, ConnectionError) as e:
+                    _conn.close()
+                    _conn = None
+                    if _reused:
+                        continue
+                    raise
+                except Exception:
+                    _conn.close()
+                    _conn = None
+                    raise
+
+                if _response.will_close:
+                    _conn.close()
+                    _conn = None
+
+                self._count(requests_sent=1)
+                if _response.status >= 400:
+                    raise http.client.HTTPException(f"Listener API returned {_response.status}: {_response_body[:200]}")
+                logging.debug("Listener API response: %d", _response.status)
+                return
+        except Exception:
+            self._count(requests_failed=1)
+            METRIC_PUT_ERRORS.inc()
+            raise
+        finally:
+            self._pool.put(_conn)
+            METRIC_PUT_SECONDS.observe_since(_start)
+
+    def _count(self, **counts):
+        with self._lock:
+            for _name, _value in counts.items():
+                setattr(self, _name, getattr(self, _name) + _value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests_sent": self.requests_sent,
+                "requests_failed": self.requests_failed,
+                "uploads_sent": self.uploads_sent,
+                "uploads_dropped": self.uploads_dropped,
+                "connections_opened": self.connections_opened,
+                "buffered": len(self._buffer) if self.coalesce else self._queue.qsize(),
+            }
@@ -0,0 +1,111 @@
+#
+#   SondeHub APRS Gateway - Logging Setup
+#
+#   Log records are handed to a background thread via a queue, so that
+#   formatting them and writing to stdout never block packet processing.
+#
+import json
+import logging
+import logging.handlers
+import pprint
+import queue
+
+
+class CustomFormatter(logging.Formatter):
+
+    grey = "\x1b[2m"
+    green = "\x1b[32;20m"
+    yellow = "\x1b[33;20m"
+    red = "\x1b[31;20m"
+    bold_red = "\x1b[31;1m"
+    reset = "\x1b[0m"
+    format_string = "%(asctime)s - %(name)s - %(levelname)s - %(message)s (%(filename)s:%(lineno)d)"
+
+    FORMATS = {
+        logging.DEBUG: grey + format_string + reset,
+        logging.INFO: green + format_string + reset,
+        logging.WARNING: yellow + format_string + reset,
+        logging.ERROR: red + format_string + reset,
+        logging.CRITICAL: bold_red + format_string + reset
+    }
+
+    def __init__(self):
+        super().__init__()
+        self.formatters = {_level: logging.Formatter(_format) for _level, _format in self.FORMATS.items()}
+        self.default_formatter = logging.Formatter(self.format_string)
+
+    def format(self, record):
+        return self.formatters.get(record.levelno, self.default_formatter).format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    """ Formats each record as a single line JSON object. """
+
+    def format(self, record):
+        _entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "location": f"{record.filename}:{record.lineno}",
+        }
+        if record.exc_info:
+            _entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            _entry["exception"] = record.exc_text
+        return json.dumps(_entry)
+
+
+class LazyPformat(object):
+    """ Pretty-prints an object only if the log message is actually formatted. """
+    __slots__ = ('obj',)
+
+    def __init__(self, obj):
+        self.obj = obj
+
+    def __str__(self):
+        return pprint.pformat(self.obj)
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records as they are, so that the message, its arguments (e.g. LazyPformat)
+    and any exception are formatted on the listener thread, and formatters still see
+    exc_info. The default QueueHandler formats the record on the logging thread.
+    Objects passed as arguments must not be changed after they are logged.
+    """
+
+    def prepare(self, record):
+        return record
+
+
+def setup_logging(level=logging.INFO, json_format=False):
+    """
+    Send all log records through a queue to a stream handler running on a
+    background thread. Returns the QueueListener, which should be stopped on
+    exit to flush any queued records.
+
+    level may be a level number, or name (e.g. 'DEBUG').
+    """
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+        if not isinstance(level, int):
+            raise ValueError(f"Unknown log level: {level}")
+
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(JSONFormatter() if json_format else CustomFormatter())
+
+    _queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(_queue, _handler, respect_handler_level=True)
+
+    _root = logging.getLogger()
+    _root.setLevel(level)
+    # Replace any default handler added by logging before this was called.
+    for _existing in list(_root.handlers):
+        _root.removeHandler(_existing)
+    _root.addHandler(DeferredQueueHandler(_queue))
+    logging.getLogger("aprslib").setLevel(max(level, logging.INFO))
+    logging.getLogger("botocore").setLevel(max(level, logging.WARNING))
+
+    _listener.start()
+    return _listener
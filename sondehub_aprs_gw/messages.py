@@ -0,0 +1,208 @@
+#
+#   SondeHub APRS Gateway - Outbound APRS Messages
+#
+#   Balloon callsigns are sent an APRS message pointing them to their SondeHub
+#   tracker page, at most once per cooldown period. Messages are queued and
+#   sent from their own thread, so a slow APRS-IS connection never holds up
+#   packet processing, and sends are rate limited so a burst of launches does
+#   not flood APRS-IS.
+#
+import logging
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+from .metrics import REGISTRY
+
+METRIC_SENT = REGISTRY.counter("messages_sent_total", "APRS messages sent to balloon callsigns")
+METRIC_FAILED = REGISTRY.counter("messages_failed_total", "APRS messages which could not be sent")
+METRIC_DROPPED = REGISTRY.counter("messages_dropped_total", "APRS messages dropped due to a full queue")
+
+MESSAGE_URL = "https://amateur.sondehub.org/"
+
+
+def format_message(callsign, source="SHUB"):
+    """ Build the APRS-IS line for a message to callsign. """
+    return f"{source}>APRS,TCPIP*::{callsign.ljust(9, ' ')}:Live on {MESSAGE_URL}{callsign}"
+
+
+class MessageSender(object):
+    """
+    Queues and sends messages to balloon callsigns, with a per-callsign cooldown
+    and a global rate limit.
+    """
+
+    # Columns of the rows returned by snapshot(), for saving state across restarts.
+    SNAPSHOT_COLUMNS = ('callsign', 'messaged')
+
+    def __init__(self, send, cooldown=4*3600, rate=1.0, burst=5, queue_size=100, max_callsigns=10000, clock=time.time):
+        """
+        send: Function which sends a line to APRS-IS (e.g. aprslib.IS.sendall).
+        cooldown: Minimum time (seconds) between messages to the same callsign.
+        rate: Maximum average rate of messages sent (messages/second).
+        burst: Number of messages which can be sent at once, before the rate limit applies.
+        queue_size: Maximum number of messages waiting to be sent. Further messages are dropped.
+        max_callsigns: Maximum number of callsigns remembered for the cooldown. The least recently
+                       messaged are forgotten first.
+        clock: Function returning the current time, used for the cooldown.
+        """
+        self.send = send
+        self.cooldown = cooldown
+        self.rate = rate
+        self.burst = burst
+        self.max_callsigns = max_callsigns
+        self.clock = clock
+
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.suppressed = 0
+        self.evicted = 0
+
+        # callsign -> time the last message was queued. Insertion order is oldest -> newest.
+        self._last_messaged = OrderedDict()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._tokens = float(burst)
+        self._last_refill = time.monotonic()
+
+    def notify(self, callsign):
+        """
+        Message callsign, unless it has been messaged within the cooldown. Never blocks.
+        Until start() is called, the message is sent immediately on the calling thread,
+        without rate limiting (e.g. when replaying captures).
+        Returns True if a message was queued or sent.
+        """
+        _now = self.clock()
+        with self._lock:
+            self._expire(_now)
+            _last = self._last_messaged.get(callsign)
+            if _last is not None and _now - _last < self.cooldown:
+                self.suppressed += 1
+                return False
+            self._last_messaged.pop(callsign, None)
+            self._last_messaged[callsign] = _now
+            while len(self._last_messaged) > self.max_callsigns:
+                self._last_messaged.popitem(last=False)
+                self.evicted += 1
+
+        if self._thread is None:
+            self._send(callsign)
+            return True
+
+        try:
+            self._queue.put_nowait(callsign)
+        except queue.Full:
+            self._forget(callsign)
+            with self._lock:
+                self.dropped += 1
+            METRIC_DROPPED.inc()
+            return False
+        with self._lock:
+            self.queued += 1
+        return True
+
+    def _expire(self, now):
+        """ Forget callsigns whose cooldown has finished. """
+        _cutoff = now - self.cooldown
+        while self._last_messaged:
+            _callsign, _last = next(iter(self._last_messaged.items()))
+            if _last >= _cutoff:
+                break
+            del self._last_messaged[_callsign]
+
+    def _forget(self, callsign):
+        """ Allow callsign to be messaged again, after a failed or dropped message. """
+        with self._lock:
+            self._last_messaged.pop(callsign, None)
+
+    def _send(self, callsign):
+        _line = format_message(callsign)
+        try:
+            self.send(_line)
+        except Exception as e:
+            logging.warning(f"Could not send APRS message to {callsign}: {e}")
+            self._forget(callsign)
+            with self._lock:
+                self.failed += 1
+            METRIC_FAILED.inc()
+            return
+        logging.info("Sent APRS message: %s", _line)
+        with self._lock:
+            self.sent += 1
+        METRIC_SENT.inc()
+
+    def _wait_for_token(self):
+        """ Token bucket rate limit. """
+        while True:
+            _now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (_now - self._last_refill) * self.rate)
+            self._last_refill = _now
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return
+            time.sleep((1.0 - self._tokens) / self.rate)
+
+    def _run(self):
+        while True:
+            _callsign = self._queue.get()
+            if _callsign is None:
+                return
+            self._wait_for_token()
+            self._send(_callsign)
+
+    def start(self):
+        """ Start sending queued messages from a background thread. """
+        self._thread = threading.Thread(target=self._run, name="message-sender", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Send any queued messages, and stop the sending thread. """
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+
+    def clear(self):
+        """ Forget all callsigns. """
+        with self._lock:
+            self._last_messaged.clear()
+
+    def snapshot(self):
+        """ Return the callsigns in their cooldown as a list of rows (see SNAPSHOT_COLUMNS). """
+        with self._lock:
+            return list(self._last_messaged.items())
+
+    def restore(self, rows):
+        """ Load callsigns from snapshot() rows, skipping any whose cooldown has finished. Returns the number loaded. """
+        _cutoff = self.clock() - self.cooldown
+        _count = 0
+        with self._lock:
+            for (_callsign, _messaged) in sorted(rows, key=lambda _row: _row[1], reverse=True):
+                if _messaged < _cutoff or _callsign in self._last_messaged:
+                    continue
+                self._last_messaged[_callsign] = _messaged
+                self._last_messaged.move_to_end(_callsign, last=False)
+                _count += 1
+            while len(self._last_messaged) > self.max_callsigns:
+                self._last_messaged.popitem(last=False)
+                self.evicted += 1
+        return _count
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.queued,
+                "sent": self.sent,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "suppressed": self.suppressed,
+                "pending": self._queue.qsize(),
+                "callsigns": len(self._last_messaged),
+                "evicted": self.evicted,
+            }
@@ -0,0 +1,220 @@
+#
+#   SondeHub APRS Gateway - Metrics
+#
+#   Lightweight counters, gauges and histograms, which can be exposed in the
+#   Prometheus text format over HTTP, and summarised in the logs.
+#   Recording a value is a dict lookup and an addition under a lock, so these
+#   can be left enabled at full feed rate.
+#
+import bisect
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Default histogram buckets (seconds), suited to per-packet processing and API call latencies.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_string(labelnames, values, extra=None):
+    _pairs = [(_name, _escape(_value)) for _name, _value in zip(labelnames, values)]
+    if extra:
+        _pairs.append(extra)
+    if not _pairs:
+        return ""
+    return "{" + ",".join(f'{_name}="{_value}"' for _name, _value in _pairs) + "}"
+
+
+class Counter(object):
+    """ A monotonically increasing count, optionally split by label values. """
+    type_name = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            _values = dict(self._values)
+        for _labels, _value in sorted(_values.items()):
+            yield self.name, _label_string(self.labelnames, _labels), _value
+
+    def summary(self):
+        with self._lock:
+            if not self.labelnames:
+                return self._values.get((), 0)
+            return {",".join(_labels): _value for _labels, _value in sorted(self._values.items())}
+
+
+class Gauge(object):
+    """
+    A value read from a function when the metrics are collected. The function
+    may return a number, or a dict of {label value: number} if labelnames has one entry.
+    """
+    type_name = "gauge"
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        _value = self.function()
+        if isinstance(_value, dict):
+            for _label, _label_value in sorted(_value.items()):
+                yield self.name, _label_string(self.labelnames, (_label,)), _label_value
+        else:
+            yield self.name, "", _value
+
+    def summary(self):
+        return self.function()
+
+
+class Histogram(object):
+    """ Distribution of observed values (e.g. latencies), optionally split by label values. """
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labels -> [bucket counts..., sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        _index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            _value = self._values.get(labelvalues)
+            if _value is None:
+                _value = [0] * (len(self.buckets) + 3)
+                self._values[labelvalues] = _value
+            _value[_index] += 1
+            _value[-2] += value
+            _value[-1] += 1
+
+    def observe_since(self, start, *labelvalues):
+        """ Observe the time elapsed since start (from time.perf_counter()), and return the current time. """
+        _now = time.perf_counter()
+        self.observe(_now - start, *labelvalues)
+        return _now
+
+    def samples(self):
+        with self._lock:
+            _values = {_labels: list(_value) for _labels, _value in self._values.items()}
+        for _labels, _value in sorted(_values.items()):
+            _cumulative = 0
+            for _bound, _count in zip(self.buckets, _value):
+                _cumulative += _count
+                yield self.name + "_bucket", _label_string(self.labelnames, _labels, ("le", repr(float(_bound)))), _cumulative
+            yield self.name + "_bucket", _label_string(self.labelnames, _labels, ("le", "+Inf")), _value[-1]
+            yield self.name + "_sum", _label_string(self.labelnames, _labels), _value[-2]
+            yield self.name + "_count", _label_string(self.labelnames, _labels), _value[-1]
+
+    def summary(self):
+        """ Count and mean of observations for each set of labels. """
+        with self._lock:
+            _summary = {
+                ",".join(_labels): {"count": _value[-1], "mean": _value[-2] / _value[-1]}
+                for _labels, _value in sorted(self._values.items()) if _value[-1]
+            }
+        if not self.labelnames:
+            return _summary.get("", {"count": 0})
+        return _summary
+
+
+class Registry(object):
+    """ A collection of metrics. """
+
+    def __init__(self, prefix="sondehub_aprs_gw_"):
+        self.prefix = prefix
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(self.prefix + name, documentation, labelnames))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        return self._register(Gauge(self.prefix + name, documentation, function, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self.prefix + name, documentation, labelnames, buckets))
+
+    def render(self):
+        """ Render all metrics in the Prometheus text exposition format. """
+        with self._lock:
+            _metrics = list(self._metrics.values())
+        _lines = []
+        for _metric in _metrics:
+            _lines.append(f"# HELP {_metric.name} {_metric.documentation}")
+            _lines.append(f"# TYPE {_metric.name} {_metric.type_name}")
+            try:
+                for _name, _labels, _value in _metric.samples():
+                    _lines.append(f"{_name}{_labels} {_value}")
+            except Exception:
+                logging.exception(f"Error collecting metric {_metric.name}")
+        return "\n".join(_lines) + "\n"
+
+    def stats(self):
+        """ Compact summary of all metrics, for logging. """
+        with self._lock:
+            _metrics = list(self._metrics.values())
+        _stats = {}
+        for _metric in _metrics:
+            try:
+                _summary = _metric.summary()
+            except Exception:
+                continue
+            if _summary:
+                _stats[_metric.name[len(self.prefix):]] = _summary
+        return _stats
+
+
+# Default registry, used by all modules of the gateway.
+REGISTRY = Registry()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        _body = self.server.registry.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_metrics_server(port, host="", registry=REGISTRY):
+    """ Serve the metrics on http://host:port/metrics from a background thread. """
+    _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    _server.daemon_threads = True
+    _server.registry = registry
+    threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+    logging.info(f"Serving metrics on port {_server.server_address[1]}")
+    return _server
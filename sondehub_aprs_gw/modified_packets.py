@@ -5,37 +5,23 @@
 #
 import logging
 
+from .comment_analysis import analyze_comment
 
-def is_modified_packet(payload):
+
+def is_modified_packet(payload, analysis=None):
     """ 
     Determine if a packet has been modified by an iGate.
     The primary example of this is LoRa iGates that add RSSI/SNR metadata onto the end of comments.
+    analysis: CommentAnalysis of the packet's comment, if already made (see comment_analysis.py).
     """
 
     try:
-        # No comment, can't do much
-        if payload['comment'] is None:
-            return False
-        
-        # LoRa APRS iGate detection
-        # Detect the presence of RSSI, SNR and dB within the comment.
-        _comment_upper = payload['comment'].upper()
-        if ('RSSI' in _comment_upper) and ('SNR' in _comment_upper) and ('DB' in _comment_upper):
-            return True
-        
-        if ('RSSI=' in _comment_upper) and ('SNR=' in _comment_upper):
-            return True
-        
-        # Check for comments with a "DS -15.75 RS -106" construct on the end
-        try:
-            _fields = payload['comment'].rstrip().split(" ")
-            if (_fields[-2] == "RS") and (_fields[-4] == "DS"):
-                _rssi = float(_fields[-1])
-                _snr = float(_fields[-3])
-                return True
-        except:
-            pass
+        if analysis is None:
+            analysis = analyze_comment(payload['comment'])
 
+        # RSSI/SNR metadata and 'DS x RS y' tails are detected by the comment analysis.
+        # A packet with no comment is never treated as modified.
+        return analysis.modified is not None
 
     except Exception as e:
         logging.exception("Failed modified packet detection.")
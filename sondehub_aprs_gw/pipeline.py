@@ -0,0 +1,359 @@
+#
+#   SondeHub APRS Gateway - Ingest Pipeline
+#
+#   Decouples reading from the APRS-IS socket from the processing of packets.
+#   The reader thread only places raw lines into a bounded queue, and a pool of
+#   worker threads does the parsing, filtering, conversion and publishing.
+#
+#   PriorityPipeline keeps a queue per priority class, so that balloon and
+#   chase-car packets are not stuck behind a backlog of ordinary position
+#   reports, and sheds the lower priority lines first when overloaded.
+#
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+from .metrics import REGISTRY
+
+METRIC_DROPPED = REGISTRY.counter("ingest_dropped_total", "Lines dropped by the ingest pipeline, due to a full queue or (with priorities) overload")
+METRIC_SHED = REGISTRY.counter("ingest_shed_total", "Lines shed by the priority ingest pipeline, by class and reason", ["class", "reason"])
+METRIC_WAIT = REGISTRY.histogram(
+    "ingest_wait_seconds",
+    "Time lines wait in the priority ingest pipeline, by class",
+    ["class"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+
+# Behaviour when the queue is full:
+# block - Block the reader until a worker frees up space (backpressure onto the socket)
+# drop_newest - Discard the line that was just read
+# drop_oldest - Discard the oldest queued line to make room for the new one
+DROP_POLICIES = ('block', 'drop_newest', 'drop_oldest')
+
+# Longest time (seconds) an idle worker waits for a line before checking whether the pipeline has been stopped.
+STOP_POLL_INTERVAL = 0.1
+
+
+class IngestPipeline(object):
+    """
+    Bounded queue between the APRS-IS reader and a pool of worker threads.
+    """
+
+    def __init__(self, handler, workers=4, queue_size=10000, drop_policy='drop_oldest', block_timeout=None):
+        """
+        handler: Function called (from a worker thread) with each raw line.
+        workers: Number of worker threads.
+        queue_size: Maximum number of lines waiting to be processed.
+        drop_policy: One of DROP_POLICIES, applied when the queue is full.
+        block_timeout: With the 'block' policy, the longest time (seconds) to wait for
+                       space before dropping the line. None waits forever.
+        """
+        if drop_policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy: {drop_policy}")
+
+        self.handler = handler
+        self.workers = workers
+        self.drop_policy = drop_policy
+        self.block_timeout = block_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+
+        self.lines_received = 0
+        self.lines_processed = 0
+        self.lines_dropped = 0
+        self.handler_errors = 0
+        self.max_depth = 0
+
+        self._lock = threading.Lock()
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            _thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            _thread.start()
+            self._threads.append(_thread)
+        logging.info(f"Started ingest pipeline with {self.workers} workers, queue size {self.queue.maxsize}, policy {self.drop_policy}")
+
+    def stop(self, timeout=5):
+        """ Stop the workers once the queue has drained (or the timeout expires). """
+        # Workers exit when they find the queue empty after this, rather than on a stop
+        # sentinel in the queue, which the drop_oldest policy could discard.
+        self._running = False
+        for _thread in self._threads:
+            _thread.join(timeout)
+        self._threads = []
+
+    def submit(self, line):
+        """ Called from the reader thread with each raw line. Never does any processing. """
+        with self._lock:
+            self.lines_received += 1
+
+        if self.drop_policy == 'block':
+            try:
+                self.queue.put(line, timeout=self.block_timeout)
+            except queue.Full:
+                self._dropped()
+        elif self.drop_policy == 'drop_newest':
+            try:
+                self.queue.put_nowait(line)
+            except queue.Full:
+                self._dropped()
+        else:
+            while True:
+                try:
+                    self.queue.put_nowait(line)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        self._dropped()
+                    except queue.Empty:
+                        pass
+
+        _depth = self.queue.qsize()
+        with self._lock:
+            if _depth > self.max_depth:
+                self.max_depth = _depth
+
+    def _dropped(self):
+        with self._lock:
+            self.lines_dropped += 1
+        METRIC_DROPPED.inc()
+
+    def _worker(self):
+        while True:
+            try:
+                line = self.queue.get(timeout=STOP_POLL_INTERVAL)
+            except queue.Empty:
+                if not self._running:
+                    return
+                continue
+            try:
+                self.handler(line)
+            except Exception:
+                with self._lock:
+                    self.handler_errors += 1
+                logging.exception("Error processing line in ingest worker")
+            with self._lock:
+                self.lines_processed += 1
+            self.queue.task_done()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queue_depth": self.queue.qsize(),
+                "queue_max_depth": self.max_depth,
+                "queue_size": self.queue.maxsize,
+                "lines_received": self.lines_received,
+                "lines_processed": self.lines_processed,
+                "lines_dropped": self.lines_dropped,
+                "handler_errors": self.handler_errors,
+            }
+
+
+class PriorityPipeline(object):
+    """
+    Ingest pipeline with a queue for each priority class. Workers always take the
+    oldest line of the highest priority class waiting.
+
+    Lines are shed, lowest priority first:
+    - When the backlog is above sample_threshold (a fraction of queue_size), lines
+      below the top class are sampled, with the fraction kept falling linearly to
+      zero as the backlog reaches queue_size.
+    - While the oldest top class line waiting has waited longer than latency_budget,
+      lines below the top class are dropped.
+    - When the queues are full, the oldest line of the lowest class waiting (no higher
+      than the new line's class) is dropped to make room, or otherwise the new line.
+    """
+
+    def __init__(self, handler, classify, classes=("high", "low"), workers=4, queue_size=10000, sample_threshold=0.5, latency_budget=1.0):
+        """
+        handler: Function called (from a worker thread) with each raw line, and its tag.
+        classify: Function returning (priority, tag) for a raw line. priority is an index into
+                  classes (0 is the highest priority). If priority is None, the handler is called
+                  immediately on the submitting thread (for lines which are cheap to handle).
+        classes: Names of the priority classes, highest priority first.
+        workers: Number of worker threads.
+        queue_size: Maximum number of lines waiting to be processed, across all classes.
+        sample_threshold: Fraction of queue_size above which lower priority lines are sampled.
+        latency_budget: Target maximum wait (seconds) for top priority lines.
+        """
+        self.handler = handler
+        self.classify = classify
+        self.classes = classes
+        self.workers = workers
+        self.queue_size = queue_size
+        self.sample_threshold = sample_threshold
+        self.latency_budget = latency_budget
+
+        self.lines_received = 0
+        self.lines_processed = 0
+        self.lines_dropped = 0
+        self.handler_errors = 0
+        self.max_depth = 0
+        self.received = {_class: 0 for _class in classes}
+        self.shed = {_class: {"full": 0, "sampled": 0, "budget": 0} for _class in classes}
+        self.max_wait = {_class: 0.0 for _class in classes}
+
+        self._queues = [deque() for _class in classes]
+        self._depth = 0
+        self._cond = threading.Condition()
+        self._random = random.Random(0)
+        self._threads = []
+        self._running = False
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        for i in range(self.workers):
+            _thread = threading.Thread(target=self._worker, name=f"ingest-worker-{i}", daemon=True)
+            _thread.start()
+            self._threads.append(_thread)
+        logging.info(f"Started priority ingest pipeline with {self.workers} workers, queue size {self.queue_size}, classes {self.classes}")
+
+    def stop(self, timeout=5):
+        """ Stop the workers once the queues have drained (or the timeout expires). """
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for _thread in self._threads:
+            _thread.join(timeout)
+        self._threads = []
+
+    def submit(self, line):
+        """ Called from the reader thread with each raw line. Never blocks on processing. """
+        (_priority, _tag) = self.classify(line)
+        if _priority is None:
+            with self._cond:
+                self.lines_received += 1
+            self.handler(line, _tag)
+            return
+
+        _class = self.classes[_priority]
+        with self._cond:
+            self.lines_received += 1
+            self.received[_class] += 1
+
+            if _priority > 0:
+                if self._over_budget():
+                    self._shed(_priority, "budget")
+                    return
+                _threshold = self.sample_threshold * self.queue_size
+                if self._depth > _threshold:
+                    _keep = 1.0 - (self._depth - _threshold) / max(1.0, self.queue_size - _threshold)
+                    if self._random.random() >= _keep:
+                        self._shed(_priority, "sampled")
+                        return
+
+            if self._depth >= self.queue_size:
+                for _lower in range(len(self.classes) - 1, _priority - 1, -1):
+                    if self._queues[_lower]:
+                        self._queues[_lower].popleft()
+                        self._depth -= 1
+                        self._shed(_lower, "full")
+                        break
+                else:
+                    self._shed(_priority, "full")
+                    return
+
+            self._queues[_priority].append((time.monotonic(), line, _tag))
+            self._depth += 1
+            if self._depth > self.max_depth:
+                self.max_depth = self._depth
+            self._cond.notify()
+
+    def _over_budget(self):
+        """ True if the oldest top priority line has waited longer than the latency budget. Must hold the lock. """
+        return bool(self._queues[0]) and time.monotonic() - self._queues[0][0][0] > self.latency_budget
+
+    def _shed(self, priority, reason):
+        """ Count a shed line. Must hold the lock. """
+        _class = self.classes[priority]
+        self.shed[_class][reason] += 1
+        self.lines_dropped += 1
+        METRIC_DROPPED.inc()
+        METRIC_SHED.inc(_class, reason)
+
+    def _next(self):
+        """ Wait for and return the next (priority, queued time, line, tag), or None when stopped and drained. """
+        with self._cond:
+            while self._depth == 0:
+                if not self._running:
+                    return None
+                self._cond.wait()
+            for _priority, _queue in enumerate(self._queues):
+                if _queue:
+                    self._depth -= 1
+                    return (_priority,) + _queue.popleft()
+
+    def _worker(self):
+        while True:
+            _item = self._next()
+            if _item is None:
+                return
+            (_priority, _queued, _line, _tag) = _item
+            _class = self.classes[_priority]
+            _wait = time.monotonic() - _queued
+            METRIC_WAIT.observe(_wait, _class)
+            with self._cond:
+                if _wait > self.max_wait[_class]:
+                    self.max_wait[_class] = _wait
+
+            try:
+                self.handler(_line, _tag)
+            except Exception:
+                with self._cond:
+                    self.handler_errors += 1
+                logging.exception("Error processing line in ingest worker")
+            with self._cond:
+                self.lines_processed += 1
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": self._depth,
+                "queue_depths": {_class: len(_queue) for _class, _queue in zip(self.classes, self._queues)},
+                "queue_max_depth": self.max_depth,
+                "queue_size": self.queue_size,
+                "lines_received": self.lines_received,
+                "lines_processed": self.lines_processed,
+                "lines_dropped": self.lines_dropped,
+                "handler_errors": self.handler_errors,
+                "received": dict(self.received),
+                "shed": {_class: dict(_reasons) for _class, _reasons in self.shed.items()},
+                "max_wait": {_class: round(_wait, 3) for _class, _wait in self.max_wait.items()},
+                "over_budget": self._over_budget(),
+            }
+
+
+class StatsLogger(object):
+    """ Periodically log the statistics of an object with a stats() method. """
+
+    def __init__(self, name, source, interval=60):
+        self.name = name
+        self.source = source
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"{name}-stats", daemon=True)
+
+    def start(self):
+        if self.interval > 0:
+            self._thread.start()
+        return self
+
+    def stop(self, timeout=5):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            logging.info(f"{self.name} stats: {self.source.stats()}")
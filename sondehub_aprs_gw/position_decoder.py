@@ -0,0 +1,280 @@
+#
+#   SondeHub APRS Gateway - Fast Position Decoder
+#
+#   A decoder for the position report formats balloons and chase cars use -
+#   uncompressed (with an optional /A= altitude), compressed and Mic-E - which
+#   produces only the fields the gateway uses, several times faster than
+#   aprslib.parse() with its generic handling of every APRS format.
+#
+#   It only accepts packets it decodes exactly as aprslib would, and leaves
+#   anything else (other formats, position ambiguity, PHG/RNG extensions,
+#   weather reports, objects, non-UTF-8 text, unusual callsigns, ...) to
+#   aprslib, so the gateway's results are the same either way.
+#
+import datetime
+import re
+
+import aprslib
+
+from .metrics import REGISTRY
+
+METRIC_DECODES = REGISTRY.counter("position_decodes_total", "Packets parsed, by decoder (fast path, or aprslib fallback)", ["decoder"])
+
+# Fields of a parsed packet used by the gateway. decode() gives each of these that
+# aprslib.parse() would, with the same value.
+FIELDS = ("raw", "from", "to", "path", "via", "format", "symbol", "symbol_table", "latitude", "longitude", "altitude", "comment", "timestamp")
+
+# Headers aprslib accepts, restricted to ASCII callsigns and 0-15 SSIDs without leading zeros.
+_HEADER = re.compile(r"([A-Za-z0-9]{1,9}(?:-[A-Za-z0-9]{1,8})?)>([A-Z0-9]{1,6}(?:-(?:1[0-5]|[0-9]))?)((?:,[A-Za-z0-9-]{1,9}\*?)*)")
+
+_TIMESTAMP = re.compile(r"(\d{6})(.)")
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+# Position formats, as matched by aprslib (the uncompressed format without position ambiguity).
+_COMPRESSED = re.compile(r"[\/\\A-Za-j][!-|]{8}[!-{}][ -|]{3}")
+_UNCOMPRESSED = re.compile(r"([0-9]{2})([0-9]{2}\.[0-9]{2})([NnSs])([\/\\0-9A-Z])([0-9]{3})([0-9]{2}\.[0-9]{2})([EeWw])([\x21-\x7e])")
+# Mic-E destination callsigns encoding latitude digits (i.e. without position ambiguity), and information fields.
+_MICE_DESTINATION = re.compile(r"[0-9A-JP-Y]{3}[0-9P-Y]{3}")
+_MICE_DIGITS = str.maketrans("ABCDEFGHIJPQRSTUVWXY", "01234567890123456789")
+_MICE_DATA = re.compile(r"[&-\x7f][&-a][\x1c-\x7f]{2}[\x1c-\x7d][\x1c-\x7f][\x21-\x7e][\/\\0-9A-Z]")
+
+# Comment fields aprslib removes from the comment (patterns as used by aprslib).
+_COURSE_SPEED = re.compile(r"[0-9 \.]{3}/[0-9 \.]{3}")
+_BEARING_NRQ = re.compile(r"/[0-9 \.]{3}/[0-9 \.]{3}")
+_ALTITUDE = re.compile(r"(.*?)/A=(\-\d{5}|\d{6})(.*)$")
+_MICE_TELEMETRY = re.compile(r"('[0-9a-f]{10}|`[0-9a-f]{4})(.*)$")
+_MICE_ALTITUDE = re.compile(r"(.*)([!-{]{3})\}(.*)$")
+_COMMENT_TELEMETRY = re.compile(r"(.*?)\|([!-{]{4,14})\|(.*)$")
+_DAO = re.compile(r"(.*)\!([\x21-\x7b])([\x20-\x7b]{2})\!(.*?)$")
+
+
+def decode(line):
+    """
+    Decode a raw APRS-IS line (bytes or str) containing an uncompressed, compressed or
+    Mic-E position report, into a dict of the FIELDS aprslib.parse() would give it.
+    Returns None if the line is not one of these, or needs aprslib to decode it exactly.
+    """
+    if isinstance(line, bytes):
+        try:
+            line = line.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+    line = line.rstrip("\r\n")
+    if "\n" in line:
+        return None
+
+    (_head, _sep, _body) = line.partition(':')
+    if len(_body) < 2:
+        return None
+    _header = _HEADER.fullmatch(_head)
+    if _header is None:
+        return None
+    (_from, _to, _path) = _header.groups()
+    if len(_from) > 9:
+        return None
+    _path = _path.split(',')[1:]
+    thing = {
+        "raw": line,
+        "from": _from,
+        "to": _to,
+        "path": _path,
+        "via": _path[-1] if len(_path) >= 2 and len(_path[-2]) == 3 and _path[-2][0] == 'q' else "",
+    }
+
+    _type = _body[0]
+    _body = _body[1:]
+    if _type in "`'":
+        return _decode_mice(thing, _body)
+    if _type in "/@":
+        _match = _TIMESTAMP.match(_body)
+        if _match:
+            if not _match.group(1).isascii() or len(_body) == 7:
+                return None
+            thing["timestamp"] = _timestamp(*_match.groups())
+            _body = _body[7:]
+    elif _type not in "!=":
+        return None
+
+    _match = _COMPRESSED.match(_body)
+    if _match:
+        if not _decode_compressed(thing, _body):
+            return None
+        _body = _body[13:]
+    else:
+        _match = _UNCOMPRESSED.match(_body)
+        if _match is None or not _decode_uncompressed(thing, _match):
+            return None
+        _body = _body[_match.end():]
+
+    if thing["symbol"] == '_':
+        # Weather report
+        return None
+    return _decode_comment(thing, _body)
+
+
+def parse(line):
+    """
+    Parse a raw APRS-IS line with decode(), or with aprslib.parse() if decode() can't
+    (raising aprslib's exceptions if the line can't be parsed at all).
+    """
+    thing = decode(line)
+    if thing is None:
+        METRIC_DECODES.inc("aprslib")
+        return aprslib.parse(line)
+    METRIC_DECODES.inc("fast")
+    return thing
+
+
+def fields(thing):
+    """ Return the FIELDS of a packet parsed by aprslib.parse(), e.g. for comparing with decode(). """
+    return {_field: thing[_field] for _field in FIELDS if _field in thing}
+
+
+def _base91(text):
+    _value = 0
+    for _char in text:
+        _value = _value * 91 + ord(_char) - 33
+    return _value
+
+
+def _timestamp(digits, form):
+    """
+    Seconds since the epoch of a DHM (form 'z' or '/') or HMS ('h') timestamp, taking the
+    rest of the date from the current UTC date, as aprslib does. 0 if the time is invalid.
+    """
+    _utc = datetime.datetime.now(datetime.timezone.utc)
+    if form == 'h':
+        _time = (_utc.day, int(digits[0:2]), int(digits[2:4]), int(digits[4:6]))
+    elif form in 'z/':
+        _time = (int(digits[0:2]), int(digits[2:4]), int(digits[4:6]), 0)
+    else:
+        return 0
+    try:
+        return int((datetime.datetime(_utc.year, _utc.month, *_time) - _EPOCH).total_seconds())
+    except ValueError:
+        return 0
+
+
+def _decode_compressed(thing, body):
+    if "|" in body[1:9]:
+        # Not valid base91. aprslib raises an error.
+        return False
+    thing["format"] = "compressed"
+    thing["symbol"] = body[9]
+    thing["symbol_table"] = body[0]
+    thing["latitude"] = 90 - (_base91(body[1:5]) / 380926.0)
+    thing["longitude"] = -180 + (_base91(body[5:9]) / 190463.0)
+
+    # Altitude, if the csT bytes hold one.
+    (_c, _s, _type) = [ord(_char) - 33 for _char in body[10:13]]
+    if _c != -1 and _s != -1 and _type & 0x18 == 0x10:
+        thing["altitude"] = (1.002 ** (_c * 91 + _s)) * 0.3048
+    return True
+
+
+def _decode_uncompressed(thing, match):
+    (_lat_deg, _lat_min, _lat_dir, _symbol_table, _lon_deg, _lon_min, _lon_dir, _symbol) = match.groups()
+    if int(_lat_deg) > 89 or int(_lon_deg) > 179:
+        return False
+
+    _latitude = int(_lat_deg) + (float(_lat_min) / 60.0)
+    _longitude = int(_lon_deg) + (float(_lon_min) / 60.0)
+    _latitude *= -1 if _lat_dir in 'Ss' else 1
+    _longitude *= -1 if _lon_dir in 'Ww' else 1
+
+    thing["format"] = "uncompressed"
+    thing["symbol"] = _symbol
+    thing["symbol_table"] = _symbol_table
+    thing["latitude"] = _latitude
+    thing["longitude"] = _longitude
+    return True
+
+
+def _decode_comment(thing, body):
+    """ Remove the data extension, altitude, telemetry and DAO from a position comment, as aprslib does. """
+    if _COURSE_SPEED.match(body):
+        body = body[7:]
+        if _BEARING_NRQ.match(body):
+            body = body[8:]
+    elif body.startswith(("PHG", "RNG")):
+        return None
+
+    if "/A=" in body:
+        _match = _ALTITUDE.match(body)
+        if _match:
+            body = _match.group(1) + _match.group(3)
+            thing["altitude"] = int(_match.group(2)) * 0.3048
+
+    body = _decode_dao(thing, _strip_telemetry(body))
+    if body and body[0] == "/":
+        body = body[1:]
+    thing["comment"] = body.strip(' ')
+    return thing
+
+
+def _decode_mice(thing, body):
+    _destination = thing["to"].split('-')[0]
+    if len(body) < 8 or not _MICE_DESTINATION.fullmatch(_destination) or not _MICE_DATA.match(body):
+        return None
+
+    thing["format"] = "mic-e"
+    thing["symbol"] = body[6]
+    thing["symbol_table"] = body[7]
+
+    # Latitude digits, N/S and the longitude offset and E/W are in the destination callsign.
+    _digits = _destination.translate(_MICE_DIGITS)
+    _latitude = int(_digits[0:2]) + (float(_digits[2:4] + "." + _digits[4:6]) / 60.0)
+    thing["latitude"] = -_latitude if ord(_destination[3]) <= 0x4c else _latitude
+
+    _longitude = ord(body[0]) - 28
+    _longitude += 100 if ord(_destination[4]) >= 0x50 else 0
+    _longitude += -80 if _longitude >= 180 and _longitude <= 189 else 0
+    _longitude += -190 if _longitude >= 190 and _longitude <= 199 else 0
+    _minutes = ord(body[1]) - 28.0
+    _minutes += -60 if _minutes >= 60 else 0
+    _minutes += ((ord(body[2]) - 28.0) / 100.0)
+    _longitude += _minutes / 60.0
+    thing["longitude"] = 0 - _longitude if ord(_destination[5]) >= 0x50 else _longitude
+
+    if len(body) > 8:
+        body = body[8:]
+        _match = _MICE_TELEMETRY.match(body)
+        if _match:
+            body = _match.group(2)
+        if "}" in body:
+            _match = _MICE_ALTITUDE.match(body)
+            if _match:
+                body = _match.group(1) + _match.group(3)
+                thing["altitude"] = _base91(_match.group(2)) - 10000
+        thing["comment"] = _decode_dao(thing, _strip_telemetry(body)).strip(' ')
+    return thing
+
+
+def _strip_telemetry(body):
+    """ Remove base91 comment telemetry (|ss11223344556677|). """
+    if "|" in body:
+        _match = _COMMENT_TELEMETRY.match(body)
+        if _match and len(_match.group(2)) % 2 == 0:
+            body = _match.group(1) + _match.group(3)
+    return body
+
+
+def _decode_dao(thing, body):
+    """ Remove a DAO extension (!DAO!), applying its extra position precision. """
+    if "!" not in body:
+        return body
+    _match = _DAO.match(body)
+    if _match is None:
+        return body
+    (_body, _datum, _dao, _rest) = _match.groups()
+
+    _lat_offset = _lon_offset = 0
+    if _datum == 'W' and _dao.isdigit():
+        _lat_offset = int(_dao[0]) * 0.001 / 60
+        _lon_offset = int(_dao[1]) * 0.001 / 60
+    elif _datum == 'w' and ' ' not in _dao:
+        _lat_offset = (_base91(_dao[0]) / 91.0) * 0.01 / 60
+        _lon_offset = (_base91(_dao[1]) / 91.0) * 0.01 / 60
+    thing["latitude"] += _lat_offset if thing["latitude"] >= 0 else -_lat_offset
+    thing["longitude"] += _lon_offset if thing["longitude"] >= 0 else -_lon_offset
+    return _body + _rest
@@ -0,0 +1,201 @@
+#
+#   SondeHub APRS Gateway - Station Position Store
+#
+#   Bounded store of the last known position of each station seen on APRS-IS,
+#   used to upload the positions of iGates which relay balloon packets.
+#
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+
+class Position(object):
+    """
+    The last known position of a station.
+
+    If raw is set, the position has not been decoded yet, and the other fields are not valid.
+    """
+    __slots__ = ('latitude', 'longitude', 'altitude', 'comment', 'last_upload', 'updated', 'raw')
+
+    def __init__(self, latitude=None, longitude=None, altitude=0, comment=None, updated=None, raw=None):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.comment = comment
+        self.last_upload = None
+        self.updated = updated
+        self.raw = raw
+
+
+# Approximate sizes (bytes) of a stored entry - the Position, its callsign, coordinates and slot in
+# the dict - and of an undecoded packet apart from its contents, for estimating memory use.
+_ENTRY_SIZE = sys.getsizeof(Position()) + sys.getsizeof("VK5QI-11") + 2 * sys.getsizeof(0.0) + 64
+_RAW_OVERHEAD = sys.getsizeof(b"")
+
+
+class PositionStore(object):
+    """
+    Maps callsign -> Position, evicting entries which have not been updated
+    within the TTL, and the least recently updated entries when full.
+    """
+
+    # Columns of the rows returned by snapshot(), for saving state across restarts.
+    SNAPSHOT_COLUMNS = ('callsign', 'latitude', 'longitude', 'altitude', 'comment', 'raw', 'updated', 'last_upload')
+
+    def __init__(self, decoder=None, ttl=4*3600, max_entries=200000, expire_interval=60, clock=time.time):
+        """
+        decoder: Function taking a raw packet, returning a (latitude, longitude, altitude, comment)
+                 tuple, used to decode positions stored with update_raw(). Should raise an
+                 exception if the packet cannot be decoded.
+        ttl: Time (seconds) after which a position is considered stale and removed.
+        max_entries: Maximum number of stations to store.
+        expire_interval: Minimum time (seconds) between scans for expired entries.
+        """
+        self.decoder = decoder
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.expire_interval = expire_interval
+        self.clock = clock
+
+        self.evicted_ttl = 0
+        self.evicted_size = 0
+        self.decode_failures = 0
+
+        self._positions = OrderedDict()
+        # Number of stored positions which have not been decoded yet, and the total length of their packets.
+        self._undecoded = 0
+        self._raw_bytes = 0
+        self._lock = threading.Lock()
+        self._last_expire = clock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def clear(self):
+        with self._lock:
+            self._positions.clear()
+            self._undecoded = 0
+            self._raw_bytes = 0
+
+    def __contains__(self, callsign):
+        return self.get(callsign) is not None
+
+    def update(self, callsign, latitude, longitude, altitude=0, comment=None):
+        """ Store a decoded position for a station. """
+        self._store(callsign, Position(latitude, longitude, altitude, comment, updated=self.clock()))
+
+    def update_raw(self, callsign, raw):
+        """ Store an undecoded position packet for a station, to be decoded if it is looked up. """
+        self._store(callsign, Position(updated=self.clock(), raw=raw))
+
+    def _store(self, callsign, position):
+        with self._lock:
+            _previous = self._positions.get(callsign)
+            if _previous is not None:
+                self._removed(_previous)
+            if position.raw is not None:
+                self._undecoded += 1
+                self._raw_bytes += len(position.raw)
+            self._positions[callsign] = position
+            self._positions.move_to_end(callsign)
+
+            if len(self._positions) > self.max_entries:
+                self._removed(self._positions.popitem(last=False)[1])
+                self.evicted_size += 1
+
+            # abs() so that expiry still runs if the clock is set backwards (e.g. replaying a capture)
+            if abs(position.updated - self._last_expire) > self.expire_interval:
+                self._expire(position.updated)
+
+    def _expire(self, now):
+        # Entries are ordered by update time, so we only need to look at the oldest.
+        self._last_expire = now
+        _cutoff = now - self.ttl
+        while self._positions:
+            _callsign, _position = next(iter(self._positions.items()))
+            if _position.updated >= _cutoff:
+                break
+            self._positions.popitem(last=False)
+            self._removed(_position)
+            self.evicted_ttl += 1
+
+    def _removed(self, position):
+        """ Account for a position being removed or replaced. Must hold the lock. """
+        if position.raw is not None:
+            self._undecoded -= 1
+            self._raw_bytes -= len(position.raw)
+
+    def get(self, callsign):
+        """ Return the Position of a station, or None if we have no (valid, current) position. """
+        with self._lock:
+            _position = self._positions.get(callsign)
+            if _position is None:
+                return None
+
+            if self.clock() - _position.updated > self.ttl:
+                del self._positions[callsign]
+                self._removed(_position)
+                self.evicted_ttl += 1
+                return None
+
+            if _position.raw is not None:
+                self._removed(_position)
+                try:
+                    (_position.latitude, _position.longitude, _position.altitude, _position.comment) = self.decoder(_position.raw)
+                    _position.raw = None
+                except Exception:
+                    del self._positions[callsign]
+                    self.decode_failures += 1
+                    return None
+
+            return _position
+
+    def mark_uploaded(self, callsign, when=None):
+        """ Record that the position of a station has been uploaded to SondeHub. """
+        with self._lock:
+            _position = self._positions.get(callsign)
+            if _position is not None:
+                _position.last_upload = self.clock() if when is None else when
+
+    def snapshot(self):
+        """ Return the stored positions as a list of rows (see SNAPSHOT_COLUMNS), least recently updated first. """
+        with self._lock:
+            return [
+                (_callsign, _p.latitude, _p.longitude, _p.altitude, _p.comment, _p.raw, _p.updated, _p.last_upload)
+                for _callsign, _p in self._positions.items()
+            ]
+
+    def restore(self, rows):
+        """ Load positions from snapshot() rows, skipping any which have expired. Returns the number loaded. """
+        _cutoff = self.clock() - self.ttl
+        _count = 0
+        with self._lock:
+            for (_callsign, _latitude, _longitude, _altitude, _comment, _raw, _updated, _last_upload) in sorted(rows, key=lambda _row: _row[6], reverse=True):
+                if _updated < _cutoff or _callsign in self._positions:
+                    continue
+                _position = Position(_latitude, _longitude, _altitude, _comment, updated=_updated, raw=_raw)
+                _position.last_upload = _last_upload
+                if _raw is not None:
+                    self._undecoded += 1
+                    self._raw_bytes += len(_raw)
+                self._positions[_callsign] = _position
+                # Newest first, each moved in front of any positions received since starting up.
+                self._positions.move_to_end(_callsign, last=False)
+                _count += 1
+            while len(self._positions) > self.max_entries:
+                self._removed(self._positions.popitem(last=False)[1])
+                self.evicted_size += 1
+        return _count
+
+    def stats(self):
+        # Memory use is estimated from the counts, rather than by walking every entry with the lock held.
+        with self._lock:
+            return {
+                "entries": len(self._positions),
+                "undecoded": self._undecoded,
+                "evicted_ttl": self.evicted_ttl,
+                "evicted_size": self.evicted_size,
+                "decode_failures": self.decode_failures,
+                "memory_bytes": len(self._positions) * _ENTRY_SIZE + self._undecoded * _RAW_OVERHEAD + self._raw_bytes,
+            }
@@ -0,0 +1,140 @@
+#
+#   SondeHub APRS Gateway - Raw Packet Pre-Filter
+#
+#   Cheap byte-level classification of raw APRS-IS lines, used to avoid running
+#   the full aprslib parser on the vast majority of the t/p feed, which we
+#   would otherwise parse only to throw away.
+#
+
+# Classification results
+DROP = 0        # Nothing we care about (messages, status, weather, unknown formats, etc)
+POSITION = 1    # A position report that is only of interest for the positions table
+BALLOON = 2     # A balloon-symbol position report, candidate for upload
+CHASE = 3       # A packet with SHUB in its path, candidate for a chase-car upload
+TELEMETRY = 4   # An APRS telemetry frame (T#), or telemetry definition message (PARM/UNIT/EQNS/BITS)
+BLOCKED = 5     # A balloon-symbol position report blocked by a path rule, only of interest for the positions table
+
+CHASE_PATH_ELEMENTS = (b'SHUB', b'SHUB1-1')
+TELEMETRY_DEFINITIONS = (b'PARM.', b'UNIT.', b'EQNS.', b'BITS.')
+
+# Packet types which aprslib handles (or rejects) before falling through to
+# the 'look for a ! within the first 40 characters' position rule.
+_NON_POSITION_TYPES = frozenset(b'#$%&()*+-.<?T[\\]^},{>:_')
+
+_DIGITS = frozenset(b'0123456789')
+_COMPRESSED_TABLES = frozenset(b'/\\ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghij')
+
+
+def split_packet(line):
+    """
+    Split a raw APRS-IS line into (path, body), where path is a list of the
+    path elements (excluding the source and destination callsigns).
+
+    Returns (None, None) if the line does not look like an APRS packet.
+    """
+    _head, _sep, _body = line.partition(b':')
+    if not _sep or not _body:
+        return None, None
+
+    _header = _head.split(b'>', 1)
+    if len(_header) != 2:
+        return None, None
+
+    return _header[1].split(b',')[1:], _body.rstrip(b'\r\n')
+
+
+def find_symbol(body):
+    """
+    Locate the symbol table and symbol code within an APRS information field,
+    following the same format detection rules as aprslib.
+
+    Returns a (symbol_table, symbol, is_object) tuple, with the symbol fields
+    as single-character bytes, or None if the packet does not carry a position.
+    """
+    _type = body[0]
+
+    # Mic-E - Symbol code and table follow the longitude/speed/course bytes.
+    if _type in b"`'":
+        if len(body) < 9:
+            return None
+        return body[8:9], body[7:8], False
+
+    if _type in b'!=/@;':
+        _offset = 1
+    elif _type in _NON_POSITION_TYPES:
+        return None
+    else:
+        # Positions with a leading string, where the '!' can appear anywhere
+        # within the first 40 characters.
+        _offset = body.find(b'!', 1)
+        if _offset < 0 or _offset > 40:
+            return None
+        _offset += 1
+        _type = ord('!')
+
+    _is_object = _type == ord(';')
+    if _is_object:
+        # 9 character object name, and alive/killed flag.
+        _offset += 10
+
+    if _type in b'/@;':
+        # Skip the timestamp, if it's present.
+        if body[_offset:_offset+6].isdigit():
+            _offset += 7
+
+    _start = body[_offset:_offset+1]
+    if not _start:
+        return None
+
+    if _start[0] in _DIGITS:
+        # Uncompressed - DDMM.mmN<table>DDDMM.mmE<code>
+        _symbol = body[_offset+18:_offset+19]
+        if not _symbol:
+            return None
+        return body[_offset+8:_offset+9], _symbol, _is_object
+
+    if _start[0] in _COMPRESSED_TABLES:
+        # Compressed - <table>YYYYXXXX<code>csT
+        _symbol = body[_offset+9:_offset+10]
+        if not _symbol:
+            return None
+        return _start, _symbol, _is_object
+
+    return None
+
+
+def classify(line, blocked_path=frozenset()):
+    """
+    Classify a raw APRS-IS line (bytes) without fully parsing it.
+
+    This errs on the side of passing packets through - anything classified
+    as BALLOON or CHASE still goes through the full parser and the usual checks.
+
+    blocked_path: Path elements (bytes) of the path blocking rules (see CompiledRules.path_bytes).
+                  Balloon-symbol packets via any of these are classified as BLOCKED.
+    """
+    _path, _body = split_packet(line)
+    if _body is None:
+        return DROP
+
+    for _element in CHASE_PATH_ELEMENTS:
+        if _element in _path:
+            return CHASE
+
+    if _body[:2] == b'T#':
+        return TELEMETRY
+    if _body[:1] == b':' and _body[10:11] == b':' and _body[11:16] in TELEMETRY_DEFINITIONS:
+        return TELEMETRY
+
+    _symbol = find_symbol(_body)
+    if _symbol is None:
+        return DROP
+
+    _table, _code, _is_object = _symbol
+    if _table == b'/' and _code == b'O' and not _is_object:
+        if blocked_path and not blocked_path.isdisjoint(_path):
+            # This would be rejected by isHam, but we still want the position.
+            return BLOCKED
+        return BALLOON
+
+    return POSITION
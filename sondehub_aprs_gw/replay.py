@@ -0,0 +1,112 @@
+#
+#   SondeHub APRS Gateway - Capture Replay
+#
+#   Feeds a raw stream capture (see capture.py) back through the gateway's
+#   parser, at the original rate, N times faster, or as fast as possible.
+#   The gateway's clock is replaced with a fake clock which follows the
+#   capture timestamps, so receive times, listener upload intervals and
+#   message rate limits behave as they did when the capture was made, and
+#   the output is the same at any replay speed.
+#   Uploads are never sent - they can optionally be written to a file instead.
+#
+#   Usage:
+#       python -m sondehub_aprs_gw.replay /data/captures                        # Replay all captures in a directory, at max speed
+#       python -m sondehub_aprs_gw.replay aprs-20261017T120000Z.txt.gz --speed 1
+#       python -m sondehub_aprs_gw.replay captures/ --speed 10 --output uploads.jsonl
+#
+import argparse
+import json
+import logging
+import time
+
+from .benchmark import load_gateway
+from .capture import read_capture
+
+
+class FakeClock(object):
+    """ A clock which only moves when set. """
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+    def set(self, now):
+        self.now = now
+
+
+def replay(lines, gateway, speed=None):
+    """
+    Replay (receive time, raw line) pairs through the gateway parser.
+    speed: Replay rate relative to the original (e.g. 1 for real time). None replays as fast as possible.
+    Returns a dict of results.
+    """
+    _clock = FakeClock()
+    gateway.set_clock(_clock.time)
+
+    _count = 0
+    _first = None
+    _last = None
+    _max_lag = 0.0
+    _start = time.perf_counter()
+    for (_timestamp, _raw) in lines:
+        if _first is None:
+            _first = _timestamp
+        _last = _timestamp
+
+        if speed:
+            # Wait until this line is due, and keep track of how far behind schedule we fall.
+            _due = (_timestamp - _first) / speed
+            _wait = _due - (time.perf_counter() - _start)
+            if _wait > 0:
+                time.sleep(_wait)
+            else:
+                _max_lag = max(_max_lag, -_wait)
+
+        _clock.set(_timestamp)
+        gateway.parser(_raw)
+        _count += 1
+
+    _elapsed = time.perf_counter() - _start
+    return {
+        "lines": _count,
+        "capture_seconds": (_last - _first) if _count else 0.0,
+        "seconds": _elapsed,
+        "lines_per_second": _count / _elapsed if _elapsed > 0 else None,
+        "max_lag_seconds": _max_lag if speed else None,
+        "payloads_published": gateway.payload_sink.published,
+        "listener_uploads": gateway.listener_sink.published,
+        "messages_sent": gateway.ais.sent,
+    }
+
+
+def main():
+    _parser = argparse.ArgumentParser(description="Replay raw APRS-IS stream captures through the gateway, without uploading anything.")
+    _parser.add_argument("captures", nargs="+", help="Capture files, or directories of capture files")
+    _parser.add_argument("--speed", default="max", help="Replay speed relative to the original rate (e.g. 1, 10), or 'max' (default)")
+    _parser.add_argument("--output", metavar="FILENAME", help="Write each upload to this file, as one JSON object per line")
+    _parser.add_argument("--log-level", default="WARNING", help="Gateway log level during the replay (default WARNING)")
+    _args = _parser.parse_args()
+
+    logging.basicConfig(level=_args.log_level.upper())
+    _speed = None if _args.speed == "max" else float(_args.speed)
+
+    _output = open(_args.output, 'w') if _args.output else None
+
+    def _sink(upload_type, body):
+        if _output:
+            _output.write(json.dumps({"type": upload_type, "body": body}) + "\n")
+
+    try:
+        _gateway = load_gateway(_sink)
+        _results = replay(read_capture(_args.captures), _gateway, speed=_speed)
+    finally:
+        if _output:
+            _output.close()
+
+    print(json.dumps(_results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
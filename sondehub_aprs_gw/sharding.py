@@ -0,0 +1,346 @@
+#
+#   SondeHub APRS Gateway - Multi-process Sharded Parsing
+#
+#   Parsing is CPU bound, and limited to one core by the GIL. This spreads the
+#   packets which need a full parse over several worker processes. Each line
+#   goes to a shard chosen from a hash of its source callsign, so all copies of
+#   a packet (via different iGates) are handled by the same worker, and the
+#   per-packet state (receive times, coalescing) is local to that worker.
+#
+#   Lines are sent to the workers in batches. Each worker runs the gateway
+#   parser with its uploads, messages and position updates replaced with
+#   stand-ins which record them, and sends them back in a batch for the
+#   parent process to carry out. State shared between stations (iGate
+#   positions, message cooldowns, the APRS-IS connection and publishers)
+#   stays in the parent process.
+#
+#   Workers which exit unexpectedly are restarted, losing the lines they had
+#   queued.
+#
+import importlib
+import logging
+import multiprocessing
+import queue
+import signal
+import threading
+import time
+import zlib
+
+
+def shard_of(line, shards):
+    """ Shard number for a raw line (bytes), from its source callsign. """
+    return zlib.crc32(line.split(b'>', 1)[0]) % shards
+
+
+def _worker_main(index, setup, log_level, inputs, outputs):
+    """
+    Worker process. setup is 'module:function' - the function is called with a list
+    to append (kind, args...) output tuples to, and returns the function which
+    processes each line.
+    """
+    # Interrupts are handled by the parent, which stops the workers.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    (_module, _function) = setup.split(":")
+    _results = []
+    _process = getattr(importlib.import_module(_module), _function)(_results)
+    logging.getLogger().setLevel(log_level)
+    outputs.put([("ready", index)])
+
+    while True:
+        try:
+            _batch = inputs.get(timeout=1.0)
+        except queue.Empty:
+            # Still send on any results from background threads (e.g. packet coalescing).
+            _batch = []
+        if _batch is None:
+            break
+        for _line in _batch:
+            try:
+                _process(_line)
+            except Exception:
+                logging.exception(f"Shard {index}: error processing line {_line}")
+        if _batch:
+            _results.append(("processed", len(_batch)))
+        if _results:
+            # Results may be appended by other threads in the meantime, so only remove those sent.
+            _send = _results[:]
+            del _results[:len(_send)]
+            outputs.put(_send)
+
+    outputs.put([("exit", index)])
+
+
+class RemotePublisher(object):
+    """ Stands in for an upload sink (e.g. the SNS publisher) in a worker. """
+
+    def __init__(self, results, kind="publish"):
+        self.results = results
+        self.kind = kind
+
+    def publish(self, payload):
+        self.results.append((self.kind, payload))
+
+
+class RemotePositions(object):
+    """
+    Stands in for the position store in a worker. Positions are stored by the
+    parent, which also decides whether a listener can be uploaded.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.clock = time.time
+
+    def __contains__(self, callsign):
+        return True
+
+    def update(self, *args):
+        self.results.append(("position", *args))
+
+    def update_raw(self, callsign, raw):
+        self.results.append(("position_raw", callsign, raw))
+
+    def clear(self):
+        pass
+
+
+class RemoteMessageSender(object):
+    """ Stands in for the message sender in a worker. """
+
+    def __init__(self, results):
+        self.results = results
+        self.clock = time.time
+
+    def notify(self, callsign):
+        self.results.append(("message", callsign))
+        return True
+
+    def clear(self):
+        pass
+
+
+class RemoteFilter(object):
+    """ Stands in for the adaptive APRS-IS filter in a worker. """
+
+    def __init__(self, results):
+        self.results = results
+        self.clock = time.time
+
+    def add(self, callsign):
+        self.results.append(("igate", callsign))
+
+    def add_balloon(self, callsign):
+        self.results.append(("balloon", callsign))
+
+    def apply(self, ais, force=False):
+        pass
+
+
+class Shard(object):
+    """ A worker process, with its queues. """
+
+    def __init__(self, index):
+        self.index = index
+        self.process = None
+        self.inputs = None
+        self.outputs = None
+        self.collector = None
+        self.ready = threading.Event()
+        self.buffer = []
+
+        self.lines = 0
+        self.processed = 0
+        self.dropped = 0
+        self.lost = 0
+        self.restarts = 0
+
+    def stats(self):
+        return {
+            "alive": self.process is not None and self.process.is_alive(),
+            "lines": self.lines,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "lost": self.lost,
+            "restarts": self.restarts,
+        }
+
+
+class ShardedParser(object):
+    """
+    Distributes lines between worker processes by source callsign, and passes
+    the workers' outputs to a handler in this process.
+    """
+
+    def __init__(self, setup, handler, shards=2, batch_size=100, linger=0.05, queue_size=100, start_timeout=60):
+        """
+        setup: 'module:function' run in each worker to set it up (see _worker_main).
+        handler: Function called with (kind, args...) for each output from the workers. Called from
+                 one thread per worker.
+        shards: Number of worker processes.
+        batch_size: Maximum number of lines sent to a worker at once.
+        linger: Maximum time (seconds) a line waits for a batch to fill.
+        queue_size: Maximum number of batches queued for each worker. Further lines are dropped.
+        start_timeout: Maximum time (seconds) to wait for a worker to start.
+        """
+        self.setup = setup
+        self.handler = handler
+        self.batch_size = batch_size
+        self.linger = linger
+        self.queue_size = queue_size
+        self.start_timeout = start_timeout
+        self.shards = [Shard(_index) for _index in range(shards)]
+        self.running = False
+
+        # Spawn rather than fork, as this process has threads running.
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._flush_thread = None
+
+    def start(self):
+        """ Start the workers, and wait until they are ready. """
+        self.running = True
+        for _shard in self.shards:
+            self._start_shard(_shard)
+        for _shard in self.shards:
+            if not _shard.ready.wait(self.start_timeout):
+                self.stop()
+                raise RuntimeError(f"Shard {_shard.index} worker did not start")
+        logging.info(f"Started {len(self.shards)} parser worker processes")
+
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="shard-flush", daemon=True)
+        self._flush_thread.start()
+        return self
+
+    def _start_shard(self, shard):
+        shard.ready.clear()
+        shard.inputs = self._context.Queue(self.queue_size)
+        shard.outputs = self._context.Queue()
+        shard.process = self._context.Process(
+            target=_worker_main,
+            args=(shard.index, self.setup, logging.getLogger().getEffectiveLevel(), shard.inputs, shard.outputs),
+            name=f"parser-shard-{shard.index}",
+            daemon=True
+        )
+        shard.process.start()
+        shard.collector = threading.Thread(target=self._collect, args=(shard, shard.outputs), name=f"shard-{shard.index}-collect", daemon=True)
+        shard.collector.start()
+
+    def submit(self, line):
+        """ Queue a line (bytes) for its shard. Never blocks - lines are dropped if the shard's queue is full. """
+        _shard = self.shards[shard_of(line, len(self.shards))]
+        with self._lock:
+            _shard.lines += 1
+            _shard.buffer.append(line)
+            if len(_shard.buffer) >= self.batch_size:
+                self._send(_shard)
+
+    def _send(self, shard):
+        """ Send the shard's buffered lines. Must hold the lock. """
+        _batch = shard.buffer
+        shard.buffer = []
+        try:
+            shard.inputs.put_nowait(_batch)
+        except queue.Full:
+            shard.dropped += len(_batch)
+            self._drained.notify_all()
+
+    def flush(self):
+        """ Send all buffered lines. """
+        with self._lock:
+            for _shard in self.shards:
+                if _shard.buffer:
+                    self._send(_shard)
+
+    def _flush_loop(self):
+        while self.running:
+            time.sleep(self.linger)
+            self.flush()
+            self._check_workers()
+
+    def _check_workers(self):
+        """ Restart any workers which have exited. """
+        for _shard in self.shards:
+            if not self.running or _shard.process.is_alive():
+                continue
+            # Collect anything the worker sent before it exited.
+            _shard.outputs.put(None)
+            _shard.collector.join(5)
+            self._close_queues(_shard)
+            with self._lock:
+                # Lines sent to the worker but not processed are lost.
+                _lost = _shard.lines - len(_shard.buffer) - _shard.processed - _shard.dropped - _shard.lost
+                _shard.lost += _lost
+                _shard.restarts += 1
+                self._drained.notify_all()
+                logging.error(f"Parser shard {_shard.index} worker exited with code {_shard.process.exitcode}, restarting ({_lost} lines lost)")
+                # Holding the lock, so no lines are sent to the old queue in the meantime.
+                self._start_shard(_shard)
+
+    def _collect(self, shard, outputs):
+        """ Pass a worker's outputs to the handler. """
+        while True:
+            _results = outputs.get()
+            if _results is None:
+                return
+            for _result in _results:
+                _kind = _result[0]
+                if _kind == "processed":
+                    with self._lock:
+                        shard.processed += _result[1]
+                        self._drained.notify_all()
+                elif _kind == "ready":
+                    shard.ready.set()
+                elif _kind == "exit":
+                    return
+                else:
+                    try:
+                        self.handler(*_result)
+                    except Exception:
+                        logging.exception(f"Error handling {_kind} output from parser shard {shard.index}")
+
+    def drain(self, timeout=None):
+        """ Send all buffered lines, and wait until the workers have processed them. Returns True if they have. """
+        self.flush()
+        _deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while any(_s.processed + _s.dropped + _s.lost < _s.lines for _s in self.shards):
+                _remaining = None if _deadline is None else _deadline - time.monotonic()
+                if _remaining is not None and _remaining <= 0:
+                    return False
+                self._drained.wait(_remaining if _remaining is not None else 1.0)
+        return True
+
+    def stop(self, timeout=10):
+        """ Process all queued lines, and stop the workers. Workers which do not exit within the timeout are killed. """
+        self.flush()
+        self.running = False
+        if self._flush_thread:
+            self._flush_thread.join()
+        for _shard in self.shards:
+            if _shard.process.is_alive():
+                try:
+                    _shard.inputs.put(None, timeout=timeout)
+                except queue.Full:
+                    pass
+        _deadline = time.monotonic() + timeout
+        for _shard in self.shards:
+            _shard.process.join(max(0, _deadline - time.monotonic()))
+            if _shard.process.is_alive():
+                logging.warning(f"Parser shard {_shard.index} worker did not exit, terminating")
+                _shard.process.terminate()
+                _shard.process.join()
+                _shard.outputs.put(None)
+            _shard.collector.join(max(0, _deadline - time.monotonic()))
+            self._close_queues(_shard)
+
+    @staticmethod
+    def _close_queues(shard):
+        """ Close a stopped worker's queues, so their feeder threads do not hold up interpreter exit. """
+        for _queue in (shard.inputs, shard.outputs):
+            _queue.cancel_join_thread()
+            _queue.close()
+
+    def stats(self):
+        with self._lock:
+            return {"shard_%d" % _shard.index: _shard.stats() for _shard in self.shards}
@@ -0,0 +1,407 @@
+#
+#   SondeHub APRS Gateway - APRS-IS Simulator and Load Test
+#
+#   A small APRS-IS compatible server, for testing the gateway offline. It
+#   handles the login line, '#filter' commands (which are acknowledged, but not
+#   applied), sends keepalive comments, streams synthetic or recorded traffic
+#   at a configurable rate, and records any packets sent by clients (e.g. the
+#   gateway's SHUB>APRS messages).
+#
+#   The load test runs the gateway in-process against the simulator, raising
+#   the traffic rate in steps until the gateway falls behind, and reports the
+#   highest sustainable rate, along with backlog growth and latency at each step.
+#
+#   Usage:
+#       python -m sondehub_aprs_gw.simulator serve --port 14580 --rate 2000
+#       APRS_HOST=localhost python -m sondehub_aprs_gw     # (in another terminal)
+#
+#       python -m sondehub_aprs_gw.simulator loadtest --start-rate 1000 --step 1000
+#
+import argparse
+import bisect
+import itertools
+import json
+import logging
+import select
+import socket
+import struct
+import threading
+import time
+
+try:
+    import fcntl
+    import termios
+except ImportError:
+    fcntl = None
+
+from .benchmark import generate_corpus, load_corpus, load_gateway
+from .capture import read_capture
+
+
+def _send_queue_bytes(sock):
+    """ Bytes written to a socket which have not yet been acknowledged by the peer (Linux only). """
+    if fcntl is None or not hasattr(termios, 'TIOCOUTQ'):
+        return None
+    try:
+        return struct.unpack('I', fcntl.ioctl(sock.fileno(), termios.TIOCOUTQ, b'\0\0\0\0'))[0]
+    except OSError:
+        return None
+
+
+class SimulatedClient(object):
+    """ State for one client connection to the simulator. """
+
+    def __init__(self, server, sock, address):
+        self.server = server
+        self.sock = sock
+        self.address = address
+        self.callsign = None
+        self.filter = None
+        self.lines_sent = 0
+        # (lines sent, time.monotonic()) after each write, for latency measurement.
+        self.checkpoints = []
+        self._buffer = b''
+
+    def sent_time(self, line_count):
+        """ Return the time at which the line_count'th line was sent, or None. """
+        _index = bisect.bisect_left(self.checkpoints, (line_count, 0.0))
+        if _index >= len(self.checkpoints):
+            return None
+        return self.checkpoints[_index][1]
+
+    def send_queue_bytes(self):
+        return _send_queue_bytes(self.sock)
+
+    def run(self):
+        try:
+            self._login()
+            self._stream()
+        except (ConnectionError, OSError) as e:
+            logging.info(f"Simulator: client {self.address} disconnected ({e})")
+        finally:
+            self.sock.close()
+            self.server._remove_client(self)
+
+    def _send(self, data):
+        self.sock.sendall(data)
+
+    def _read_lines(self, timeout):
+        """ Return complete lines received from the client, waiting up to timeout seconds for data. """
+        (_readable, _, _) = select.select([self.sock], [], [], timeout)
+        if not _readable:
+            return []
+        _data = self.sock.recv(4096)
+        if not _data:
+            raise ConnectionError("connection closed by client")
+        self._buffer += _data
+        _lines = self._buffer.split(b'\n')
+        self._buffer = _lines.pop()
+        return [_line.rstrip(b'\r') for _line in _lines]
+
+    def _login(self):
+        self._send(f"# aprsc 2.1.14 {self.server.server_name} simulator\r\n".encode('ascii'))
+        _deadline = time.monotonic() + 30
+        while self.callsign is None:
+            if time.monotonic() > _deadline:
+                raise ConnectionError("no login received")
+            for _line in self._read_lines(1.0):
+                _fields = _line.decode('latin-1').split()
+                if len(_fields) >= 4 and _fields[0] == "user" and _fields[2] == "pass":
+                    self.callsign = _fields[1]
+                    if "filter" in _fields:
+                        self.filter = " ".join(_fields[_fields.index("filter") + 1:])
+                    self._send(f"# logresp {self.callsign} verified, server {self.server.server_name}\r\n".encode('ascii'))
+                    logging.info(f"Simulator: {self.callsign} logged in from {self.address}, filter: {self.filter}")
+                    # Give the client a moment to read the login response before streaming starts.
+                    time.sleep(0.1)
+                    break
+
+    def _handle_line(self, line):
+        if line.startswith(b'#'):
+            _command = line[1:].decode('latin-1').strip()
+            if _command.startswith("filter"):
+                self.filter = _command[len("filter"):].strip()
+                self._send(f"# filter {self.filter} active\r\n".encode('latin-1'))
+                logging.info(f"Simulator: {self.callsign} set filter {self.filter}")
+            return
+        if line:
+            self.server._received(self, line)
+
+    def _stream(self):
+        _source = itertools.cycle(self.server.lines)
+        _tick = 0.01
+        _credit = 0.0
+        _last = time.monotonic()
+        _last_keepalive = _last
+        while self.server.running:
+            for _line in self._read_lines(_tick):
+                self._handle_line(_line)
+
+            _now = time.monotonic()
+            if self.server.rate is None:
+                _count = self.server.max_batch
+            else:
+                # Catch up on short stalls, but don't build up more than 0.1 seconds worth of lines.
+                _credit = min(_credit + self.server.rate * (_now - _last), max(self.server.rate * 0.1, 1.0))
+                _count = int(_credit)
+                _credit -= _count
+            _last = _now
+
+            if _count and self.server.lines:
+                self._send(b"\r\n".join(itertools.islice(_source, _count)) + b"\r\n")
+                self.lines_sent += _count
+                self.checkpoints.append((self.lines_sent, time.monotonic()))
+
+            if _now - _last_keepalive > self.server.keepalive_interval:
+                _last_keepalive = _now
+                _timestamp = time.strftime("%d %b %Y %H:%M:%S GMT", time.gmtime())
+                self._send(f"# aprsc 2.1.14 {_timestamp} {self.server.server_name} simulator\r\n".encode('ascii'))
+
+
+class APRSISServer(object):
+    """
+    APRS-IS compatible TCP server, which streams lines to each connected client.
+    """
+
+    def __init__(self, lines, rate=100, host="127.0.0.1", port=0, keepalive_interval=20, server_name="SIMULATOR", max_batch=1000):
+        """
+        lines: Raw lines (bytes) to send, repeated as necessary.
+        rate: Lines per second sent to each client. None sends as fast as the client will accept.
+              Can be changed while running.
+        host, port: Address to listen on. Port 0 picks a free port (see .address).
+        keepalive_interval: Time (seconds) between keepalive comments.
+        max_batch: Lines per write when the rate is None.
+        """
+        self.lines = list(lines)
+        self.rate = rate
+        self.keepalive_interval = keepalive_interval
+        self.server_name = server_name
+        self.max_batch = max_batch
+
+        # (callsign, line) for every packet sent by a client.
+        self.received = []
+        self.clients = []
+        self.running = False
+
+        self._lock = threading.Lock()
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((host, port))
+        self._sock.listen(5)
+        self.address = self._sock.getsockname()
+
+    def start(self):
+        self.running = True
+        threading.Thread(target=self._accept_loop, name="simulator-accept", daemon=True).start()
+        logging.info(f"Simulator: listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def stop(self):
+        self.running = False
+        self._sock.close()
+
+    def _accept_loop(self):
+        while self.running:
+            try:
+                (_sock, _address) = self._sock.accept()
+            except OSError:
+                return
+            # Accepted sockets inherit the process-wide default timeout, if one is set.
+            _sock.settimeout(None)
+            _client = SimulatedClient(self, _sock, _address)
+            with self._lock:
+                self.clients.append(_client)
+            threading.Thread(target=_client.run, name=f"simulator-client-{_address[1]}", daemon=True).start()
+
+    def _remove_client(self, client):
+        with self._lock:
+            if client in self.clients:
+                self.clients.remove(client)
+
+    def _received(self, client, line):
+        logging.info(f"Simulator: received from {client.callsign}: {line}")
+        with self._lock:
+            self.received.append((client.callsign, line))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "clients": len(self.clients),
+                "lines_sent": sum(_client.lines_sent for _client in self.clients),
+                "lines_received": len(self.received),
+            }
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    _values = sorted(values)
+    return _values[min(len(_values) - 1, int(len(_values) * fraction))]
+
+
+def load_test(lines, start_rate=1000, step=1000, max_rate=100000, step_time=10, workers=0, max_backlog_growth=0.05, sample_interval=0.1):
+    """
+    Run the gateway (with stubbed uploads) against the simulator, increasing
+    the rate by 'step' lines/sec every 'step_time' seconds, until the gateway
+    falls behind, or max_rate is reached. The gateway has fallen behind if the
+    backlog of sent-but-unprocessed lines grows by more than max_backlog_growth
+    times the number of lines sent during a step, or if the socket pushes back
+    so the simulator cannot send at (1 - max_backlog_growth) times the target rate.
+    workers: If > 0, lines are processed through an IngestPipeline with this many workers.
+    Returns a dict with the sustainable rate, and results for each step.
+    """
+    from .pipeline import IngestPipeline
+    from .upstream import FanIn
+
+    _server = APRSISServer(lines, rate=0).start()
+    _gateway = load_gateway()
+    _processed = [0]
+    _lock = threading.Lock()
+    _stop = threading.Event()
+
+    def _process(line):
+        _gateway.parser(line)
+        with _lock:
+            _processed[0] += 1
+
+    if workers > 0:
+        _pipeline = IngestPipeline(_process, workers=workers, drop_policy='block')
+        _pipeline.start()
+        _submit = _pipeline.submit
+    else:
+        _submit = _process
+
+    def _callback(line):
+        if not _stop.is_set():
+            _submit(line)
+
+    # Use the gateway's APRS-IS client, so that messages from the gateway reach the simulator.
+    _ais = FanIn([_server.address], "N0CALL", _callback, filter="t/p", window=0).start()
+    _gateway.ais = _ais
+
+    while not _server.clients or _server.clients[0].callsign is None:
+        time.sleep(0.01)
+    _client = _server.clients[0]
+    # Wait for the simulator to start streaming after the login response.
+    time.sleep(0.2)
+
+    _steps = []
+    _sustainable = None
+    _rate = start_rate
+    try:
+        while _rate <= max_rate:
+            _server.rate = _rate
+            _start = time.monotonic()
+            _processed_start = _processed[0]
+            _sent_start = _client.lines_sent
+            _backlog_start = _client.lines_sent - _processed[0]
+            _latencies = []
+            _send_queue = []
+            while time.monotonic() - _start < step_time:
+                time.sleep(sample_interval)
+                _now = time.monotonic()
+                _count = _processed[0]
+                _sent_time = _client.sent_time(_count)
+                if _sent_time is not None and _count > _processed_start:
+                    _latencies.append(max(0.0, _now - _sent_time))
+                _queued = _client.send_queue_bytes()
+                if _queued is not None:
+                    _send_queue.append(_queued)
+
+            _elapsed = time.monotonic() - _start
+            _sent = _client.lines_sent - _sent_start
+            _backlog_end = _client.lines_sent - _processed[0]
+            _result = {
+                "target_rate": _rate,
+                "sent_rate": _sent / _elapsed,
+                "processed_rate": (_processed[0] - _processed_start) / _elapsed,
+                "backlog_start": _backlog_start,
+                "backlog_end": _backlog_end,
+                "latency_p50": _percentile(_latencies, 0.5),
+                "latency_p99": _percentile(_latencies, 0.99),
+                "latency_max": max(_latencies) if _latencies else None,
+                "send_queue_bytes_max": max(_send_queue) if _send_queue else None,
+            }
+            _steps.append(_result)
+            logging.info(f"Load test step: {_result}")
+
+            if _backlog_end - _backlog_start > _sent * max_backlog_growth or _result["sent_rate"] < _rate * (1 - max_backlog_growth):
+                break
+            _sustainable = _rate
+            _rate += step
+    finally:
+        _stop.set()
+        _server.rate = max(_server.rate or 0, 1)
+        _ais.stop()
+        _ais.join(timeout=5)
+        _server.stop()
+        if workers > 0:
+            _pipeline.stop()
+
+    return {
+        "sustainable_rate": _sustainable,
+        "messages_received": len(_server.received),
+        "steps": _steps,
+    }
+
+
+def _load_lines(args):
+    if args.capture:
+        return [_raw for _timestamp, _raw in read_capture(args.capture)]
+    if args.corpus:
+        return load_corpus(args.corpus)
+    return generate_corpus(args.lines, seed=args.seed)
+
+
+def main():
+    _parser = argparse.ArgumentParser(description="APRS-IS simulator and gateway load test.")
+    _parser.add_argument("--capture", action="append", help="Send lines from these capture files (or directories of capture files)")
+    _parser.add_argument("--corpus", help="Send lines from a corpus file (one raw line per line)")
+    _parser.add_argument("--lines", type=int, default=100000, help="Number of lines in the synthetic corpus (default 100000)")
+    _parser.add_argument("--seed", type=int, default=1, help="Random seed for the synthetic corpus (default 1)")
+    _parser.add_argument("--log-level", default="WARNING", help="Log level (default WARNING)")
+    _commands = _parser.add_subparsers(dest="command", required=True)
+
+    _serve = _commands.add_parser("serve", help="Run the simulator")
+    _serve.add_argument("--host", default="127.0.0.1", help="Address to listen on (default 127.0.0.1)")
+    _serve.add_argument("--port", type=int, default=14580, help="Port to listen on (default 14580)")
+    _serve.add_argument("--rate", default="100", help="Lines per second sent to each client, or 'max' (default 100)")
+
+    _loadtest = _commands.add_parser("loadtest", help="Find the highest rate the gateway can sustain")
+    _loadtest.add_argument("--start-rate", type=int, default=1000, help="Initial rate, lines/sec (default 1000)")
+    _loadtest.add_argument("--step", type=int, default=1000, help="Rate increase per step, lines/sec (default 1000)")
+    _loadtest.add_argument("--max-rate", type=int, default=100000, help="Highest rate to test (default 100000)")
+    _loadtest.add_argument("--step-time", type=float, default=10, help="Duration of each step, seconds (default 10)")
+    _loadtest.add_argument("--workers", type=int, default=0, help="Process lines with an ingest pipeline with this many workers (default 0)")
+    _args = _parser.parse_args()
+
+    logging.basicConfig(level=_args.log_level.upper(), format="%(asctime)s - %(levelname)s - %(message)s")
+    _lines = _load_lines(_args)
+
+    if _args.command == "serve":
+        _server = APRSISServer(
+            _lines,
+            rate=None if _args.rate == "max" else float(_args.rate),
+            host=_args.host,
+            port=_args.port
+        ).start()
+        try:
+            while True:
+                time.sleep(10)
+                logging.warning(f"Simulator: {_server.stats()}")
+        except KeyboardInterrupt:
+            _server.stop()
+    else:
+        _results = load_test(
+            _lines,
+            start_rate=_args.start_rate,
+            step=_args.step,
+            max_rate=_args.max_rate,
+            step_time=_args.step_time,
+            workers=_args.workers
+        )
+        print(json.dumps(_results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#
+#   SondeHub APRS Gateway - Upload Sinks
+#
+#   Destinations for the payloads and listener (and chase-car) positions the
+#   gateway uploads. A sink is anything with a publish(body) method, and
+#   optionally stats() and close() - the SNS BatchPublisher and the listener
+#   API ListenerClient are both sinks. The sinks here write uploads to stdout
+#   or a file (as one JSON object per line), keep them in memory, or pass them
+#   to a function, for running the gateway without access to SondeHub.
+#
+#   boto3 is only imported when an SNS sink is created.
+#
+import collections
+import json
+import sys
+import threading
+
+from .listener_client import ListenerClient
+from .sns_batch import BatchPublisher
+
+
+class MemorySink(object):
+    """ Keeps uploads in memory. """
+
+    def __init__(self, max_items=None):
+        """ max_items: Maximum number of uploads kept, oldest discarded first. None keeps all. """
+        self.items = collections.deque(maxlen=max_items)
+        self.published = 0
+
+    def publish(self, body):
+        self.items.append(body)
+        self.published += 1
+
+    def stats(self):
+        return {"published": self.published, "kept": len(self.items)}
+
+
+class CallbackSink(object):
+    """ Passes each upload to a function, as (upload type, body). """
+
+    def __init__(self, upload_type, callback=None):
+        """
+        upload_type: Upload type passed to the callback, e.g. 'payload'.
+        callback: Function called with (upload type, body). If None, uploads are only counted.
+        """
+        self.upload_type = upload_type
+        self.callback = callback
+        self.published = 0
+
+    def publish(self, body):
+        self.published += 1
+        if self.callback:
+            self.callback(self.upload_type, body)
+
+    def stats(self):
+        return {"published": self.published}
+
+
+class JSONLinesSink(object):
+    """
+    Writes each upload as a JSON object ({"type": upload type, "body": body}) on
+    its own line, to stdout or a file.
+    """
+
+    def __init__(self, upload_type, filename=None):
+        """
+        upload_type: Upload type written with each body, e.g. 'payload'.
+        filename: File to append to. Written to stdout if None.
+        """
+        self.upload_type = upload_type
+        self.filename = filename
+        self.published = 0
+        self._file = open(filename, 'a') if filename else sys.stdout
+        self._lock = threading.Lock()
+
+    def publish(self, body):
+        _line = json.dumps({"type": self.upload_type, "body": body}) + "\n"
+        with self._lock:
+            self._file.write(_line)
+            self._file.flush()
+            self.published += 1
+
+    def close(self):
+        if self.filename:
+            with self._lock:
+                self._file.close()
+
+    def stats(self):
+        return {"published": self.published}
+
+
+def sns_sink(topic_arn, **kwargs):
+    """ A BatchPublisher for an SNS topic. Keyword arguments are passed to BatchPublisher. """
+    import boto3
+    return BatchPublisher(boto3.client('sns'), topic_arn, **kwargs)
+
+
+def listener_api_sink(url, **kwargs):
+    """ A ListenerClient for the listener API. Keyword arguments are passed to ListenerClient. """
+    return ListenerClient(url, **kwargs)
@@ -0,0 +1,194 @@
+#
+#   SondeHub APRS Gateway - Batched SNS Publisher
+#
+#   Buffers payloads and publishes them to SNS using PublishBatch, flushing
+#   when a batch is full or when the oldest buffered payload has waited
+#   longer than the linger time.
+#
+#   publish() only adds to the (bounded) buffer - batches are submitted from a
+#   background thread, so slow or failing SNS calls never hold up the caller
+#   (which may be the APRS-IS event loop thread).
+#
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .metrics import REGISTRY
+
+# SNS limits a PublishBatch call to 10 entries.
+SNS_MAX_BATCH_SIZE = 10
+
+METRIC_PUBLISH_SECONDS = REGISTRY.histogram("sns_publish_seconds", "SNS PublishBatch call latency")
+METRIC_PUBLISH_ERRORS = REGISTRY.counter("sns_publish_errors_total", "SNS publishing errors", ["type"])
+
+
+class BatchPublisher(object):
+    """
+    Publishes payloads to an SNS topic in batches.
+
+    client is a boto3 SNS client (or anything providing publish_batch with the same
+    request/response format).
+    """
+
+    def __init__(self, client, topic_arn, batch_size=SNS_MAX_BATCH_SIZE, max_linger=0.25, max_in_flight=4, max_retries=3, retry_delay=0.5, max_buffered=10000):
+        """
+        batch_size: Number of payloads per PublishBatch call (max 10).
+        max_linger: Maximum time (seconds) a payload waits in the buffer before being sent.
+        max_in_flight: Maximum number of concurrent PublishBatch calls.
+        max_retries: Number of times to retry failed entries.
+        retry_delay: Initial delay (seconds) between retries, doubled on each retry.
+        max_buffered: Maximum number of payloads waiting to be sent. Further payloads are dropped.
+        """
+        self.client = client
+        self.topic_arn = topic_arn
+        self.batch_size = max(1, min(batch_size, SNS_MAX_BATCH_SIZE))
+        self.max_linger = max_linger
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_buffered = max_buffered
+
+        self.payloads_published = 0
+        self.payloads_dropped = 0
+        self.payloads_failed = 0
+        self.batches_sent = 0
+        self.entries_retried = 0
+
+        self._buffer = []
+        self._buffer_time = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self._cond = threading.Condition(self._lock)
+        self._in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="sns-publish")
+        self._running = True
+        self._linger_thread = threading.Thread(target=self._linger, name="sns-linger", daemon=True)
+        self._linger_thread.start()
+
+    def publish(self, payload):
+        """ Queue a payload (dict) for publishing. Never waits for a batch to be sent. """
+        _message = json.dumps(payload)
+        with self._cond:
+            if len(self._buffer) >= self.max_buffered:
+                self.payloads_dropped += 1
+                METRIC_PUBLISH_ERRORS.inc("dropped")
+                logging.warning("SNS publish buffer full, dropped payload")
+                return
+            self._buffer.append(_message)
+            if self._buffer_time is None:
+                self._buffer_time = time.monotonic()
+            if len(self._buffer) == 1 or len(self._buffer) % self.batch_size == 0:
+                self._cond.notify()
+
+    def close(self):
+        """ Send the buffered payloads, and wait for all in-flight batches to complete. """
+        with self._cond:
+            self._running = False
+            self._cond.notify()
+        self._linger_thread.join()
+        self._executor.shutdown(wait=True)
+
+    def _take_batch(self):
+        # Must be called with the lock held.
+        _batch = self._buffer[:self.batch_size]
+        self._buffer = self._buffer[self.batch_size:]
+        self._buffer_time = time.monotonic() if self._buffer else None
+        return _batch
+
+    def _linger(self):
+        """ Submit full batches, and partial batches once they have lingered (or when closing). """
+        with self._cond:
+            while self._running or self._buffer:
+                if self._buffer_time is None:
+                    self._cond.wait()
+                    continue
+
+                if self._running and len(self._buffer) < self.batch_size:
+                    _wait = self._buffer_time + self.max_linger - time.monotonic()
+                    if _wait > 0:
+                        self._cond.wait(_wait)
+                        continue
+
+                _batch = self._take_batch()
+                self._cond.release()
+                try:
+                    self._submit(_batch)
+                finally:
+                    self._cond.acquire()
+
+    def _submit(self, batch):
+        # Block here if too many batches are already in flight.
+        self._in_flight.acquire()
+        try:
+            self._executor.submit(self._send, batch)
+        except RuntimeError:
+            # Executor has been shut down.
+            self._in_flight.release()
+            logging.error(f"SNS publisher closed, dropped {len(batch)} payloads")
+
+    def _send(self, batch):
+        try:
+            _entries = {}
+            with self._lock:
+                for _message in batch:
+                    _entries[str(self._next_id)] = _message
+                    self._next_id += 1
+
+            _delay = self.retry_delay
+            for _attempt in range(self.max_retries + 1):
+                if _attempt > 0:
+                    time.sleep(_delay)
+                    _delay *= 2
+                    self._count(entries_retried=len(_entries))
+
+                _start = time.perf_counter()
+                try:
+                    _response = self.client.publish_batch(
+                        TopicArn=self.topic_arn,
+                        PublishBatchRequestEntries=[{'Id': _id, 'Message': _message} for _id, _message in _entries.items()]
+                    )
+                except Exception:
+                    METRIC_PUBLISH_ERRORS.inc("exception")
+                    logging.exception(f"Error publishing batch of {len(_entries)} payloads to SNS")
+                    continue
+                finally:
+                    METRIC_PUBLISH_SECONDS.observe_since(_start)
+
+                _published = 0
+                _failed = 0
+                for _success in _response.get('Successful', []):
+                    if _entries.pop(_success['Id'], None) is not None:
+                        _published += 1
+
+                for _failure in _response.get('Failed', []):
+                    METRIC_PUBLISH_ERRORS.inc("sender_fault" if _failure.get('SenderFault') else "entry_failed")
+                    if _failure.get('SenderFault'):
+                        # Retrying won't help with these.
+                        if _entries.pop(_failure['Id'], None) is not None:
+                            _failed += 1
+                        logging.error(f"SNS rejected payload: {_failure.get('Code')} {_failure.get('Message')}")
+
+                self._count(batches_sent=1, payloads_published=_published, payloads_failed=_failed)
+                if not _entries:
+                    return
+
+            self._count(payloads_failed=len(_entries))
+            logging.error(f"Giving up publishing {len(_entries)} payloads to SNS after {self.max_retries} retries")
+        finally:
+            self._in_flight.release()
+
+    def _count(self, **counts):
+        with self._lock:
+            for _name, _value in counts.items():
+                setattr(self, _name, getattr(self, _name) + _value)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buffered": len(self._buffer),
+                "payloads_published": self.payloads_published,
+                "payloads_failed": self.payloads_failed,
+                "payloads_dropped": self.payloads_dropped,
+                "batches_sent": self.batches_sent,
+                "entries_retried": self.entries_retried,
+            }
@@ -0,0 +1,135 @@
+#
+#   SondeHub APRS Gateway - Warm-start State Snapshots
+#
+#   Periodically saves the gateway's in-memory state (station positions,
+#   message cooldowns, receive times and adaptive filter iGates) to an SQLite
+#   database, and loads it again on startup. Without this, a restart loses the
+#   iGate positions needed for listener uploads, and re-messages every live
+#   balloon.
+#
+#   Each snapshot replaces the previous one in a single transaction, in WAL
+#   mode, so a crash part way through leaves the last complete snapshot.
+#   Entries which have expired since the snapshot was saved are skipped when
+#   loading.
+#
+#   Components provide snapshot() (a list of rows), restore(rows), and a
+#   SNAPSHOT_COLUMNS tuple naming the columns of each row.
+#
+import logging
+import sqlite3
+import threading
+import time
+
+
+class StateStore(object):
+    """ Saves and loads the state of several components to an SQLite database. """
+
+    def __init__(self, path, components, interval=60, clock=time.time):
+        """
+        path: Database filename.
+        components: Dict of name -> component. The name is used as the table name.
+        interval: Time (seconds) between snapshots.
+        clock: Function returning the current time.
+        """
+        self.path = path
+        self.components = components
+        self.interval = interval
+        self.clock = clock
+
+        self.snapshots = 0
+        self.failures = 0
+        self.last_rows = 0
+        self.last_seconds = 0.0
+        self.last_saved = None
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _connect(self):
+        _db = sqlite3.connect(self.path, timeout=30)
+        _db.execute("PRAGMA journal_mode=WAL")
+        _db.execute("PRAGMA synchronous=NORMAL")
+        _db.execute("CREATE TABLE IF NOT EXISTS snapshot (saved REAL)")
+        for _name, _component in self.components.items():
+            _columns = list(_component.SNAPSHOT_COLUMNS)
+            _existing = [_row[1] for _row in _db.execute(f'PRAGMA table_info("{_name}")')]
+            if _existing and _existing != _columns:
+                # Saved by a different version - it can't be loaded.
+                logging.warning(f"State snapshot table {_name} has columns {_existing}, expected {_columns} - discarding")
+                _db.execute(f'DROP TABLE "{_name}"')
+            _db.execute(f'CREATE TABLE IF NOT EXISTS "{_name}" ({", ".join(_columns)})')
+        _db.commit()
+        return _db
+
+    def load(self):
+        """ Restore each component from the database. Returns a dict of name -> number of entries loaded. """
+        _start = time.perf_counter()
+        _loaded = {}
+        _db = self._connect()
+        try:
+            _saved = _db.execute("SELECT saved FROM snapshot").fetchone()
+            for _name, _component in self.components.items():
+                _loaded[_name] = _component.restore(_db.execute(f'SELECT * FROM "{_name}"').fetchall())
+        finally:
+            _db.close()
+
+        if _saved:
+            logging.info(
+                "Loaded state snapshot from %.0f seconds ago in %.2f seconds: %s",
+                self.clock() - _saved[0], time.perf_counter() - _start, _loaded
+            )
+        return _loaded
+
+    def save(self):
+        """ Save a snapshot of each component, replacing the previous snapshot. Returns the number of rows saved. """
+        with self._lock:
+            _start = time.perf_counter()
+            _snapshots = {_name: _component.snapshot() for _name, _component in self.components.items()}
+            _now = self.clock()
+            _db = self._connect()
+            try:
+                with _db:
+                    _db.execute("DELETE FROM snapshot")
+                    _db.execute("INSERT INTO snapshot VALUES (?)", (_now,))
+                    for _name, _rows in _snapshots.items():
+                        _placeholders = ", ".join("?" * len(self.components[_name].SNAPSHOT_COLUMNS))
+                        _db.execute(f'DELETE FROM "{_name}"')
+                        _db.executemany(f'INSERT INTO "{_name}" VALUES ({_placeholders})', _rows)
+            finally:
+                _db.close()
+
+            self.snapshots += 1
+            self.last_rows = sum(len(_rows) for _rows in _snapshots.values())
+            self.last_seconds = time.perf_counter() - _start
+            self.last_saved = _now
+            return self.last_rows
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception:
+                self.failures += 1
+                logging.exception("Error saving state snapshot")
+
+    def start(self):
+        """ Start saving snapshots every interval seconds. """
+        self._thread = threading.Thread(target=self._run, name="state-snapshot", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Stop the snapshot thread, and save a final snapshot. """
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.save()
+
+    def stats(self):
+        return {
+            "snapshots": self.snapshots,
+            "failures": self.failures,
+            "rows": self.last_rows,
+            "save_seconds": round(self.last_seconds, 3),
+        }
@@ -0,0 +1,90 @@
+import unittest
+
+from .aprs_filter import AdaptiveFilter
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class FakeIS(object):
+    def __init__(self):
+        self.filters = []
+
+    def set_filter(self, filter_text):
+        self.filters.append(filter_text)
+
+
+class TestAdaptiveFilter(unittest.TestCase):
+    def test_updates(self):
+        _clock = FakeClock()
+        _ais = FakeIS()
+        _filter = AdaptiveFilter("s/O", ttl=3600, update_interval=60, clock=_clock.time)
+
+        _filter.apply(_ais, force=True)
+        self.assertEqual(_ais.filters, ["s/O"])
+
+        # First update is sent immediately, later ones are rate limited.
+        _clock.now += 60
+        _filter.add("VK5ARG-2")
+        _filter.apply(_ais)
+        _filter.add("DB0FRI*")
+        _filter.add("not a callsign")
+        _filter.apply(_ais)
+        self.assertEqual(_ais.filters[-1], "s/O b/VK5ARG-2")
+        _clock.now += 60
+        _filter.apply(_ais)
+        self.assertEqual(_ais.filters[-1], "s/O b/DB0FRI/VK5ARG-2")
+
+        # No change, no update.
+        _clock.now += 60
+        _filter.add("DB0FRI")
+        _filter.apply(_ais)
+        self.assertEqual(len(_ais.filters), 3)
+
+        # VK5ARG-2 expires.
+        _clock.now += 3500
+        _filter.apply(_ais)
+        self.assertEqual(_ais.filters[-1], "s/O b/DB0FRI")
+        self.assertEqual(_filter.igates(), ["DB0FRI"])
+
+    def test_max_length(self):
+        _filter = AdaptiveFilter("s/O", max_length=len("s/O b/CALL10/CALL11/CALL12"))
+        for _i in range(13):
+            _filter.add(f"CALL{_i}")
+        self.assertEqual(_filter.filter_string(), "s/O b/CALL10/CALL11/CALL12")
+        self.assertEqual(_filter.stats()["igates_in_filter"], 3)
+
+    def test_balloons(self):
+        # Balloons have their own share of the filter, and don't push out iGates.
+        _filter = AdaptiveFilter("s/O", max_length=len("s/O b/IGATE1/IGATE2 b/BAL1/BAL2"), balloon_max_length=len(" b/BAL1/BAL2"))
+        _filter.add("IGATE1")
+        _filter.add("IGATE2")
+        for _i in range(4):
+            _filter.add_balloon(f"BAL{_i}")
+        self.assertEqual(_filter.filter_string(), "s/O b/IGATE1/IGATE2 b/BAL2/BAL3")
+        self.assertEqual(_filter.balloons(), ["BAL3", "BAL2", "BAL1", "BAL0"])
+        _stats = _filter.stats()
+        self.assertEqual((_stats["igates_in_filter"], _stats["balloons_in_filter"]), (2, 2))
+        # Balloons are not saved with the iGates.
+        self.assertEqual([_row[0] for _row in _filter.snapshot()], ["IGATE1", "IGATE2"])
+
+        # iGates can use any space the balloons don't.
+        _filter = AdaptiveFilter("s/O", max_length=len("s/O b/IGATE1/IGATE2"), balloon_max_length=len(" b/BAL1/BAL2"))
+        _filter.add("IGATE1")
+        _filter.add("IGATE2")
+        self.assertEqual(_filter.filter_string(), "s/O b/IGATE1/IGATE2")
+
+        # Disabled.
+        _filter = AdaptiveFilter("s/O", balloon_max_length=0)
+        _filter.add_balloon("BAL1")
+        self.assertEqual(_filter.filter_string(), "s/O")
+        self.assertEqual(_filter.balloons(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
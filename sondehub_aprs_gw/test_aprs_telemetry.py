@@ -0,0 +1,146 @@
+import unittest
+
+from .aprs_filter import AdaptiveFilter
+from .aprs_telemetry import TelemetryStore, StationTelemetry, parse_telemetry_line
+from .gateway import Gateway
+from .sinks import MemorySink
+
+BALLOON = b"VK5QI-11>APRS,WIDE2-1,qAR,%s:!3455.12S/13840.34EO/A=030000 Test balloon %d"
+FRAME = b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ:T#%03d,%d,128,255,000,012,11100000"
+DEFINITIONS = [
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ::VK5QI-11 :PARM.Batt V,Temp,Pressure,,,Heater,GPS",
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ::VK5QI-11 :UNIT.V,deg.C,hPa",
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ::VK5QI-11 :EQNS.0,0.02,0,0,0.5,-60,0,4,0{01",
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ::VK5QI-11 :BITS.10110000,Test Project",
+]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000000.0
+
+    def time(self):
+        return self.now
+
+
+class TestStationTelemetry(unittest.TestCase):
+    def test_defaults(self):
+        # Without definitions, values are unscaled with default names, and bits are not included.
+        self.assertEqual(StationTelemetry().decode("001,199,0.5,x,-3"), {"a1": 199.0, "a2": 0.5, "a4": -3.0})
+
+    def test_definitions(self):
+        _station = StationTelemetry()
+        for _line in DEFINITIONS:
+            (_kind, _callsign, (_type, _text)) = parse_telemetry_line(_line)
+            self.assertEqual((_kind, _callsign), ("definition", "VK5QI-11"))
+            _station.define(_type, _text)
+        self.assertEqual(_station.project, "Test Project")
+        self.assertEqual(_station.units[:3], ("V", "deg.C", "hPa"))
+        self.assertEqual(
+            _station.decode("001,150,128,255,000,012,11100000"),
+            {"batt_v": 3.0, "temp": 4.0, "pressure": 1020.0, "a4": 0.0, "a5": 12.0, "heater": True, "gps": False}
+        )
+
+    def test_invalid_definitions(self):
+        _station = StationTelemetry()
+        with self.assertRaises(ValueError):
+            _station.define("EQNS", "0,1,x")
+        with self.assertRaises(ValueError):
+            _station.define("BITS", "12345678,Title")
+        self.assertEqual(_station.decode("001,10"), {"a1": 10.0})
+
+
+class TestTelemetryStore(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.store = TelemetryStore(ttl=3600, frame_ttl=600, max_entries=3, clock=self.clock.time)
+
+    def test_take(self):
+        self.assertIsNone(self.store.take("VK5QI-11", "packet 1"))
+        self.store.update_frame("VK5QI-11", "001,1")
+        self.assertEqual(self.store.take("VK5QI-11", "packet 1"), {"a1": 1.0})
+        # Copies of the same packet get the same values, later packets don't.
+        self.assertEqual(self.store.take("VK5QI-11", "packet 1"), {"a1": 1.0})
+        self.assertIsNone(self.store.take("VK5QI-11", "packet 2"))
+
+        # Copies of a frame via other iGates are ignored.
+        self.store.update_frame("VK5QI-11", "001,1")
+        self.assertIsNone(self.store.take("VK5QI-11", "packet 3"))
+        self.assertEqual(self.store.stats()["frames_duplicate"], 1)
+
+        # Frames which are too old are not attached.
+        self.store.update_frame("VK5QI-11", "002,2")
+        self.clock.now += 601
+        self.assertIsNone(self.store.take("VK5QI-11", "packet 4"))
+        self.assertEqual(self.store.stats()["frames_stale"], 1)
+
+    def test_expiry(self):
+        self.store.update_definition("VK5QI-11", "PARM", "Batt")
+        for _callsign in ("A", "B", "C"):
+            self.store.update_frame(_callsign, "001,1")
+        self.assertNotIn("VK5QI-11", self.store)
+        self.assertEqual(self.store.stats()["evicted_size"], 1)
+        self.assertEqual((self.store.stats()["defined"], self.store.stats()["frames_pending"]), (0, 3))
+
+        self.clock.now += 3601
+        self.store.update_frame("D", "001,1")
+        self.assertEqual(self.store.stats()["stations"], 1)
+        self.assertEqual(self.store.stats()["evicted_ttl"], 3)
+        self.assertEqual(self.store.stats()["frames_pending"], 1)
+
+    def test_snapshot(self):
+        self.store.update_definition("VK5QI-11", "PARM", "Batt")
+        self.store.update_definition("VK5QI-11", "EQNS", "0,2,0")
+        self.store.update_frame("VK5ZZ", "001,1")
+        _rows = self.store.snapshot()
+        self.assertEqual(_rows, [("VK5QI-11", "Batt", None, "0,2,0", None, self.clock.now)])
+
+        _store = TelemetryStore(clock=self.clock.time)
+        self.assertEqual(_store.restore(_rows), 1)
+        _store.update_frame("VK5QI-11", "002,3")
+        self.assertEqual((_store.stats()["defined"], _store.stats()["frames_pending"]), (1, 1))
+        self.assertEqual(_store.take("VK5QI-11", "packet"), {"batt": 6.0})
+        self.assertEqual(_store.stats()["frames_pending"], 0)
+
+
+class TestGatewayTelemetry(unittest.TestCase):
+    def test_payload_telemetry(self):
+        _clock = FakeClock()
+        _gateway = Gateway(payload_sink=MemorySink(), clock=_clock.time)
+        # A frame before the definitions arrive is uploaded unscaled.
+        _gateway.parser(FRAME % (1, 150))
+        _gateway.parser(BALLOON % (b"VK5ZZ", 1))
+        for _line in DEFINITIONS:
+            _gateway.parser(_line)
+        _gateway.parser(FRAME % (2, 160))
+        _gateway.parser(BALLOON % (b"VK5ZZ", 2))
+        _gateway.parser(BALLOON % (b"VK5YY", 2))
+        _clock.now += 10
+        _gateway.parser(BALLOON % (b"VK5ZZ", 3))
+
+        _payloads = list(_gateway.payload_sink.items)
+        self.assertEqual(len(_payloads), 4)
+        self.assertEqual((_payloads[0]["a1"], _payloads[0]["a5"]), (150.0, 12.0))
+        self.assertNotIn("heater", _payloads[0])
+        # The copy via another iGate gets the same values.
+        for _payload in _payloads[1:3]:
+            self.assertEqual((_payload["batt_v"], _payload["temp"], _payload["heater"]), (3.2, 4.0, True))
+        self.assertNotIn("batt_v", _payloads[3])
+
+    def test_disabled(self):
+        _gateway = Gateway(payload_sink=MemorySink(), aprs_filter=AdaptiveFilter(), aprs_telemetry=False)
+        _gateway.parser(FRAME % (1, 150))
+        _gateway.parser(BALLOON % (b"VK5ZZ", 1))
+        self.assertNotIn("a1", _gateway.payload_sink.items[0])
+        self.assertEqual(_gateway.aprs_filter.balloons(), [])
+
+    def test_filter_balloons(self):
+        # Balloons are added to the adaptive filter's balloon list, not the iGate list.
+        _gateway = Gateway(payload_sink=MemorySink(), aprs_filter=AdaptiveFilter())
+        _gateway.parser(BALLOON % (b"VK5ZZ", 1))
+        self.assertEqual(_gateway.aprs_filter.igates(), ["VK5ZZ"])
+        self.assertEqual(_gateway.aprs_filter.balloons(), ["VK5QI-11"])
+
+
+if __name__ == '__main__':
+    unittest.main()
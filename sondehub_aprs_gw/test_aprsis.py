@@ -0,0 +1,77 @@
+import asyncio
+import time
+import unittest
+
+from .aprsis import APRSISClient, LoginError, StalledError
+from .simulator import APRSISServer
+
+
+class TestAPRSISClient(unittest.TestCase):
+    def test_receive(self):
+        _lines = [f"N0CALL-{_i % 16}>APRS,TCPIP*,qAC,T2TEST:>Status {_i}".encode('ascii') for _i in range(100)]
+        _server = APRSISServer(_lines, rate=1000, server_name="T2TEST").start()
+        self.addCleanup(_server.stop)
+
+        async def _run():
+            _client = APRSISClient("N0CALL", *_server.address, filter="t/p")
+            await _client.connect()
+            _received = []
+            async for _line in _client.lines_received():
+                _received.append(_line)
+                if len(_received) == 10:
+                    await _client.set_filter("s/O")
+                if len(_received) == 50:
+                    break
+            await _client.send("SHUB>APRS,TCPIP*::N0CALL-11:Hello")
+            await asyncio.sleep(0.1)
+            _filter = _server.clients[0].filter
+            await _client.close()
+            return _client, _received, _filter
+
+        (_client, _received, _filter) = asyncio.run(_run())
+        self.assertEqual(_client.server, "T2TEST")
+        self.assertEqual(_received, _lines[:50])
+        self.assertEqual(_filter, "s/O")
+        self.assertEqual(_server.received, [("N0CALL", b"SHUB>APRS,TCPIP*::N0CALL-11:Hello")])
+
+    def test_stalled(self):
+        # The server sends nothing after the login - not even keepalives.
+        _server = APRSISServer([], rate=0, keepalive_interval=3600).start()
+        self.addCleanup(_server.stop)
+
+        async def _run():
+            _client = APRSISClient("N0CALL", *_server.address, keepalive_timeout=0.3)
+            await _client.connect()
+            try:
+                async for _line in _client.lines_received():
+                    pass
+            finally:
+                await _client.close()
+
+        _start = time.monotonic()
+        with self.assertRaises(StalledError):
+            asyncio.run(_run())
+        self.assertLess(time.monotonic() - _start, 2)
+
+    def test_login_rejected(self):
+        async def _handle(reader, writer):
+            writer.write(b"# aprsc 2.1.14\r\n")
+            await reader.readline()
+            writer.write(b"# logresp N0CALL unverified, server T2TEST\r\n")
+            await writer.drain()
+            writer.close()
+
+        async def _run():
+            _server = await asyncio.start_server(_handle, "127.0.0.1", 0)
+            _port = _server.sockets[0].getsockname()[1]
+            try:
+                await APRSISClient("N0CALL", "127.0.0.1", _port, passcode=12345).connect()
+            finally:
+                _server.close()
+
+        with self.assertRaises(LoginError):
+            asyncio.run(_run())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from . import benchmark, prefilter
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_corpus_mix(self):
+        _corpus = benchmark.generate_corpus(2000, seed=3)
+        self.assertEqual(_corpus, benchmark.generate_corpus(2000, seed=3))
+        _classes = [prefilter.classify(_line) for _line in _corpus]
+        for _class in (prefilter.DROP, prefilter.POSITION, prefilter.BALLOON, prefilter.CHASE):
+            self.assertIn(_class, _classes)
+
+    def test_run(self):
+        _results = benchmark.run(benchmark.generate_corpus(2000, seed=3))
+        self.assertEqual(_results["lines"], 2000)
+        self.assertGreater(_results["payloads_published"], 0)
+        self.assertGreater(_results["listener_uploads"], 0)
+        for _stage in ("position", "parse", "filter", "convert", "publish"):
+            self.assertIn(_stage, _results["stages"])
+
+
+    def test_decoder_benchmark(self):
+        _results = benchmark.decoder_benchmark(benchmark.generate_corpus(2000, seed=3), repeat=1)
+        self.assertGreater(_results["lines"], 0)
+        self.assertEqual(_results["fast_decoded"], 1.0)
+        self.assertEqual(_results["mismatches"], [])
+        self.assertLess(_results["fast_us_per_line"], _results["aprslib_us_per_line"])
+
+
+if __name__ == '__main__':
+    unittest.main()
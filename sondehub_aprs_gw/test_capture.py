@@ -0,0 +1,47 @@
+import gzip
+import os
+import tempfile
+import unittest
+
+from .capture import CaptureWriter, capture_files, read_capture
+
+
+class FakeClock(object):
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class TestCapture(unittest.TestCase):
+    def test_write_rotate_read(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _clock = FakeClock(1700000000.0)
+            _writer = CaptureWriter(_dir, rotate_interval=60, max_files=2, clock=_clock.time)
+            _lines = []
+            for _i in range(5):
+                _line = f"N0CALL-{_i}>APRS,TCPIP*:!5000.00N/01400.00E-\xb0".encode('latin-1')
+                _writer.write(_line)
+                _lines.append((_clock.now, _line))
+                _clock.now += 40
+            _writer.close()
+
+            # 5 lines over 160 seconds gives 3 files, the oldest of which has been removed.
+            self.assertEqual(_writer.files_opened, 3)
+            self.assertEqual(len(capture_files(_dir)), 2)
+            self.assertEqual(list(read_capture([_dir])), _lines[2:])
+
+    def test_truncated(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _filename = os.path.join(_dir, "aprs-test.txt.gz")
+            _data = gzip.compress(b"1700000000.000 A>B:>one\n1700000001.000 A>B:>two\n" * 1000)
+            with open(_filename, 'wb') as _f:
+                _f.write(_data[:len(_data) // 2])
+            _read = list(read_capture([_filename]))
+            self.assertGreater(len(_read), 0)
+            self.assertEqual(_read[0], (1700000000.0, b"A>B:>one"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+
+from . import benchmark
+from .coalesce import PacketCoalescer, packet_key
+from .replay import replay
+
+BEACON = b"F1DZP-11>APZ41N,WIDE1-1,%s,%s:!5056.48N/00151.60EO021/000/A=010000/P6S7T29V2947C00"
+IGATES = [b"F6ASP", b"F4GOH-10", b"F5ZMH", b"ON4AVE-1"]
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestPacketCoalescer(unittest.TestCase):
+    def test_key_ignores_path(self):
+        self.assertEqual(packet_key(BEACON % (b"qAR", b"F6ASP")), packet_key(BEACON % (b"qAO", b"F5ZMH")))
+        self.assertNotEqual(packet_key(BEACON % (b"qAR", b"F6ASP")), packet_key(b"F1DZP-12>APZ41N,qAR,F6ASP:!5056.48N/00151.60EO"))
+
+    def test_window(self):
+        _clock = FakeClock()
+        _coalescer = PacketCoalescer(2.0, clock=_clock.time)
+        _packet = _coalescer.put(b"key", {"from": "F1DZP-11"})
+        _clock.now += 1.5
+        self.assertIs(_coalescer.get(b"key"), _packet)
+        _clock.now += 1.0
+        self.assertIsNone(_coalescer.get(b"key"))
+        self.assertEqual(_coalescer.stats()["copies"], 1)
+
+    def test_combined_emit(self):
+        _clock = FakeClock()
+        _emitted = []
+        _coalescer = PacketCoalescer(2.0, combine=True, emit=_emitted.append, clock=_clock.time)
+        _packet = _coalescer.put(b"a", {})
+        _coalescer.set_payload(_packet, {"lat": 1})
+        _coalescer.add_uploader(_packet, {"uploader_callsign": "F6ASP"})
+        # Rejected packets (no payload) are not emitted.
+        _coalescer.put(b"b", {})
+        _clock.now += 3
+        _coalescer.flush()
+        self.assertEqual(_emitted, [_packet])
+        self.assertEqual(_coalescer.stats()["held"], 0)
+
+    def test_late_copy_emits_first(self):
+        # A copy arriving after the window, before the flush thread has run,
+        # must not replace (and lose) the held packet.
+        _clock = FakeClock()
+        _emitted = []
+        _coalescer = PacketCoalescer(2.0, combine=True, emit=_emitted.append, clock=_clock.time)
+        _first = _coalescer.put(b"a", {})
+        _coalescer.set_payload(_first, {"lat": 1})
+        _clock.now += 2.5
+        self.assertIsNone(_coalescer.get(b"a"))
+        _second = _coalescer.put(b"a", {})
+        self.assertIsNot(_second, _first)
+        self.assertEqual(_emitted, [_first])
+        _coalescer.set_payload(_second, {"lat": 2})
+        _coalescer.flush(all=True)
+        self.assertEqual([_packet.payload for _packet in _emitted], [{"lat": 1}, {"lat": 2}])
+
+    def test_concurrent_put_returns_held(self):
+        _clock = FakeClock()
+        _coalescer = PacketCoalescer(2.0, clock=_clock.time)
+        _first = _coalescer.put(b"a", {})
+        _clock.now += 0.5
+        self.assertIs(_coalescer.put(b"a", {}), _first)
+        self.assertEqual(_coalescer.stats()["packets"], 1)
+
+
+class TestGatewayCoalescing(unittest.TestCase):
+    def setUp(self):
+        self.uploads = []
+        self.gateway = benchmark.load_gateway(lambda _type, _body: self.uploads.append((_type, _body)))
+        self.addCleanup(setattr, self.gateway, "coalescer", None)
+
+    def _replay(self, corpus, coalescer=None):
+        del self.uploads[:]
+        self.gateway.positions.clear()
+        self.gateway.rx_times.clear()
+        self.gateway.message_sender.clear()
+        self.gateway.coalescer = coalescer
+        replay(corpus, self.gateway)
+        if coalescer:
+            coalescer.flush(all=True)
+        return [_body for _type, _body in self.uploads if _type == "payload"]
+
+    def _corpus(self):
+        _corpus = []
+        for _beacon in range(3):
+            _time = 1700000000.0 + _beacon * 60
+            for _i, _igate in enumerate(IGATES):
+                _line = BEACON.replace(b"A=010000", b"A=01%04d" % _beacon) % (b"qAR", _igate)
+                _corpus.append((_time + _i * 0.3, _line))
+        # A copy with a blocked path element is never published.
+        _corpus.append((1700000000.5, BEACON % (b"NOHUB,qAO", b"F5ZMH")))
+        return _corpus
+
+    def test_per_uploader_matches_uncoalesced(self):
+        _corpus = self._corpus()
+        _expected = self._replay(_corpus)
+        _coalescer = PacketCoalescer(2.0, emit=self.gateway.publish_combined)
+        _payloads = self._replay(_corpus, _coalescer)
+        self.assertEqual(len(_expected), 12)
+        self.assertEqual(_payloads, _expected)
+        self.assertEqual(_coalescer.stats()["packets"], 3)
+
+    def test_combined(self):
+        _coalescer = PacketCoalescer(2.0, combine=True, emit=self.gateway.publish_combined)
+        _payloads = self._replay(self._corpus(), _coalescer)
+        self.assertEqual(len(_payloads), 3)
+        self.assertEqual(
+            [_uploader["uploader_callsign"] for _uploader in _payloads[0]["uploaders"]],
+            [_igate.decode() for _igate in IGATES]
+        )
+        self.assertEqual(_payloads[0]["uploader_callsign"], "F6ASP")
+
+
+if __name__ == '__main__':
+    unittest.main()
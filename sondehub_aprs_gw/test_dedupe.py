@@ -0,0 +1,40 @@
+import unittest
+
+from .dedupe import RxTimeCache
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestRxTimeCache(unittest.TestCase):
+    def test_duplicates(self):
+        _clock = FakeClock()
+        _cache = RxTimeCache(window=10, clock=_clock)
+        self.assertEqual(_cache.receive_time('!5224.52N/02103.90EO122/056'), 1000.0)
+        _clock.now += 5
+        self.assertEqual(_cache.receive_time('!5224.52N/02103.90EO122/056'), 1000.0)
+        self.assertEqual(_cache.receive_time(b'!5224.52N/02103.90EO122/056'), 1000.0)
+        self.assertEqual(_cache.receive_time('!5224.52N/02103.90EO122/057'), 1005.0)
+        # Outside the window, a repeat is treated as a new packet.
+        _clock.now += 20
+        self.assertEqual(_cache.receive_time('!5224.52N/02103.90EO122/056'), 1025.0)
+        _stats = _cache.stats()
+        self.assertEqual((_stats['hits'], _stats['misses']), (2, 3))
+        # The /057 packet has expired.
+        self.assertEqual((_stats['entries'], _stats['evictions']), (1, 1))
+
+    def test_max_entries(self):
+        _cache = RxTimeCache(window=10, max_entries=10, clock=FakeClock())
+        for i in range(20):
+            _cache.receive_time(str(i))
+        self.assertEqual(len(_cache), 10)
+        self.assertEqual(_cache.stats()['evictions'], 10)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+import unittest
+
+from .filter_rules import FilterRules
+
+
+def _thing(to='APRS', fromcall='VK5QI-11', path=('WIDE1-1', 'qAR', 'VK5ZZ'), comment=None):
+    _thing = {'to': to, 'from': fromcall, 'path': list(path)}
+    if comment is not None:
+        _thing['comment'] = comment
+    return _thing
+
+
+class TestFilterRules(unittest.TestCase):
+    def test_default_rules(self):
+        _rules = FilterRules()
+        for _thing_args, _expected in [
+            ({}, None),
+            ({'comment': 'P6S7T29V2947C00 JO00WW'}, None),
+            ({'to': 'APHAX0'}, 'tocall_aphax'),
+            ({'to': 'APRARX'}, 'tocall_aprarx'),
+            ({'fromcall': 'WIDE2-1'}, 'fromcall_wide'),
+            ({'path': ['SONDEGATE', 'TCPIP', 'qAR', 'DF7OA-12']}, 'path_sondegate'),
+            ({'path': ['NOHUB', 'qAS', 'OK5TVR-15']}, 'path_nohub'),
+            # Path rules match whole elements only.
+            ({'path': ['NOHUB1', 'qAS', 'OK5TVR-15']}, None),
+            ({'comment': 'Balloon is climbing   Ubatt 2.8V   NSM is Not Sonde Monitor'}, 'comment_nsm'),
+            ({'comment': 'Weather Balloon'}, None),
+            ({'to': 'TA1ABC', 'fromcall': 'TA1ABC', 'comment': 'Weather Balloon'}, 'comment_weather_balloon'),
+        ]:
+            self.assertEqual(_rules.match(_thing(**_thing_args)), _expected, msg=_thing_args)
+
+        self.assertEqual(_rules.stats()['tocall_aphax'], 1)
+        self.assertNotIn('tocall_apdr', _rules.stats())
+        self.assertEqual(_rules.rules.path_bytes, frozenset((b'SONDEGATE', b'NOHUB')))
+
+    def test_comment_literals(self):
+        # Plain string comment rules are found without a regex, with the same result: the rule
+        # matching earliest in the comment, or the first rule listed if tied.
+        _rules = [
+            {'name': 'a', 'type': 'comment', 'value': 'Sonde'},
+            {'name': 'b', 'type': 'comment', 'value': 'Son'},
+            {'name': 'c', 'type': 'comment', 'value': 'Mon'},
+        ]
+        with tempfile.TemporaryDirectory() as _dir:
+            _filename = os.path.join(_dir, 'rules.json')
+            with open(_filename, 'w') as _f:
+                json.dump({'rules': _rules}, _f)
+            _literal = FilterRules(_filename, check_interval=0)
+            with open(_filename, 'w') as _f:
+                json.dump({'rules': _rules + [{'name': 'd', 'type': 'comment', 'pattern': 'x{3}'}]}, _f)
+            _regex = FilterRules(_filename, check_interval=0)
+        self.assertIsNotNone(_literal.rules.comment_literals)
+        self.assertIsNone(_regex.rules.comment_literals)
+
+        for _comment, _expected in [('Sonde Monitor', 'a'), ('Monitor Sonde', 'c'), ('Sons', 'b'), ('Balloon', None)]:
+            _packet = _thing(comment=_comment)
+            self.assertEqual(_literal.match(_packet), _expected, msg=_comment)
+            self.assertEqual(_regex.match(_packet), _expected, msg=_comment)
+            # The same result from a comment analysis.
+            self.assertEqual(_literal.match(_packet, _literal.analyze(_packet)), _expected, msg=_comment)
+
+    def test_reload(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _filename = os.path.join(_dir, 'rules.json')
+            with open(_filename, 'w') as _f:
+                json.dump({'rules': [{'name': 'a', 'type': 'tocall_prefix', 'value': 'APA'}]}, _f)
+            _rules = FilterRules(_filename, check_interval=0)
+            self.assertEqual(_rules.match(_thing(to='APABC')), 'a')
+
+            with open(_filename, 'w') as _f:
+                json.dump({'rules': [{'name': 'b', 'type': 'comment', 'pattern': r'T\d+'}]}, _f)
+            _rules.request_reload()
+            self.assertIsNone(_rules.match(_thing(to='APABC')))
+            self.assertEqual(_rules.match(_thing(comment='xT12')), 'b')
+
+            # An invalid file keeps the existing rules.
+            with open(_filename, 'w') as _f:
+                _f.write('{')
+            _rules.request_reload()
+            self.assertEqual(_rules.match(_thing(comment='xT12')), 'b')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from .gateway import Gateway
+from .metrics import REGISTRY
+from .sinks import MemorySink, JSONLinesSink
+
+BALLOON = b"F1DZP-11>APZ41N,WIDE1-1,qAO,F6ASP:!5056.48N/00151.60EO021/000/A=013000/P6S7T29V2947C00"
+IGATE = b"F6ASP>APDW16,TCPIP*,qAC,T2TEST:!5030.00N/00215.00E&Direwolf iGate"
+CHASE = b"VK5QI-9>APRS,SHUB,qAR,VK5ARG:!3456.78S/13812.34E>Chasing"
+
+
+class TestGateway(unittest.TestCase):
+    def test_memory_sinks(self):
+        _gateway = Gateway(payload_sink=MemorySink(), listener_sink=MemorySink(), software_version="test")
+        for _line in (IGATE, BALLOON, BALLOON, CHASE):
+            _gateway.parser(_line)
+
+        self.assertEqual(_gateway.payload_sink.published, 2)
+        _payload = _gateway.payload_sink.items[0]
+        self.assertEqual((_payload["payload_callsign"], _payload["uploader_callsign"], _payload["software_version"]), ("F1DZP-11", "F6ASP", "test"))
+        self.assertAlmostEqual(_payload["alt"], 3962.4)
+        # The iGate's position is uploaded once, then the chase car.
+        self.assertEqual([_body["uploader_callsign"] for _body in _gateway.listener_sink.items], ["F6ASP", "VK5QI-9"])
+        self.assertTrue(_gateway.listener_sink.items[1]["mobile"])
+
+    def test_separate_state(self):
+        _first = Gateway(payload_sink=MemorySink())
+        _second = Gateway(payload_sink=MemorySink())
+        _first.parser(IGATE)
+        self.assertIn("F6ASP", _first.positions)
+        self.assertNotIn("F6ASP", _second.positions)
+
+    def test_start_two_gateways(self):
+        # Several gateways can be started in one process, and the gauges report their total.
+        _positions = REGISTRY.stats().get("positions", 0)
+        _gateways = [Gateway(payload_sink=MemorySink()).start(stats_interval=60) for _i in range(2)]
+        for _gateway in _gateways:
+            _gateway.parser(IGATE)
+        self.assertEqual(REGISTRY.stats()["positions"], _positions + 2)
+
+        _loggers = [_logger for _gateway in _gateways for _logger in _gateway.stats_loggers]
+        self.assertTrue(all(_logger._thread.is_alive() for _logger in _loggers))
+        for _gateway in _gateways:
+            _gateway.stop()
+        self.assertFalse(any(_logger._thread.is_alive() for _logger in _loggers))
+        self.assertEqual(REGISTRY.stats().get("positions", 0), _positions)
+
+    def test_no_sinks(self):
+        # Without sinks (or an APRS-IS connection) nothing is uploaded, but the packet is still processed.
+        _gateway = Gateway()
+        _gateway.parser(BALLOON)
+        self.assertIn("F1DZP-11", _gateway.positions)
+
+    def test_path_rules(self):
+        # Balloons blocked by a path rule are only stored as positions, and counted as rule hits,
+        # with the path rules taken from the (reloadable) rules file.
+        _line = BALLOON.replace(b"WIDE1-1", b"NOHUB")
+        with tempfile.TemporaryDirectory() as _dir:
+            _filename = os.path.join(_dir, "rules.json")
+            with open(_filename, "w") as _f:
+                json.dump({"rules": [{"name": "path_nohub", "type": "path", "value": "NOHUB"}]}, _f)
+            _gateway = Gateway(payload_sink=MemorySink(), filter_rules_file=_filename)
+            _gateway.parser(_line)
+            self.assertEqual(_gateway.payload_sink.published, 0)
+            self.assertEqual(_gateway.filter_rules.stats(), {"path_nohub": 1})
+            self.assertIn("F1DZP-11", _gateway.positions)
+
+            with open(_filename, "w") as _f:
+                json.dump({"rules": []}, _f)
+            _gateway.filter_rules.reload()
+            _gateway.parser(_line)
+            self.assertEqual(_gateway.payload_sink.published, 1)
+
+    def test_json_lines_sink(self):
+        with tempfile.TemporaryDirectory() as _dir:
+            _filename = os.path.join(_dir, "uploads.jsonl")
+            _sink = JSONLinesSink("payload", _filename)
+            _gateway = Gateway(payload_sink=_sink)
+            _gateway.parser(BALLOON)
+            _gateway.stop()
+            with open(_filename) as _f:
+                _uploads = [json.loads(_line) for _line in _f]
+        self.assertEqual(len(_uploads), 1)
+        self.assertEqual(_uploads[0]["type"], "payload")
+        self.assertEqual(_uploads[0]["body"]["payload_callsign"], "F1DZP-11")
+
+    def test_import_without_boto3(self):
+        # boto3 is only imported for the SNS sink.
+        _result = subprocess.run(
+            [sys.executable, "-c", "import sys, sondehub_aprs_gw.__main__; print('boto3' in sys.modules)"],
+            capture_output=True, text=True, check=True
+        )
+        self.assertEqual(_result.stdout.strip(), "False")
+
+
+if __name__ == '__main__':
+    unittest.main()
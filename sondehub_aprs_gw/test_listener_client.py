@@ -0,0 +1,82 @@
+import json
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .listener_client import ListenerClient
+
+
+class _ListenerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_PUT(self):
+        time.sleep(self.server.delay)
+        _body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.received.append(json.loads(_body))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'OK')
+
+    def log_message(self, *args):
+        pass
+
+
+class TestListenerClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _ListenerHandler)
+        self.server.received = []
+        self.server.delay = 0
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/amateur/listeners"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keepalive(self):
+        _client = ListenerClient(self.url, pool_size=2)
+        for i in range(5):
+            _client.put({'uploader_callsign': f'TEST-{i}'})
+        self.assertEqual(len(self.server.received), 5)
+        self.assertEqual(_client.stats()['connections_opened'], 1)
+        self.assertEqual(_client.stats()['requests_sent'], 5)
+
+    def test_publish_queued(self):
+        # publish() returns without waiting for the request, and close() waits for the queued uploads.
+        self.server.delay = 0.2
+        _client = ListenerClient(self.url, pool_size=1, queue_size=2)
+        _start = time.monotonic()
+        for i in range(4):
+            _client.publish({'uploader_callsign': f'TEST-{i}'})
+        self.assertLess(time.monotonic() - _start, 0.1)
+        _client.close()
+        # At most one upload in progress and two queued - the rest are dropped.
+        _stats = _client.stats()
+        self.assertEqual(len(self.server.received), _stats['uploads_sent'])
+        self.assertGreaterEqual(_stats['uploads_dropped'], 1)
+        self.assertEqual(_stats['uploads_sent'] + _stats['uploads_dropped'], 4)
+
+    def test_coalesce(self):
+        _client = ListenerClient(self.url, coalesce=True, coalesce_window=0.05)
+        for i in range(3):
+            _client.put({'uploader_callsign': f'TEST-{i}'})
+        time.sleep(0.3)
+        self.assertEqual(self.server.received, [[{'uploader_callsign': f'TEST-{i}'} for i in range(3)]])
+        self.assertEqual(_client.stats()['uploads_sent'], 3)
+
+    def test_coalesce_close(self):
+        # close() sends the buffered uploads without waiting for the window, and stops the thread.
+        _client = ListenerClient(self.url, coalesce=True, coalesce_window=60)
+        for i in range(3):
+            _client.publish({'uploader_callsign': f'TEST-{i}'})
+        _start = time.monotonic()
+        _client.close()
+        self.assertLess(time.monotonic() - _start, 5)
+        self.assertEqual(self.server.received, [[{'uploader_callsign': f'TEST-{i}'} for i in range(3)]])
+        self.assertFalse(_client._thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import io
+import json
+import logging
+import sys
+import threading
+import unittest
+
+from .logs import CustomFormatter, JSONFormatter, LazyPformat, setup_logging
+
+
+class TestLogs(unittest.TestCase):
+    def _record(self, level=logging.INFO, msg="payload: %s", args=({'a': 1},)):
+        return logging.LogRecord("root", level, "test.py", 10, msg, args, None)
+
+    def test_json_format(self):
+        _entry = json.loads(JSONFormatter().format(self._record()))
+        self.assertEqual(_entry['level'], 'INFO')
+        self.assertEqual(_entry['message'], "payload: {'a': 1}")
+        self.assertEqual(_entry['location'], 'test.py:10')
+
+    def test_custom_format(self):
+        _formatter = CustomFormatter()
+        self.assertIn("WARNING - payload: {'a': 1} (test.py:10)", _formatter.format(self._record(logging.WARNING)))
+        # Levels without a colour are still formatted.
+        self.assertIn("Level 5 - payload", _formatter.format(self._record(5)))
+
+    def test_lazy_pformat(self):
+        class _Counter(dict):
+            calls = 0
+            def __repr__(self):
+                _Counter.calls += 1
+                return dict.__repr__(self)
+
+        _logger = logging.getLogger("sondehub_aprs_gw.test_lazy")
+        _logger.setLevel(logging.WARNING)
+        _logger.info("payload: %s", LazyPformat(_Counter(a=1)))
+        self.assertEqual(_Counter.calls, 0)
+        self.assertEqual(str(LazyPformat(_Counter(a=1))), "{'a': 1}")
+
+    def test_queued_records(self):
+        # Records are formatted on the listener thread, and JSON records keep their exception.
+        class _Thread(object):
+            def __str__(self):
+                return threading.current_thread().name
+
+        _root = logging.getLogger()
+        (_handlers, _level) = (list(_root.handlers), _root.level)
+        _stderr = sys.stderr
+        sys.stderr = io.StringIO()
+        try:
+            _listener = setup_logging(logging.INFO, json_format=True)
+            logging.info("formatted on %s", _Thread())
+            try:
+                raise ValueError("bad packet")
+            except ValueError:
+                logging.exception("Error")
+            _listener.stop()
+            _output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = _stderr
+            for _handler in list(_root.handlers):
+                _root.removeHandler(_handler)
+            for _handler in _handlers:
+                _root.addHandler(_handler)
+            _root.setLevel(_level)
+
+        _entries = [json.loads(_line) for _line in _output.splitlines()]
+        self.assertNotEqual(_entries[0]["message"], f"formatted on {threading.current_thread().name}")
+        self.assertEqual(_entries[1]["message"], "Error")
+        self.assertIn("ValueError: bad packet", _entries[1]["exception"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+import threading
+import time
+import unittest
+
+from .messages import MessageSender, format_message
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestMessageSender(unittest.TestCase):
+    def test_format(self):
+        self.assertEqual(format_message("VK5ARG-11"), "SHUB>APRS,TCPIP*::VK5ARG-11:Live on https://amateur.sondehub.org/VK5ARG-11")
+
+    def test_cooldown(self):
+        _sent = []
+        _clock = FakeClock()
+        _sender = MessageSender(_sent.append, cooldown=3600, clock=_clock.time)
+        self.assertTrue(_sender.notify("VK5ARG-11"))
+        _clock.now += 1800
+        self.assertFalse(_sender.notify("VK5ARG-11"))
+        _clock.now += 1801
+        self.assertTrue(_sender.notify("VK5ARG-11"))
+        self.assertEqual(len(_sent), 2)
+        self.assertEqual(_sender.stats()["suppressed"], 1)
+
+    def test_bounded(self):
+        _clock = FakeClock()
+        _sender = MessageSender(lambda _line: None, max_callsigns=10, clock=_clock.time)
+        for _i in range(25):
+            _sender.notify(f"N0CALL-{_i}")
+        self.assertEqual(_sender.stats()["callsigns"], 10)
+        self.assertEqual(_sender.stats()["evicted"], 15)
+        # Expired callsigns are forgotten.
+        _clock.now += 5*3600
+        _sender.notify("VK5ARG-11")
+        self.assertEqual(_sender.stats()["callsigns"], 1)
+
+    def test_failure_retries(self):
+        def _send(_line):
+            raise ConnectionError("Not connected")
+        _sender = MessageSender(_send)
+        self.assertTrue(_sender.notify("VK5ARG-11"))
+        self.assertTrue(_sender.notify("VK5ARG-11"))
+        self.assertEqual(_sender.stats()["failed"], 2)
+
+    def test_never_blocks(self):
+        # A stalled APRS-IS connection fills the queue, and further messages are dropped.
+        _release = threading.Event()
+        _sent = []
+
+        def _send(_line):
+            _release.wait()
+            _sent.append(_line)
+
+        _sender = MessageSender(_send, rate=1000, burst=1000, queue_size=5).start()
+        _start = time.monotonic()
+        _results = [_sender.notify(f"N0CALL-{_i}") for _i in range(50)]
+        self.assertLess(time.monotonic() - _start, 0.5)
+        _release.set()
+        _sender.stop()
+
+        self.assertEqual(len(_sent), _results.count(True))
+        self.assertGreaterEqual(_sender.stats()["dropped"], 44)
+        # Dropped callsigns can be messaged later.
+        self.assertTrue(_sender.notify("N0CALL-49"))
+
+    def test_rate_limit(self):
+        _times = []
+        _sender = MessageSender(lambda _line: _times.append(time.monotonic()), rate=20, burst=2).start()
+        for _i in range(6):
+            _sender.notify(f"N0CALL-{_i}")
+        _sender.stop()
+        self.assertEqual(len(_times), 6)
+        # 2 sent immediately, then 4 at 20/second.
+        self.assertGreater(_times[-1] - _times[0], 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from .metrics import Registry
+
+
+class TestMetrics(unittest.TestCase):
+    def test_render(self):
+        _registry = Registry(prefix="test_")
+        _counter = _registry.counter("lines_total", "Lines", ["class"])
+        _histogram = _registry.histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        _registry.gauge("depth", "Queue depth", lambda: 3)
+        _counter.inc("balloon")
+        _counter.inc("balloon")
+        _counter.inc('po"s')
+        _histogram.observe(0.05)
+        _histogram.observe(0.5)
+        _histogram.observe(5)
+
+        _lines = _registry.render().splitlines()
+        self.assertIn('# TYPE test_lines_total counter', _lines)
+        self.assertIn('test_lines_total{class="balloon"} 2', _lines)
+        self.assertIn('test_lines_total{class="po\\"s"} 1', _lines)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1', _lines)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 2', _lines)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 3', _lines)
+        self.assertIn('test_latency_seconds_count 3', _lines)
+        self.assertIn('test_depth 3', _lines)
+
+    def test_stats(self):
+        _registry = Registry(prefix="test_")
+        _registry.counter("unused_total", "Unused")
+        _registry.counter("messages_total", "Messages").inc()
+        _registry.histogram("stage_seconds", "Stages", ["stage"]).observe(0.5, "parse")
+        self.assertEqual(_registry.stats(), {
+            'messages_total': 1,
+            'stage_seconds': {'parse': {'count': 1, 'mean': 0.5}},
+        })
+
+
+if __name__ == '__main__':
+    unittest.main()
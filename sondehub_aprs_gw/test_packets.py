@@ -1,6 +1,7 @@
 import unittest
 
 from . import modified_packets, comment_telemetry
+from .comment_analysis import analyze_comment, MODIFIED_DS_RS_TAIL
 
 
 modified = [
@@ -75,12 +76,44 @@ class TestModified(unittest.TestCase):
     def test_not_modified_packet_processing(self):
         for payload in not_modified:
             self.assertFalse(modified_packets.is_modified_packet(payload[0]), msg=payload[0])
+    def test_shared_analysis(self):
+        # The same results from one analysis of each comment, shared by both stages.
+        for payload in data:
+            analysis = analyze_comment(payload[0]['comment'])
+            self.assertEqual(modified_packets.is_modified_packet(payload[0], analysis), payload in modified, msg=payload[0])
+            if payload in not_modified:
+                self.assertEqual(comment_telemetry.extract_comment_telemetry(payload[0], analysis), payload[1])
+    def test_ds_rs_tail(self):
+        self.assertEqual(analyze_comment("P3S15 DS -15.75 RS -106 ").modified, MODIFIED_DS_RS_TAIL)
+        self.assertEqual(analyze_comment("P3S15  DS -15.75 RS -106").modified, MODIFIED_DS_RS_TAIL)
+        # Only single spaces between the fields.
+        self.assertIsNone(analyze_comment("P3S15 DS -15.75  RS -106").modified)
+        self.assertIsNone(analyze_comment("P3S15\tDS -15.75 RS -106").modified)
 
 class TestComment(unittest.TestCase):
     def test_comment_telemetry(self):
         for payload in not_modified:
             telm = comment_telemetry.extract_comment_telemetry(payload[0])
             self.assertEqual(telm,payload[1])
+    def test_extractors(self):
+        # Each tracker's extractor can still be called directly, with or without an analysis.
+        _extractors = {
+            'APZ41N': comment_telemetry.extract_RS41ng_telemetry,
+            'APZQAP': comment_telemetry.extract_RS41HUP_telemetry,
+            'APRM20': comment_telemetry.extract_M20_telemetry,
+            'APRNFW': comment_telemetry.extract_NFW_telemetry,
+            'APLIGA': comment_telemetry.extract_lightaprs_telemetry,
+            'APELK0': comment_telemetry.extract_wb8elk_skytracker_telemetry,
+        }
+        _tested = set()
+        for payload in not_modified:
+            _extract = _extractors.get(payload[0]['aprs_tocall'])
+            if _extract is None or payload[0]['comment'] is None or payload[0]['comment'].startswith(',StrTrk'):
+                continue
+            self.assertEqual(_extract(payload[0]), payload[1], msg=payload[0])
+            self.assertEqual(_extract(payload[0], analyze_comment(payload[0]['comment'])), payload[1], msg=payload[0])
+            _tested.add(payload[0]['aprs_tocall'])
+        self.assertEqual(_tested, set(_extractors))
     def test_comment_none(self):
         telm = comment_telemetry.extract_comment_telemetry(
             {'software_name': 'aprs', 'aprs_tocall': 'TW1VU7-2', 'uploader_callsign': 'HB9BB', 'path': 'WIDE1-1,WIDE2-1,qAR,HB9BB', 'time_received': '2023-04-14T05:01:42.107491Z', 'payload_callsign': 'OE9IMJ-11', 'datetime': '2023-04-14T05:01:42.107172Z', 'lat': 47.27616666666667, 'lon': 9.648833333333334, 'alt': 515, 'comment': 'mou CT3001 S8 2.8C  955hPa 3.4V', 'raw': 'OE9IMJ-11>TW1VU7-2,WIDE1-1,WIDE2-1,qAR,HB9BB:`\x7fByl\x1fQO/"9S}mou CT3001 S8 2.8C  955hPa 3.4V', 'modulation': 'APRS'},
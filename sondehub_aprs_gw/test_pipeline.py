@@ -0,0 +1,138 @@
+import threading
+import time
+import unittest
+
+from .pipeline import IngestPipeline, PriorityPipeline, METRIC_DROPPED
+
+
+def _classify(line):
+    """ Lines are (priority, name) tuples in these tests. """
+    return line
+
+
+class TestPipeline(unittest.TestCase):
+    def test_processes_lines(self):
+        _seen = []
+        _pipeline = IngestPipeline(_seen.append, workers=2, queue_size=100)
+        _pipeline.start()
+        for i in range(50):
+            _pipeline.submit(i)
+        _pipeline.queue.join()
+        _pipeline.stop()
+        self.assertEqual(sorted(_seen), list(range(50)))
+        self.assertEqual(_pipeline.stats()['lines_processed'], 50)
+        self.assertEqual(_pipeline.stats()['lines_dropped'], 0)
+
+    def test_drop_policies(self):
+        # Workers are not started, so the queue fills up.
+        _dropped = METRIC_DROPPED.summary()
+        for _policy, _expected in [('drop_newest', [0, 1]), ('drop_oldest', [3, 4])]:
+            _pipeline = IngestPipeline(lambda x: None, workers=0, queue_size=2, drop_policy=_policy)
+            for i in range(5):
+                _pipeline.submit(i)
+            self.assertEqual(list(_pipeline.queue.queue), _expected)
+            self.assertEqual(_pipeline.stats()['lines_dropped'], 3)
+            self.assertEqual(_pipeline.stats()['queue_max_depth'], 2)
+        self.assertEqual(METRIC_DROPPED.summary() - _dropped, 6)
+
+    def test_block_timeout(self):
+        _pipeline = IngestPipeline(lambda x: None, workers=0, queue_size=1, drop_policy='block', block_timeout=0.01)
+        _pipeline.submit(0)
+        _pipeline.submit(1)
+        self.assertEqual(_pipeline.stats()['lines_dropped'], 1)
+
+    def test_handler_errors(self):
+        _event = threading.Event()
+        def _handler(line):
+            if line == 'bad':
+                raise ValueError(line)
+            _event.set()
+        _pipeline = IngestPipeline(_handler, workers=1)
+        _pipeline.start()
+        _pipeline.submit('bad')
+        _pipeline.submit('good')
+        self.assertTrue(_event.wait(1))
+        _pipeline.stop()
+        self.assertEqual(_pipeline.stats()['handler_errors'], 1)
+
+    def test_stop_while_full(self):
+        # Lines dropped to make room while stopping must not stop the workers from exiting.
+        _release = threading.Event()
+        _pipeline = IngestPipeline(lambda line: _release.wait(1), workers=2, queue_size=2, drop_policy='drop_oldest')
+        _pipeline.start()
+        _threads = list(_pipeline._threads)
+        for i in range(10):
+            _pipeline.submit(i)
+        _stopper = threading.Thread(target=_pipeline.stop)
+        _stopper.start()
+        for i in range(10, 100):
+            _pipeline.submit(i)
+        _release.set()
+        _stopper.join(5)
+        for _thread in _threads:
+            self.assertFalse(_thread.is_alive())
+        _stats = _pipeline.stats()
+        self.assertEqual(_stats['lines_received'], 100)
+        self.assertEqual(_stats['lines_processed'] + _stats['lines_dropped'], 100)
+
+
+
+class TestPriorityPipeline(unittest.TestCase):
+    def test_priority_order(self):
+        _seen = []
+        _pipeline = PriorityPipeline(lambda line, tag: _seen.append(tag), _classify, workers=1, queue_size=100)
+        for i in range(5):
+            _pipeline.submit((1, f"low{i}"))
+        _pipeline.submit((0, "high"))
+        # Lines with no priority are handled straight away.
+        _pipeline.submit((None, "inline"))
+        self.assertEqual(_seen, ["inline"])
+        _pipeline.start()
+        _pipeline.stop()
+        self.assertEqual(_seen, ["inline", "high", "low0", "low1", "low2", "low3", "low4"])
+
+    def test_shed_lowest_first(self):
+        # Workers are not started, so the queues fill up.
+        _pipeline = PriorityPipeline(lambda line, tag: None, _classify, workers=0, queue_size=4, sample_threshold=1.0)
+        for i in range(3):
+            _pipeline.submit((1, f"low{i}"))
+        for i in range(3):
+            _pipeline.submit((0, f"high{i}"))
+        _stats = _pipeline.stats()
+        self.assertEqual(_stats["queue_depths"], {"high": 3, "low": 1})
+        self.assertEqual(_stats["shed"]["low"]["full"], 2)
+
+        # Full of high priority lines - new low priority lines are dropped.
+        _pipeline.submit((0, "high3"))
+        _pipeline.submit((1, "low3"))
+        _stats = _pipeline.stats()
+        self.assertEqual(_stats["queue_depths"], {"high": 4, "low": 0})
+        self.assertEqual(_stats["shed"]["low"]["full"], 4)
+        self.assertEqual(_stats["shed"]["high"]["full"], 0)
+        self.assertEqual(_stats["lines_dropped"], 4)
+
+    def test_sampling(self):
+        _pipeline = PriorityPipeline(lambda line, tag: None, _classify, workers=0, queue_size=1000, sample_threshold=0.5)
+        for i in range(1000):
+            _pipeline.submit((1, i))
+        _stats = _pipeline.stats()
+        # Everything is kept up to half full, then progressively fewer.
+        self.assertGreater(_stats["queue_depth"], 500)
+        self.assertLess(_stats["queue_depth"], 1000)
+        self.assertEqual(_stats["shed"]["low"]["sampled"], 1000 - _stats["queue_depth"])
+
+    def test_latency_budget(self):
+        _pipeline = PriorityPipeline(lambda line, tag: None, _classify, workers=0, queue_size=100, latency_budget=0.05)
+        _pipeline.submit((0, "high"))
+        _pipeline.submit((1, "low0"))
+        time.sleep(0.1)
+        self.assertTrue(_pipeline.stats()["over_budget"])
+        _pipeline.submit((1, "low1"))
+        _pipeline.submit((0, "high1"))
+        _stats = _pipeline.stats()
+        self.assertEqual(_stats["shed"]["low"]["budget"], 1)
+        self.assertEqual(_stats["queue_depths"], {"high": 2, "low": 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+import unittest
+
+import aprslib
+
+from . import benchmark, position_decoder, prefilter
+from .gateway import Gateway
+from .sinks import MemorySink
+from .test_packets import data
+
+# Lines covering each part of the decoder, and lines it should leave to aprslib.
+EDGE_CASES = [
+    # Uncompressed, with and without course/speed, DF report, altitude, telemetry and DAO
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ:!3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ:=3455.12S/13840.34WO090/010/270/729/A=-00123 DF",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12N/13840.34EO/A=123456/A=654321 twice",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12N/13840.34EO/A=12345 not an altitude /A=001000",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12N/13840.34EOTemp |!!!!|/A=001000 |!\"#$%&'()*+,| odd telemetry",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12S/13840.34WO!W12! DAO !wA%! two DAOs",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12N/13840.34EO!W1a! not digits",
+    # Timestamps: HMS, DHM, local DHM, unknown form, and invalid
+    b"VK5QI-11>APRS,qAR,VK5ZZ:/123456h3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:@011200z3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:/011200/3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:/011200x3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:@246199h3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:@3455.12S/13840.34EO no timestamp",
+    # Compressed, with altitude, course/speed, range and no csT
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!/5L!!<*e7OS]S comment",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:=/5L!!<*e7O7P[",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!/5L!!<*e7O{?!",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!/5L!!<*e7O   /A=001000",
+    # Mic-E, with altitude, telemetry and DAO
+    b"VK5QI-9>S32UVT,qAR,VK5ZZ:`(_fn\"Oj/]comment",
+    b"VK5QI-9>S32UVT-2,qAR,VK5ZZ:'(_fn\"OO/'1a2b3c4d5e\"4T}balloon!wB#!",
+    b"VK5QI-9>T2SP0W,qAR,VK5ZZ:`(_fn\"OO/",
+    b"VK5QI-9>T2SP0W,qAR,VK5ZZ:`(_fn\"OO/ ",
+    # Left to aprslib
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!34  .  S/138  .  EO position ambiguity",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12S/13840.34EOPHG2360 PHG",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12S/13840.34E_090/010g015t068 weather",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:;OBJECT   *111111z3455.12S/13840.34EO object",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:Leading text !3455.12S/13840.34EO",
+    b"VK5QI-9>S32ULT,qAR,VK5ZZ:`(_fn\"Oj/]Mic-E ambiguity",
+    b"vk5qi-11>APRS-05,qAR,VK5ZZ:!3455.12S/13840.34EO lower case and SSID",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12S/13840.34EO caf\xe9 latin-1",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:@123456h",
+    # Not parsed by aprslib at all
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!9955.12S/13840.34EO",
+    b"VK5QI-11>APRS,,VK5ZZ:!3455.12S/13840.34EO",
+    b"VK5QI-11>APRS,qAR,VK5ZZ:!",
+    b"VK5QI-9>S32UVT,qAR,VK5ZZ:`(_",
+]
+
+
+def _aprslib_fields(line):
+    try:
+        return position_decoder.fields(aprslib.parse(line))
+    except (aprslib.exceptions.ParseError, aprslib.exceptions.UnknownFormat):
+        return None
+
+
+class TestPositionDecoder(unittest.TestCase):
+    def check(self, lines):
+        """ Check every line the fast decoder decodes gives the same fields as aprslib. Returns the number decoded. """
+        _decoded = 0
+        for _line in lines:
+            _thing = position_decoder.decode(_line)
+            if _thing is not None:
+                _decoded += 1
+                self.assertEqual(_thing, _aprslib_fields(_line), msg=_line)
+        return _decoded
+
+    def test_recorded_packets(self):
+        _lines = [_payload[0]['raw'].encode() for _payload in data]
+        self.assertEqual(self.check(_lines), len(_lines))
+
+    def test_synthetic_corpus(self):
+        _corpus = benchmark.generate_corpus(5000, seed=4)
+        self.check(_corpus)
+        # All the balloon and chase-car lines are decoded without aprslib.
+        for _line in _corpus:
+            if prefilter.classify(_line) in (prefilter.BALLOON, prefilter.CHASE):
+                self.assertIsNotNone(position_decoder.decode(_line), msg=_line)
+
+    def test_edge_cases(self):
+        self.check(EDGE_CASES)
+        for _line in EDGE_CASES[:EDGE_CASES.index(b"VK5QI-11>APRS,qAR,VK5ZZ:!34  .  S/138  .  EO position ambiguity")]:
+            self.assertIsNotNone(position_decoder.decode(_line), msg=_line)
+
+    def test_fallback(self):
+        # Lines the fast decoder can't handle are parsed by aprslib, including its exceptions.
+        _line = b"VK5QI-11>APRS,qAR,VK5ZZ:!3455.12S/13840.34EOPHG2360 PHG"
+        self.assertIsNone(position_decoder.decode(_line))
+        self.assertEqual(position_decoder.parse(_line)["phg"], "2360")
+        with self.assertRaises(aprslib.exceptions.ParseError):
+            position_decoder.parse(b"VK5QI-11>APRS,qAR,VK5ZZ:!9955.12S/13840.34EO")
+
+    def test_gateway_uploads(self):
+        # The gateway's uploads are the same with either decoder.
+        _uploads = []
+        for _fast in (True, False):
+            _gateway = Gateway(payload_sink=MemorySink(), listener_sink=MemorySink(), fast_decoder=_fast, clock=lambda: 1700000000.0)
+            for _line in benchmark.generate_corpus(3000, seed=6):
+                _gateway.parser(_line)
+            _uploads.append((list(_gateway.payload_sink.items), list(_gateway.listener_sink.items)))
+        self.assertGreater(len(_uploads[0][0]), 0)
+        self.assertEqual(_uploads[0], _uploads[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import unittest
+
+from .positions import PositionStore
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPositionStore(unittest.TestCase):
+    def test_lookup(self):
+        _store = PositionStore()
+        _store.update('VK5QI', -34.9, 138.6, 100, 'igate')
+        self.assertIn('VK5QI', _store)
+        self.assertNotIn('VK5ZZ', _store)
+        _position = _store.get('VK5QI')
+        self.assertEqual((_position.latitude, _position.longitude, _position.altitude, _position.comment), (-34.9, 138.6, 100, 'igate'))
+
+    def test_lazy_decode(self):
+        _decoded = []
+        def _decoder(raw):
+            _decoded.append(raw)
+            if raw == b'bad':
+                raise ValueError()
+            return (1.0, 2.0, 3.0, None)
+
+        _store = PositionStore(_decoder)
+        _store.update_raw('VK5QI', b'good')
+        _store.update_raw('VK5ZZ', b'bad')
+        self.assertEqual(_decoded, [])
+        self.assertEqual(_store.get('VK5QI').latitude, 1.0)
+        self.assertEqual(_store.get('VK5QI').altitude, 3.0)
+        self.assertIsNone(_store.get('VK5ZZ'))
+        # Only decoded once.
+        self.assertEqual(_decoded, [b'good', b'bad'])
+        self.assertEqual(_store.stats()['decode_failures'], 1)
+        self.assertEqual(len(_store), 1)
+
+    def test_eviction(self):
+        _clock = FakeClock()
+        _store = PositionStore(ttl=100, max_entries=3, expire_interval=10, clock=_clock)
+        for i in range(5):
+            _store.update(f'VK5QI-{i}', 0, 0)
+        self.assertEqual(len(_store), 3)
+        self.assertEqual(_store.stats()['evicted_size'], 2)
+
+        _clock.now += 101
+        self.assertIsNone(_store.get('VK5QI-4'))
+        _store.update('VK5ZZ', 0, 0)
+        self.assertEqual(len(_store), 1)
+        self.assertEqual(_store.stats()['evicted_ttl'], 3)
+
+    def test_undecoded_count(self):
+        _clock = FakeClock()
+        _store = PositionStore(lambda raw: (1.0, 2.0, 3.0, None), ttl=100, max_entries=3, expire_interval=10, clock=_clock)
+        for i in range(4):
+            _store.update_raw(f'VK5QI-{i}', b'raw')
+        self.assertEqual(_store.stats()['undecoded'], 3)
+        _store.update('VK5QI-1', 0, 0)
+        _store.get('VK5QI-2')
+        self.assertEqual(_store.stats()['undecoded'], 1)
+        _store.update_raw('VK5QI-1', b'raw')
+        self.assertEqual(_store.stats()['undecoded'], 2)
+
+        _clock.now += 101
+        _store.update('VK5ZZ', 0, 0)
+        self.assertEqual(_store.stats()['undecoded'], 0)
+        _store.restore([('VK5QI', None, None, 0, None, b'raw', _clock.now, None)])
+        self.assertEqual(_store.stats()['undecoded'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
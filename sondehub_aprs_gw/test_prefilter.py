@@ -0,0 +1,65 @@
+import unittest
+
+from . import prefilter
+from .test_packets import data
+
+BLOCKED_PATH = frozenset((b'SONDEGATE', b'NOHUB'))
+
+
+class TestPrefilter(unittest.TestCase):
+    def test_balloon_packets(self):
+        for payload in data:
+            _raw = payload[0]['raw'].encode()
+            if b'NOHUB' in _raw:
+                self.assertEqual(prefilter.classify(_raw, BLOCKED_PATH), prefilter.BLOCKED, msg=_raw)
+            else:
+                self.assertEqual(prefilter.classify(_raw, BLOCKED_PATH), prefilter.BALLOON, msg=_raw)
+            # Without path rules, nothing is blocked.
+            self.assertEqual(prefilter.classify(_raw), prefilter.BALLOON, msg=_raw)
+
+    def test_blocked_packets(self):
+        _raw = b"T1310753>APRARX,SONDEGATE,TCPIP,qAR,DF7OA-12:/233445h5242.24N/00959.93EO152/042/A=043155"
+        self.assertEqual(prefilter.classify(_raw, BLOCKED_PATH), prefilter.BLOCKED)
+        self.assertEqual(prefilter.classify(_raw, frozenset((b'NOHUB',))), prefilter.BALLOON)
+        # Only balloons are blocked.
+        self.assertEqual(prefilter.classify(_raw.replace(b'EO152', b'E>152'), BLOCKED_PATH), prefilter.POSITION)
+
+    def test_chase_packets(self):
+        for _raw in [
+            b"VK5QI-9>APRS,SHUB,qAR,VK5ZZ:!3455.00S/13840.00E>chase car",
+            b"VK5QI-9>APRS,SHUB1-1,qAR,VK5ZZ:!3455.00S/13840.00E>chase car",
+        ]:
+            self.assertEqual(prefilter.classify(_raw), prefilter.CHASE, msg=_raw)
+
+    def test_position_packets(self):
+        for _raw in [
+            # Uncompressed, non-balloon symbol
+            b"VK5ZZ>APRS,TCPIP*,qAC,T2AUSTRALIA:=3455.00S/13840.00E-PHG2360 home",
+            # Mic-E, non-balloon symbol
+            b"VK5QI-9>S32UVT,qAR,VK5ZZ:`(_fn\"Oj/]comment",
+            # Balloon symbol, but an object
+            b"VK5QI-9>APRS,qAR,VK5ZZ:;OBJ      *111111z3455.00S/13840.00EO",
+        ]:
+            self.assertEqual(prefilter.classify(_raw, BLOCKED_PATH), prefilter.POSITION, msg=_raw)
+
+    def test_telemetry_packets(self):
+        for _raw in [
+            b"VK5QI-11>APRS,qAR,VK5ZZ:T#001,1,2,3,4,5,00000000",
+            b"VK5QI-11>APRS,qAR,VK5ZZ::VK5QI-11 :PARM.Batt,Temp",
+            b"VK5QI-11>APRS,qAR,VK5ZZ::VK5QI-11 :EQNS.0,0.01,0,0,1,-273{12",
+        ]:
+            self.assertEqual(prefilter.classify(_raw), prefilter.TELEMETRY, msg=_raw)
+
+    def test_dropped_packets(self):
+        for _raw in [
+            b"VK5QI-9>APRS,qAR,VK5ZZ:>status text",
+            b"VK5QI-9>APRS,qAR,VK5ZZ::VK5QI    :hello{1",
+            b"VK5QI-9>APRS,qAR,VK5ZZ:_10090556c220s004g005t077r000p000P000h50b09900wRSW",
+            b"VK5QI-9>APRS,qAR,VK5ZZ:",
+            b"garbage",
+        ]:
+            self.assertEqual(prefilter.classify(_raw), prefilter.DROP, msg=_raw)
+
+
+if __name__ == '__main__':
+    unittest.main()
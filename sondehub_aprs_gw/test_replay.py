@@ -0,0 +1,54 @@
+import unittest
+
+from . import benchmark
+from .replay import replay
+
+
+class TestReplay(unittest.TestCase):
+    def _replay(self, corpus, speed=None):
+        _uploads = []
+        _gateway = benchmark.load_gateway(lambda _type, _body: _uploads.append((_type, _body)))
+        # Start from a clean gateway state, so each replay is independent.
+        _gateway.positions.clear()
+        _gateway.rx_times.clear()
+        _gateway.message_sender.clear()
+        _results = replay(corpus, _gateway, speed=speed)
+        return _results, _uploads
+
+    def test_deterministic(self):
+        _corpus = [(1700000000.0 + _i * 0.01, _line) for _i, _line in enumerate(benchmark.generate_corpus(2000, seed=5))]
+        (_results, _uploads) = self._replay(_corpus)
+        (_results_fast, _uploads_fast) = self._replay(_corpus, speed=1000)
+        self.assertEqual(_results["lines"], 2000)
+        self.assertAlmostEqual(_results["capture_seconds"], 19.99)
+        self.assertGreater(_results["payloads_published"], 0)
+        self.assertEqual(_uploads, _uploads_fast)
+
+        # Payloads without a timestamp get the capture time.
+        _payload = [_body for _type, _body in _uploads if _type == "payload" and _body["aprs_tocall"] == "APZ41N"][0]
+        self.assertTrue(_payload["datetime"].startswith("2023-11-14T22:13:"))
+        self.assertEqual(_payload["datetime"], _payload["time_received"])
+
+    def test_message_interval(self):
+        _line = b"F1DZP-11>APZ41N,WIDE1-1,qAO,F6ASP:!5056.48N/00151.60EO021/000/A=003000/P6S7T29V2947C00"
+        _corpus = [(1700000000.0 + _i * 600, _line) for _i in range(30)]
+        (_results, _uploads) = self._replay(_corpus)
+        # 5 hours of packets, with messages at most every 4 hours.
+        self.assertEqual(_results["payloads_published"], 30)
+        self.assertEqual(len([_type for _type, _body in _uploads if _type == "message"]), 2)
+
+    def test_telemetry_clock(self):
+        # The frame is too old to attach in capture time, however fast the capture is replayed.
+        _frame = b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ:T#001,150,128,255,000,012,11100000"
+        _balloon = b"VK5QI-11>APRS,WIDE2-1,qAR,VK5ZZ:!3455.12S/13840.34EO/A=030000 Test balloon"
+        _corpus = [(1700000000.0, _frame), (1700000700.0, _balloon)]
+        (_results, _uploads) = self._replay(_corpus)
+        (_results_fast, _uploads_fast) = self._replay(_corpus, speed=10000)
+        self.assertEqual(_results["payloads_published"], 1)
+        self.assertEqual(_uploads, _uploads_fast)
+        _payload = [_body for _type, _body in _uploads if _type == "payload"][0]
+        self.assertNotIn("a1", _payload)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+import time
+import unittest
+
+from . import benchmark
+from .sharding import ShardedParser, shard_of
+
+
+class TestSharding(unittest.TestCase):
+    def test_shard_of(self):
+        # All copies of a packet go to the same shard, whatever the path.
+        self.assertEqual(
+            shard_of(b"VK5ARG-11>APRS,WIDE1-1,qAR,VK5XYZ:!3456.78S/13812.34EO", 4),
+            shard_of(b"VK5ARG-11>APRS,qAO,VK5ABC:!3456.78S/13812.34EO", 4)
+        )
+        _shards = {shard_of(b"N0CALL-%d>APRS:>test" % _i, 4) for _i in range(100)}
+        self.assertEqual(_shards, {0, 1, 2, 3})
+
+    def test_matches_single_process(self):
+        _corpus = benchmark.generate_corpus(3000, seed=7)
+        _gateway = benchmark.load_gateway()
+        _single = benchmark.run(_corpus, _gateway)
+        _gateway.positions.clear()
+        _gateway.rx_times.clear()
+        _gateway.message_sender.clear()
+        _sharded = benchmark.run(_corpus, _gateway, shards=2)
+        for _key in ("payloads_published", "messages_sent"):
+            self.assertEqual(_sharded[_key], _single[_key])
+        self.assertGreater(_sharded["listener_uploads"], 0)
+
+    def test_worker_restart(self):
+        _gateway = benchmark.load_gateway()
+        _shards = ShardedParser("sondehub_aprs_gw.config:setup_shard_worker", _gateway.handle_shard_output, shards=1).start()
+        self.addCleanup(_shards.stop)
+        _line = b"F1DZP-11>APZ41N,WIDE1-1,qAO,F6ASP:!5056.48N/00151.60EO021/000/A=003000/P6S7T29V2947C00"
+
+        _shards.shards[0].process.kill()
+        _deadline = time.monotonic() + 30
+        while _shards.shards[0].restarts == 0 and time.monotonic() < _deadline:
+            time.sleep(0.05)
+        self.assertEqual(_shards.shards[0].restarts, 1)
+        self.assertTrue(_shards.shards[0].ready.wait(30))
+
+        _published = _gateway.payload_sink.published
+        _shards.submit(_line)
+        self.assertTrue(_shards.drain(30))
+        self.assertEqual(_gateway.payload_sink.published, _published + 1)
+        self.assertEqual(_shards.stats()["shard_0"]["processed"], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
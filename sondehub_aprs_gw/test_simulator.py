@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+import aprslib
+
+from .simulator import APRSISServer, load_test
+
+
+LINES = [
+    b"N0CALL-1>APRS,TCPIP*,qAC,T2TEST:!5000.00N/01400.00E-Test",
+    b"N0CALL-2>APRS,TCPIP*,qAC,T2TEST:>Status",
+]
+
+
+class TestSimulator(unittest.TestCase):
+    def test_session(self):
+        _server = APRSISServer(LINES, rate=200).start()
+        try:
+            _received = []
+            _stop = threading.Event()
+
+            def _callback(line):
+                if _stop.is_set():
+                    raise StopIteration
+                _received.append(line)
+
+            _ais = aprslib.IS("N0CALL", aprslib.passcode("N0CALL"), host=_server.address[0], port=_server.address[1])
+            _ais.set_filter("t/p")
+            _ais.connect()
+            _consumer = threading.Thread(target=_ais.consumer, kwargs={"callback": _callback, "raw": True}, daemon=True)
+            _consumer.start()
+
+            _ais.set_filter("s/O")
+            _ais.sendall("SHUB>APRS,TCPIP*::N0CALL-11:Hello")
+            time.sleep(0.5)
+            _stop.set()
+            _consumer.join(timeout=5)
+            _ais.close()
+
+            self.assertGreater(len(_received), 10)
+            self.assertEqual(_received[:2], LINES)
+            self.assertEqual(_server.received, [("N0CALL", b"SHUB>APRS,TCPIP*::N0CALL-11:Hello")])
+            time.sleep(0.1)
+            self.assertEqual(_server.stats()["clients"], 0)
+        finally:
+            _server.stop()
+
+    def test_load_test(self):
+        _results = load_test(LINES, start_rate=200, step=200, max_rate=400, step_time=0.5)
+        self.assertEqual(_results["sustainable_rate"], 400)
+        self.assertEqual([_step["target_rate"] for _step in _results["steps"]], [200, 400])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import json
+import threading
+import time
+import unittest
+
+from .sns_batch import BatchPublisher
+
+
+class FakeSNSClient(object):
+    """ Stand-in for a boto3 SNS client, recording PublishBatch calls. """
+
+    def __init__(self, fail_ids=(), sender_fault_ids=()):
+        self.calls = []
+        self.fail_ids = set(fail_ids)
+        self.sender_fault_ids = set(sender_fault_ids)
+        self._lock = threading.Lock()
+
+    def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+        with self._lock:
+            self.calls.append([json.loads(_entry['Message']) for _entry in PublishBatchRequestEntries])
+        _successful = []
+        _failed = []
+        for _entry in PublishBatchRequestEntries:
+            if _entry['Id'] in self.sender_fault_ids:
+                _failed.append({'Id': _entry['Id'], 'Code': 'InvalidParameter', 'SenderFault': True})
+            elif _entry['Id'] in self.fail_ids:
+                # Fail once, then succeed on retry.
+                self.fail_ids.discard(_entry['Id'])
+                _failed.append({'Id': _entry['Id'], 'Code': 'InternalError', 'SenderFault': False})
+            else:
+                _successful.append({'Id': _entry['Id'], 'MessageId': 'x'})
+        return {'Successful': _successful, 'Failed': _failed}
+
+
+class TestBatchPublisher(unittest.TestCase):
+    def test_size_flush(self):
+        _client = FakeSNSClient()
+        _publisher = BatchPublisher(_client, 'arn', max_linger=60)
+        for i in range(25):
+            _publisher.publish({'n': i})
+        _publisher.close()
+        self.assertEqual([len(_call) for _call in _client.calls], [10, 10, 5])
+        self.assertEqual(_publisher.stats()['payloads_published'], 25)
+
+    def test_linger_flush(self):
+        _client = FakeSNSClient()
+        _publisher = BatchPublisher(_client, 'arn', max_linger=0.05)
+        _publisher.publish({'n': 1})
+        _publisher.publish({'n': 2})
+        time.sleep(0.3)
+        self.assertEqual(_client.calls, [[{'n': 1}, {'n': 2}]])
+        _publisher.close()
+
+    def test_partial_failure_retry(self):
+        _client = FakeSNSClient(fail_ids=['1'], sender_fault_ids=['2'])
+        _publisher = BatchPublisher(_client, 'arn', max_linger=60, retry_delay=0.01)
+        for i in range(4):
+            _publisher.publish({'n': i})
+        _publisher.close()
+        # Only the entry with a transient failure is retried.
+        self.assertEqual(len(_client.calls), 2)
+        self.assertEqual(_client.calls[1], [{'n': 1}])
+        _stats = _publisher.stats()
+        self.assertEqual(_stats['payloads_published'], 3)
+        self.assertEqual(_stats['payloads_failed'], 1)
+        self.assertEqual(_stats['entries_retried'], 1)
+
+
+    def test_publish_never_blocks(self):
+        # With every PublishBatch call hung, publish() still returns, and drops payloads once the buffer is full.
+        _release = threading.Event()
+
+        class _HungClient(FakeSNSClient):
+            def publish_batch(self, TopicArn, PublishBatchRequestEntries):
+                _release.wait(5)
+                return FakeSNSClient.publish_batch(self, TopicArn, PublishBatchRequestEntries)
+
+        _client = _HungClient()
+        _publisher = BatchPublisher(_client, 'arn', batch_size=2, max_in_flight=1, max_buffered=10)
+        _start = time.monotonic()
+        for i in range(50):
+            _publisher.publish({'n': i})
+        self.assertLess(time.monotonic() - _start, 1.0)
+        _stats = _publisher.stats()
+        self.assertGreater(_stats['payloads_dropped'], 0)
+
+        _release.set()
+        _publisher.close()
+        _stats = _publisher.stats()
+        self.assertEqual(_stats['payloads_published'] + _stats['payloads_dropped'], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
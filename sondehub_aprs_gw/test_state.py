@@ -0,0 +1,98 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from .aprs_filter import AdaptiveFilter
+from .dedupe import RxTimeCache
+from .messages import MessageSender
+from .positions import PositionStore
+from .state import StateStore
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1700000000.0
+
+    def time(self):
+        return self.now
+
+
+class TestStateStore(unittest.TestCase):
+    def setUp(self):
+        _dir = tempfile.TemporaryDirectory()
+        self.addCleanup(_dir.cleanup)
+        self.path = os.path.join(_dir.name, "state.db")
+        self.clock = FakeClock()
+
+    def _components(self):
+        return {
+            "positions": PositionStore(ttl=3600, clock=self.clock.time),
+            "rx_times": RxTimeCache(window=300, clock=self.clock.time),
+            "message_cooldowns": MessageSender(lambda _line: None, cooldown=4*3600, clock=self.clock.time),
+            "aprs_filter_igates": AdaptiveFilter(ttl=86400, clock=self.clock.time),
+        }
+
+    def test_round_trip(self):
+        _components = self._components()
+        _components["positions"].update("VK5XYZ", -34.9, 138.6, 100, "iGate")
+        _components["positions"].mark_uploaded("VK5XYZ")
+        self.clock.now += 10
+        _components["positions"].update_raw("VK5ABC", b"VK5ABC>APRS:!3456.78S/13812.34E-")
+        _time = _components["rx_times"].receive_time("!3456.78S/13812.34EO/A=012345")
+        _components["message_cooldowns"].notify("VK5ARG-11")
+        _components["aprs_filter_igates"].add("VK5XYZ")
+        self.assertEqual(StateStore(self.path, _components, clock=self.clock.time).save(), 5)
+
+        # Restart a minute later.
+        self.clock.now += 60
+        _restored = self._components()
+        _loaded = StateStore(self.path, _restored, clock=self.clock.time).load()
+        self.assertEqual(_loaded, {"positions": 2, "rx_times": 1, "message_cooldowns": 1, "aprs_filter_igates": 1})
+
+        _position = _restored["positions"].get("VK5XYZ")
+        self.assertEqual((_position.latitude, _position.longitude, _position.comment), (-34.9, 138.6, "iGate"))
+        self.assertIsNotNone(_position.last_upload)
+        self.assertEqual(_restored["positions"].snapshot()[1][5], b"VK5ABC>APRS:!3456.78S/13812.34E-")
+        self.assertEqual(_restored["rx_times"].receive_time("!3456.78S/13812.34EO/A=012345"), _time)
+        self.assertFalse(_restored["message_cooldowns"].notify("VK5ARG-11"))
+        self.assertEqual(_restored["aprs_filter_igates"].igates(), ["VK5XYZ"])
+
+    def test_expired_skipped(self):
+        _components = self._components()
+        _components["positions"].update("VK5XYZ", -34.9, 138.6)
+        _components["rx_times"].receive_time("!3456.78S/13812.34EO/A=012345")
+        _components["message_cooldowns"].notify("VK5ARG-11")
+        StateStore(self.path, _components, clock=self.clock.time).save()
+
+        # Down for two hours - positions and receive times have expired, message cooldowns have not.
+        self.clock.now += 7200
+        _loaded = StateStore(self.path, self._components(), clock=self.clock.time).load()
+        self.assertEqual(_loaded, {"positions": 0, "rx_times": 0, "message_cooldowns": 1, "aprs_filter_igates": 0})
+
+    def test_replaces_previous(self):
+        _components = self._components()
+        _store = StateStore(self.path, _components, clock=self.clock.time)
+        for _i in range(3):
+            _components["positions"].update(f"N0CALL-{_i}", 1.0, 2.0)
+            _store.save()
+        _db = sqlite3.connect(self.path)
+        self.assertEqual(_db.execute("SELECT COUNT(*) FROM positions").fetchone()[0], 3)
+        self.assertEqual(_db.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+        _db.close()
+
+    def test_schema_change(self):
+        _db = sqlite3.connect(self.path)
+        _db.execute("CREATE TABLE positions (callsign, latitude)")
+        _db.execute("INSERT INTO positions VALUES ('VK5XYZ', 1.0)")
+        _db.commit()
+        _db.close()
+        self.assertEqual(StateStore(self.path, self._components(), clock=self.clock.time).load()["positions"], 0)
+
+    def test_empty(self):
+        _loaded = StateStore(self.path, self._components(), clock=self.clock.time).load()
+        self.assertEqual(sum(_loaded.values()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import threading
+import time
+import unittest
+
+from .simulator import APRSISServer
+from .upstream import FanIn, parse_servers
+
+
+class TestUpstream(unittest.TestCase):
+    def test_parse_servers(self):
+        self.assertEqual(
+            parse_servers("euro.aprs2.net, noam.aprs2.net:10152,", 14580),
+            [("euro.aprs2.net", 14580), ("noam.aprs2.net", 10152)]
+        )
+
+    def test_fan_in(self):
+        _lines = [f"N0CALL-{_i % 16}>APRS,TCPIP*,qAC,T2TEST:>Status {_i}".encode('ascii') for _i in range(5000)]
+        _servers = [APRSISServer(_lines, rate=1000).start(), APRSISServer(_lines, rate=1000).start()]
+        _received = []
+        _lock = threading.Lock()
+
+        def _callback(line):
+            with _lock:
+                _received.append(line)
+
+        _fan_in = FanIn([_server.address for _server in _servers], "N0CALL", _callback, filter="t/p")
+        try:
+            _fan_in.start()
+            time.sleep(1.0)
+
+            _fan_in.sendall("SHUB>APRS,TCPIP*::N0CALL-11:Hello")
+            time.sleep(0.1)
+            self.assertEqual(_servers[0].received, [("N0CALL", b"SHUB>APRS,TCPIP*::N0CALL-11:Hello")])
+
+            # The first server goes away, and the stream continues from the second.
+            _servers[0].stop()
+            time.sleep(0.5)
+            _stats = _fan_in.stats()["upstreams"]
+        finally:
+            _fan_in.stop()
+            for _server in _servers:
+                _server.stop()
+        _fan_in.join(5)
+
+        _names = [f"{_host}:{_port}" for _host, _port in [_server.address for _server in _servers]]
+        self.assertFalse(_stats[_names[0]]["connected"])
+        self.assertTrue(_stats[_names[1]]["connected"])
+        self.assertGreater(_fan_in.duplicates, 100)
+        # Each line is passed on once, in order.
+        self.assertEqual(_received, _lines[:len(_received)])
+        _lines_received = [_upstream["lines"] for _upstream in _fan_in.stats()["upstreams"].values()]
+        self.assertEqual(len(_received), max(_lines_received))
+
+
+if __name__ == '__main__':
+    unittest.main()
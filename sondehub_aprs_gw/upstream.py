@@ -0,0 +1,294 @@
+#
+#   SondeHub APRS Gateway - APRS-IS Upstream Connections
+#
+#   Holds connections to one or more APRS-IS servers at once, and merges their
+#   streams. Each line is passed on only when it first arrives from any server,
+#   so latency is the minimum across the servers, and a server restart does not
+#   cause a gap. Lost connections are retried with exponential backoff.
+#
+#   All the connections run on one asyncio event loop, in its own thread.
+#
+#   Lines are deduplicated on the complete raw line, which includes the packet
+#   contents and the path (and so the iGate). Copies of a packet via different
+#   iGates are kept, as they are needed for listener uploads.
+#
+import asyncio
+import logging
+import random
+import threading
+import time
+from collections import OrderedDict
+
+import aprslib
+
+from .aprsis import APRSISClient
+from .dedupe import packet_digest
+from .metrics import REGISTRY
+
+METRIC_LINES = REGISTRY.counter("upstream_lines_total", "Lines received from each APRS-IS server", ["upstream"])
+METRIC_FIRST = REGISTRY.counter("upstream_first_arrivals_total", "Lines which arrived first from each APRS-IS server", ["upstream"])
+METRIC_MISSED = REGISTRY.counter("upstream_missed_total", "Lines received from other servers but not this one, while connected", ["upstream"])
+METRIC_CONNECTS = REGISTRY.counter("upstream_connects_total", "Successful connections to each APRS-IS server", ["upstream"])
+METRIC_LAG = REGISTRY.histogram(
+    "upstream_lag_seconds",
+    "Delay of duplicate lines behind the first arrival, for each APRS-IS server",
+    ["upstream"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+
+
+def parse_servers(servers, default_port=14580):
+    """ Parse a comma separated list of host[:port] into a list of (host, port). """
+    _servers = []
+    for _server in servers.split(","):
+        _server = _server.strip()
+        if not _server:
+            continue
+        (_host, _sep, _port) = _server.partition(":")
+        _servers.append((_host, int(_port) if _port else default_port))
+    return _servers
+
+
+class Upstream(object):
+    """ A connection to a single APRS-IS server, reconnecting with backoff. """
+
+    def __init__(self, fan_in, index, host, port):
+        self.fan_in = fan_in
+        self.index = index
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.client = None
+        self.connected = False
+
+        self.lines = 0
+        self.first_arrivals = 0
+        self.missed = 0
+        self.connects = 0
+        self.failures = 0
+        self.lag_total = 0.0
+        self.lag_count = 0
+
+    async def run(self):
+        _failures = 0
+        while self.fan_in.running:
+            _connected_at = None
+            self.client = APRSISClient(
+                self.fan_in.callsign,
+                self.host,
+                self.port,
+                filter=self.fan_in.filter,
+                passcode=self.fan_in.passcode,
+                software_version=self.fan_in.software_version,
+                keepalive_timeout=self.fan_in.keepalive_timeout
+            )
+            try:
+                await self.client.connect()
+                _connected_at = time.monotonic()
+                self.connected = True
+                self.connects += 1
+                METRIC_CONNECTS.inc(self.name)
+                logging.info(f"Connected to APRS-IS server {self.name} ({self.client.server})")
+                async for _line in self.client.lines_received():
+                    self.lines += 1
+                    METRIC_LINES.inc(self.name)
+                    self.fan_in._on_line(self, _line)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if self.fan_in.running:
+                    logging.warning(f"APRS-IS server {self.name}: {type(e).__name__}: {e}")
+            finally:
+                self.connected = False
+                await self.client.close()
+
+            if not self.fan_in.running:
+                break
+
+            # Back off on repeated failures, unless the connection had been up for a while.
+            self.failures += 1
+            if _connected_at is not None and time.monotonic() - _connected_at > self.fan_in.max_backoff:
+                _failures = 0
+            _delay = min(self.fan_in.max_backoff, self.fan_in.backoff * 2 ** _failures) * random.uniform(0.5, 1.0)
+            _failures += 1
+            logging.info(f"Reconnecting to APRS-IS server {self.name} in {_delay:.1f} seconds")
+            await asyncio.sleep(_delay)
+
+    def stats(self):
+        return {
+            "connected": self.connected,
+            "lines": self.lines,
+            "first_arrivals": self.first_arrivals,
+            "missed": self.missed,
+            "mean_lag": self.lag_total / self.lag_count if self.lag_count else None,
+            "connects": self.connects,
+            "failures": self.failures,
+        }
+
+
+class FanIn(object):
+    """
+    Connections to several APRS-IS servers, merged into a single stream of
+    unique lines. Provides the parts of the aprslib.IS interface used by the
+    gateway (set_filter, sendall).
+    """
+
+    def __init__(self, servers, callsign, callback, filter="", window=30, backoff=1, max_backoff=120, keepalive_timeout=60, software_version="local"):
+        """
+        servers: List of (host, port).
+        callsign: Callsign to log in with.
+        callback: Function called with each unique raw line, from the event loop thread. It must
+                  not block (e.g. on network requests), or it will hold up every connection.
+        filter: Initial server-side filter.
+        window: Time (seconds) for which lines are remembered, to detect copies from other servers.
+                0 passes on every line (e.g. for the load test, which repeats lines).
+        backoff: Initial delay (seconds) before reconnecting after a failure. Doubles with each failure.
+        max_backoff: Maximum delay (seconds) before reconnecting.
+        keepalive_timeout: Time (seconds) without receiving anything from a server before reconnecting.
+        software_version: Software version sent when logging in.
+        """
+        self.callsign = callsign
+        self.passcode = aprslib.passcode(callsign)
+        self.callback = callback
+        self.filter = filter
+        self.window = window
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.keepalive_timeout = keepalive_timeout
+        self.software_version = software_version
+        self.upstreams = [Upstream(self, _index, _host, _port) for _index, (_host, _port) in enumerate(servers)]
+        self.running = False
+
+        self.duplicates = 0
+        # digest -> [first arrival time, bitmask of upstreams the line has arrived from]
+        self._seen = OrderedDict()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._tasks = []
+        self._thread = None
+
+    def start(self):
+        self.running = True
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="upstream", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._tasks = [self._loop.create_task(_upstream.run()) for _upstream in self.upstreams]
+        try:
+            self._loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+        finally:
+            self._loop.close()
+
+    def stop(self):
+        self.running = False
+        if self._loop is None:
+            return
+        for _task in self._tasks:
+            try:
+                self._loop.call_soon_threadsafe(_task.cancel)
+            except RuntimeError:
+                # Loop already closed
+                pass
+
+    def join(self, timeout=None):
+        if self._thread:
+            self._thread.join(timeout)
+
+    def _call(self, coroutine, timeout=None):
+        """ Run a coroutine on the event loop from another thread, optionally waiting for its result. """
+        if self._loop is None or self._loop.is_closed():
+            coroutine.close()
+            raise ConnectionError("Not connected to any APRS-IS server")
+        _future = asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+        if timeout is not None:
+            return _future.result(timeout)
+        _future.add_done_callback(self._log_error)
+
+    @staticmethod
+    def _log_error(future):
+        if not future.cancelled() and future.exception() is not None:
+            logging.warning(f"APRS-IS error: {future.exception()}")
+
+    def _on_line(self, upstream, line):
+        if self.window <= 0:
+            upstream.first_arrivals += 1
+            METRIC_FIRST.inc(upstream.name)
+            self.callback(line)
+            return
+
+        _key = packet_digest(bytes(line))
+        _bit = 1 << upstream.index
+        _now = time.monotonic()
+        with self._lock:
+            self._expire(_now)
+            _entry = self._seen.get(_key)
+            if _entry is None:
+                self._seen[_key] = [_now, _bit]
+                upstream.first_arrivals += 1
+            else:
+                _entry[1] |= _bit
+                self.duplicates += 1
+                _lag = _now - _entry[0]
+                upstream.lag_total += _lag
+                upstream.lag_count += 1
+
+        if _entry is None:
+            METRIC_FIRST.inc(upstream.name)
+            self.callback(line)
+        else:
+            METRIC_LAG.observe(_lag, upstream.name)
+
+    def _expire(self, now):
+        """ Forget lines older than the window, counting them as missed by any connected upstream that did not receive them. """
+        _cutoff = now - self.window
+        _all = (1 << len(self.upstreams)) - 1
+        while self._seen:
+            _key, (_time, _mask) = next(iter(self._seen.items()))
+            if _time >= _cutoff:
+                break
+            del self._seen[_key]
+            if _mask != _all and len(self.upstreams) > 1:
+                for _upstream in self.upstreams:
+                    if not _mask & (1 << _upstream.index) and _upstream.connected:
+                        _upstream.missed += 1
+                        METRIC_MISSED.inc(_upstream.name)
+
+    def set_filter(self, filter_text):
+        """ Set the server-side filter on all connections. Does not wait for it to be sent. """
+        self.filter = filter_text
+        if self._loop is not None:
+            self._call(self._set_filter(filter_text))
+
+    async def _set_filter(self, filter_text):
+        for _upstream in self.upstreams:
+            if _upstream.client is None:
+                continue
+            try:
+                await _upstream.client.set_filter(filter_text)
+            except Exception as e:
+                logging.warning(f"Error setting filter on APRS-IS server {_upstream.name}: {e}")
+
+    def sendall(self, line, timeout=10):
+        """ Send a line to APRS-IS, via the first connected server. Raises ConnectionError if it could not be sent. """
+        self._call(self._send(line), timeout)
+
+    async def _send(self, line):
+        for _upstream in self.upstreams:
+            if not _upstream.connected:
+                continue
+            try:
+                await _upstream.client.send(line)
+                return
+            except Exception as e:
+                logging.warning(f"Error sending to APRS-IS server {_upstream.name}: {e}")
+        raise ConnectionError("Not connected to any APRS-IS server")
+
+    def stats(self):
+        return {
+            "duplicates": self.duplicates,
+            "remembered": len(self._seen),
+            "upstreams": {_upstream.name: _upstream.stats() for _upstream in self.upstreams},
+        }